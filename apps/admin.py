@@ -7,6 +7,7 @@ import click
 from core.auth import auth_manager, UserRole
 from core.audit import audit_logger, AuditEventType
 from core.logging import logger
+from core.serialization import loads
 
 @click.group()
 def admin():
@@ -109,8 +110,7 @@ def audit_log(lines: int):
         
         for line in recent_lines:
             try:
-                import json
-                event = json.loads(line.strip())
+                event = loads(line)
                 timestamp = datetime.datetime.fromtimestamp(event['timestamp']).strftime("%Y-%m-%d %H:%M:%S")
                 event_type = event['event_type']
                 user_id = event.get('user_id', 'unknown')
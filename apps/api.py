@@ -1,15 +1,17 @@
 from fastapi import FastAPI, Depends, HTTPException, Request
 from fastapi.security import HTTPBearer
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
 import time
-from index.embedder import embed_texts
+from index.embedder import embed_query
 from core.auth import get_current_user, get_admin_user, User
 from core.audit import audit_logger, AuditEventType
-from rag.retriever import vector_search
+from rag.retriever import vector_search, is_empty_query
 from rag.context_builder import hydrate_matches, build_context
-from rag.generator import answer
+from state.db import engine, log_retrieval
+from rag.generator import answer, answer_stream
 from rag.reranker import rerank, is_rerank_available
 from search.hybrid import hybrid_search, is_available as typesense_available
 from core.logging import logger
@@ -72,6 +74,7 @@ class QueryRequest(BaseModel):
     k: Optional[int] = 12
     hybrid: Optional[bool] = False
     rerank: Optional[bool] = False
+    namespace: Optional[str] = None
 
 class QueryResponse(BaseModel):
     answer: str
@@ -126,61 +129,95 @@ def metrics():
         "timestamp": time.time()
     }
 
-@app.post("/query", response_model=QueryResponse)
-def query(request: QueryRequest, user: User = Depends(get_current_user)):
-    """Query the knowledge base with optional hybrid search and reranking"""
-    try:
-        # Embed the query
-        vec = embed_texts([request.q])[0]
-        
-        # Search for relevant chunks
-        best_score = 0.0
-        if request.hybrid and typesense_available():
-            matches, best_score = hybrid_search(request.q, vec, top_k=request.k)
-            search_type = "hybrid"
-        else:
-            # Oversample for potential reranking
-            search_k = request.k * 2 if request.rerank else request.k
-            matches, best_score = vector_search(vec, top_k=search_k)
-            search_type = "vector"
-        
+def _build_pack(request: QueryRequest) -> tuple:
+    """Retrieve, rerank, expand and ground; returns (context pack, search type, source count, query vector)"""
+    # Embed the query (coalesced with concurrent requests)
+    vec = embed_query(request.q)
+    
+    # Search for relevant chunks
+    best_score = 0.0
+    if request.hybrid and typesense_available():
+        matches, best_score = hybrid_search(request.q, vec, k=request.k, namespace=request.namespace)
+        search_type = "hybrid"
+    else:
+        # Oversample for potential reranking
+        search_k = request.k * 2 if request.rerank else request.k
+        matches, best_score = vector_search(vec, top_k=search_k, namespace=request.namespace)
+        search_type = "vector"
+    
+    # Hydration and neighbor expansion share one pooled connection
+    with engine.connect() as conn:
         # Hydrate matches with full text
-        snippets = hydrate_matches(matches)
-        
+        snippets = hydrate_matches(matches, conn=conn)
+    
         # Optional reranking
+        expand_top_n = None
         if request.rerank and is_rerank_available() and snippets:
             snippets = rerank(request.q, snippets)
             snippets = snippets[:request.k]  # Trim to final k
             search_type += "+rerank"
-        
+            expand_top_n = max(1, request.k // 2)  # Only widen the reranker's best picks
+    
         # Late windowing - expand with neighboring chunks
         from rag.context_builder import expand_with_neighbors
-        snippets = expand_with_neighbors(snippets, left=1, right=1, max_chars=12000)
-        
-        # Google grounding fallback
-        external_snippets = []
-        from core.config import is_grounding_enabled, grounding_threshold, max_google_results
-        from gcp.search import google_ground, should_use_grounding
-        
-        if is_grounding_enabled() and should_use_grounding(best_score, len(snippets), request.k):
-            try:
-                external_snippets = google_ground(request.q, max_results=max_google_results())
-                if external_snippets:
-                    logger.info(f"API Grounding: added {len(external_snippets)} Google snippets")
-                    search_type += "+grounding"
-            except Exception as e:
-                logger.warning(f"API Grounding failed: {e}")
-        
-        # Build context pack (local + external)
-        from rag.context_builder import build_combined_context
-        pack = build_combined_context(snippets, external_snippets)
+        snippets = expand_with_neighbors(snippets, left=1, right=1, max_chars=12000, top_n=expand_top_n, conn=conn)
+    
+    # Queued for the background writer, so logging adds no DB write here
+    log_retrieval(
+        request.q,
+        candidate_ids=[m["id"] for m in matches],
+        chosen_ids=[s["id"] for s in snippets],
+        scores=[m.get("score") or 0.0 for m in matches],
+        filters={"namespace": request.namespace, "search_type": search_type},
+    )
+    
+    # Google grounding fallback
+    external_snippets = []
+    from core.config import is_grounding_enabled, grounding_threshold, max_google_results
+    from gcp.search import google_ground, should_use_grounding
+    
+    if is_grounding_enabled() and should_use_grounding(best_score, len(snippets), request.k):
+        try:
+            external_snippets = google_ground(request.q, max_results=max_google_results())
+            if external_snippets:
+                logger.info(f"API Grounding: added {len(external_snippets)} Google snippets")
+                search_type += "+grounding"
+        except Exception as e:
+            logger.warning(f"API Grounding failed: {e}")
+    
+    # Build context pack (local + external)
+    from rag.context_builder import build_combined_context
+    pack = build_combined_context(snippets, external_snippets)
+    return pack, search_type, len(snippets) + len(external_snippets), vec
+
+
+NO_CONTEXT_ANSWER = "I don't have enough context to answer this question. Please make sure documents have been ingested and indexed."
+EMPTY_QUERY_ANSWER = "Please ask a question about your documents."
+
+
+@app.post("/query", response_model=QueryResponse)
+def query(request: QueryRequest, user: User = Depends(get_current_user)):
+    """Query the knowledge base with optional hybrid search and reranking"""
+    # Blank queries never reach the embedder or the index
+    if is_empty_query(request.q):
+        return QueryResponse(
+            answer=EMPTY_QUERY_ANSWER,
+            k=request.k,
+            hybrid=request.hybrid,
+            rerank=request.rerank,
+            search_type="empty",
+            sources_count=0
+        )
+    
+    try:
+        pack, search_type, sources_count, vec = _build_pack(request)
         
         # Generate answer
         if pack.strip():
-            ans = answer(request.q, pack)
-            logger.info(f"API query processed ({search_type}): {len(snippets)} sources")
+            ans = answer(request.q, pack, query_vec=vec)
+            logger.info(f"API query processed ({search_type}): {sources_count} sources")
         else:
-            ans = "I don't have enough context to answer this question. Please make sure documents have been ingested and indexed."
+            ans = NO_CONTEXT_ANSWER
         
         return QueryResponse(
             answer=ans,
@@ -188,7 +225,7 @@ def query(request: QueryRequest, user: User = Depends(get_current_user)):
             hybrid=request.hybrid,
             rerank=request.rerank,
             search_type=search_type,
-            sources_count=len(snippets) + len(external_snippets)
+            sources_count=sources_count
         )
         
     except Exception as e:
@@ -202,6 +239,33 @@ def query(request: QueryRequest, user: User = Depends(get_current_user)):
             sources_count=0
         )
 
+@app.post("/query/stream")
+def query_stream(request: QueryRequest, user: User = Depends(get_current_user)):
+    """Like /query, but streams the answer as plain text while it is generated
+    
+    Retrieval metadata is sent up front in the X-Search-Type and
+    X-Sources-Count headers, so clients can render the first tokens at once.
+    """
+    if is_empty_query(request.q):
+        return StreamingResponse(iter([EMPTY_QUERY_ANSWER]), media_type="text/plain; charset=utf-8",
+                                 headers={"X-Search-Type": "empty", "X-Sources-Count": "0"})
+    
+    try:
+        pack, search_type, sources_count, vec = _build_pack(request)
+    except Exception as e:
+        logger.error(f"API streaming query failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Query failed: {e}")
+    
+    if pack.strip():
+        body = answer_stream(request.q, pack, query_vec=vec)
+    else:
+        body = iter([NO_CONTEXT_ANSWER])
+    return StreamingResponse(
+        body,
+        media_type="text/plain; charset=utf-8",
+        headers={"X-Search-Type": search_type, "X-Sources-Count": str(sources_count)},
+    )
+
 # Legacy endpoint for backward compatibility
 @app.post("/query_legacy")
 def query_legacy(payload: dict):
@@ -1,14 +1,18 @@
 from __future__ import annotations
 import argparse
 import os
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Callable
 from core.logging import logger
 from ingest.pipeline import ingest_path
 from index.upsert import build_and_upsert
-from index.embedder import embed_texts
-from rag.retriever import vector_search
-from rag.context_builder import hydrate_matches, build_context
-from rag.generator import answer
-from rag.reranker import rerank, is_rerank_available
+from index.embedder import embed_query
+from rag.retriever import vector_search, is_empty_query
+from rag.context_builder import hydrate_matches, build_combined_context, expand_with_neighbors
+from state.db import engine
+from rag.generator import answer_stream
+from rag.reranker import rerank as rerank_snippets, is_rerank_available
 from search.hybrid import index_typesense, hybrid_search, is_available as typesense_available
 
 
@@ -17,9 +21,9 @@ def cmd_ingest(path: str):
     logger.info(f"Ingested documents={res['documents']} chunks={res['chunks']}")
 
 
-def cmd_index():
+def cmd_index(namespace: str | None = None):
     # Index to Pinecone
-    res = build_and_upsert()
+    res = build_and_upsert(namespace=namespace)
     logger.info(f"Upserted {res['upserts']} vectors to namespace={res['namespace']}")
     
     # Index to Typesense
@@ -30,37 +34,66 @@ def cmd_index():
         logger.info(f"Indexed {typesense_res['indexed']} chunks to Typesense")
 
 
-def cmd_ask(q: str, k: int = 12, hybrid: bool = False, rerank: bool = False):
+@dataclass
+class Deps:
+    """Pipeline stages used by cmd_ask; tests pass their own callables instead of patching modules"""
+    embed: Callable = embed_query
+    vector_search: Callable = vector_search
+    hybrid_search: Callable = hybrid_search
+    typesense_available: Callable = typesense_available
+    hydrate: Callable = hydrate_matches
+    rerank: Callable = rerank_snippets
+    rerank_available: Callable = is_rerank_available
+    expand: Callable = expand_with_neighbors
+    build_context: Callable = build_combined_context
+    answer: Callable = answer_stream
+    connect: Callable = engine.connect
+
+
+def cmd_ask(q: str, k: int = 12, hybrid: bool = False, rerank: bool = False, namespace: str | None = None,
+            deps: Deps | None = None):
     from core.config import is_grounding_enabled, grounding_threshold, max_google_results
-    from rag.context_builder import build_combined_context
     from gcp.search import google_ground, should_use_grounding
     
-    # Embed query
-    vec = embed_texts([q])[0]
+    deps = deps or Deps()
+    
+    # Nothing to retrieve for a blank query; skip the embedding call and search
+    if is_empty_query(q):
+        print("\n=== ANSWER (empty) ===")
+        print("Please ask a question about your documents.\n")
+        return
+    
+    # Embed query (coalesced with concurrent asks in this process)
+    vec = deps.embed(q)
     
     # Search for relevant chunks
     best_score = 0.0
-    if hybrid and typesense_available():
-        matches, best_score = hybrid_search(q, vec, top_k=k)
+    if hybrid and deps.typesense_available():
+        matches, best_score = deps.hybrid_search(q, vec, k=k, namespace=namespace)
         search_type = "hybrid"
     else:
         # Oversample for potential reranking
         search_k = k * 2 if rerank else k
-        matches, best_score = vector_search(vec, top_k=search_k)
+        matches, best_score = deps.vector_search(vec, top_k=search_k, namespace=namespace)
         search_type = "vector"
     
-    # Hydrate matches with full text
-    snippets = hydrate_matches(matches)
+    # Hydration and neighbor expansion share one pooled connection, opened only
+    # when one of them is the real database-backed stage
+    uses_db = deps.hydrate is hydrate_matches or deps.expand is expand_with_neighbors
+    with deps.connect() if uses_db else nullcontext() as conn:
+        # Hydrate matches with full text
+        snippets = deps.hydrate(matches, conn=conn)
     
-    # Optional reranking
-    if rerank and is_rerank_available() and snippets:
-        snippets = rerank(q, snippets)
-        snippets = snippets[:k]  # Trim to final k
-        search_type += "+rerank"
+        # Optional reranking
+        expand_top_n = None
+        if rerank and deps.rerank_available() and snippets:
+            snippets = deps.rerank(q, snippets)
+            snippets = snippets[:k]  # Trim to final k
+            search_type += "+rerank"
+            expand_top_n = max(1, k // 2)  # Only widen the reranker's best picks
     
-    # Late windowing - expand with neighboring chunks
-    from rag.context_builder import expand_with_neighbors
-    snippets = expand_with_neighbors(snippets, left=1, right=1, max_chars=12000)
+        # Late windowing - expand with neighboring chunks
+        snippets = deps.expand(snippets, left=1, right=1, max_chars=12000, top_n=expand_top_n, conn=conn)
     
     # Google grounding fallback
     external_snippets = []
@@ -78,18 +111,20 @@ def cmd_ask(q: str, k: int = 12, hybrid: bool = False, rerank: bool = False):
         logger.info("Grounding: local only")
     
     # Build context pack (local + external)
-    pack = build_combined_context(snippets, external_snippets)
+    pack = deps.build_context(snippets, external_snippets)
     
-    # Generate answer
+    # Generate answer, printing tokens as they arrive
+    print(f"\n=== ANSWER ({search_type}) ===")
     if pack.strip():
-        ans = answer(q, pack)
+        for delta in deps.answer(q, pack, query_vec=vec):
+            print(delta, end="", flush=True)
+        print("\n")
         total_sources = len(snippets) + len(external_snippets)
         logger.info(f"Query processed ({search_type}): {len(snippets)} local + {len(external_snippets)} external sources")
     else:
         ans = "I don't have enough context to answer this question. Please make sure you have ingested and indexed some documents first."
         total_sources = 0
-    
-    print(f"\n=== ANSWER ({search_type}) ===\n{ans}\n")
+        print(f"{ans}\n")
     
     if snippets:
         print(f"📚 Local Sources: {len(snippets)} chunks")
@@ -107,6 +142,7 @@ def main():
     
     # Index command  
     px = sub.add_parser("index", help="Build vector and keyword indexes")
+    px.add_argument("--namespace", help="Pinecone namespace (default: PINECONE_NAMESPACE)")
     
     # Ask command
     pa = sub.add_parser("ask", help="Ask questions about your documents")
@@ -114,6 +150,7 @@ def main():
     pa.add_argument("--k", type=int, default=12, help="Number of results to retrieve (default: 12)")
     pa.add_argument("--hybrid", action="store_true", help="Use hybrid search (vector + keyword)")
     pa.add_argument("--rerank", action="store_true", help="Use reranking for better results")
+    pa.add_argument("--namespace", help="Pinecone namespace (default: PINECONE_NAMESPACE)")
     
     # Snap command
     ps = sub.add_parser("snap", help="Capture webpage screenshot into data/inputs/")
@@ -124,9 +161,9 @@ def main():
     if args.cmd == "ingest":
         cmd_ingest(args.path)
     elif args.cmd == "index":
-        cmd_index()
+        cmd_index(args.namespace)
     elif args.cmd == "ask":
-        cmd_ask(args.q, args.k, args.hybrid, args.rerank)
+        cmd_ask(args.q, args.k, args.hybrid, args.rerank, args.namespace)
     elif args.cmd == "snap":
         cmd_snap(args.url)
     else:
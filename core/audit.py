@@ -4,12 +4,12 @@ Audit logging for Vectorpenter security and compliance
 
 from __future__ import annotations
 import time
-import json
 from typing import Dict, Any, Optional
 from dataclasses import dataclass, asdict
 from enum import Enum
 from pathlib import Path
 from core.logging import logger
+from core.serialization import dumps_bytes
 
 class AuditEventType(str, Enum):
     """Types of audit events"""
@@ -68,10 +68,9 @@ class AuditLogger:
                 }
             )
             
-            # Also log to dedicated audit file
-            with open(self.log_file, "a", encoding="utf-8") as f:
-                audit_line = json.dumps(event.to_dict()) + "\n"
-                f.write(audit_line)
+            # Also log to dedicated audit file (serialized straight to UTF-8 bytes)
+            with open(self.log_file, "ab") as f:
+                f.write(dumps_bytes(event.to_dict()) + b"\n")
                 
         except Exception as e:
             logger.error(f"Failed to write audit log: {e}")
@@ -3,7 +3,6 @@ Caching layer for Vectorpenter to improve performance
 """
 
 import hashlib
-import json
 import time
 import threading
 from functools import wraps, lru_cache
@@ -11,7 +10,9 @@ from typing import Any, Dict, List, Optional, Callable, Union
 from dataclasses import dataclass
 from collections import OrderedDict
 
+from core.config import settings
 from core.logging import logger
+from core.serialization import dumps_bytes
 
 
 @dataclass
@@ -50,8 +51,7 @@ class LRUCache:
             'args': args,
             'kwargs': sorted(kwargs.items())
         }
-        key_str = json.dumps(key_data, sort_keys=True, default=str)
-        return hashlib.md5(key_str.encode()).hexdigest()
+        return hashlib.md5(dumps_bytes(key_data, sort_keys=True)).hexdigest()
     
     def get(self, key: str) -> Optional[Any]:
         """Get value from cache"""
@@ -73,12 +73,14 @@ class LRUCache:
             return entry.value
     
     def put(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
-        """Put value in cache"""
+        """Put value in cache; a max_size of 0 or less disables caching"""
+        if self.max_size <= 0:
+            return
         with self._lock:
-            # Remove oldest entries if at capacity
-            while len(self._cache) >= self.max_size:
-                oldest_key = next(iter(self._cache))
-                del self._cache[oldest_key]
+            # Remove oldest entries if at capacity, unless key already has a slot
+            if key not in self._cache:
+                while len(self._cache) >= self.max_size:
+                    self._cache.popitem(last=False)
             
             # Create cache entry
             entry = CacheEntry(
@@ -146,30 +148,53 @@ class LRUCache:
 embedding_cache = LRUCache(max_size=5000, default_ttl=3600)  # 1 hour TTL
 search_results_cache = LRUCache(max_size=1000, default_ttl=300)  # 5 minute TTL
 context_cache = LRUCache(max_size=500, default_ttl=600)  # 10 minute TTL
+# chunk id -> (doc, seq, text); re-ingest deletes a document's ids, and the TTL
+# bounds staleness when another process did the ingest
+chunk_cache = LRUCache(max_size=settings.hydrate_cache_size, default_ttl=600)
+# (model, query, documents) -> Voyage ranking as [(document index, score)];
+# keyed on the texts themselves so a re-ingested chunk is never served stale
+rerank_cache = LRUCache(max_size=512, default_ttl=600)
+# (index, namespace, top_k, query vector) -> Pinecone matches; cleared whenever
+# this process upserts, and the TTL bounds staleness for other writers
+vector_search_cache = LRUCache(max_size=4096, default_ttl=settings.vector_cache_ttl_seconds)
 
 
-def cache_embeddings(ttl: Optional[float] = None):
-    """Decorator to cache embedding results"""
+def cache_embeddings(ttl: Optional[float] = None, model: str = ""):
+    """Decorator to cache embedding results per text, keyed by (model, text)
+    
+    Caching per text rather than per batch lets a question that was already
+    embedded on its own (or inside a larger batch) reuse its vector.
+    """
     def decorator(func: Callable) -> Callable:
         @wraps(func)
         def wrapper(texts: List[str], *args, **kwargs):
-            # Create cache key from texts
-            cache_key = embedding_cache._make_key(texts, *args, **kwargs)
+            # The embedder drops blank texts, which would misalign per-text
+            # results, so such batches bypass the cache entirely
+            if args or kwargs or not all(isinstance(t, str) and t.strip() for t in texts):
+                return func(texts, *args, **kwargs)
             
-            # Try to get from cache
-            cached_result = embedding_cache.get(cache_key)
-            if cached_result is not None:
+            keys = [embedding_cache._make_key(model, text) for text in texts]
+            vectors = [embedding_cache.get(key) for key in keys]
+            
+            # Collect unique misses so duplicates in a batch are embedded once
+            missing: Dict[str, str] = {}
+            for key, text, vector in zip(keys, texts, vectors):
+                if vector is None:
+                    missing.setdefault(key, text)
+            
+            if not missing:
                 logger.debug(f"Cache hit for embedding batch of {len(texts)} texts")
-                return cached_result
+                return vectors
             
-            # Cache miss - call original function
-            logger.debug(f"Cache miss for embedding batch of {len(texts)} texts")
-            result = func(texts, *args, **kwargs)
+            # Cache miss - embed only the texts we don't have yet
+            logger.debug(f"Cache miss for {len(missing)}/{len(texts)} embedding texts")
+            fresh = dict(zip(missing, func(list(missing.values()))))
             
             # Store in cache
-            embedding_cache.put(cache_key, result, ttl)
+            for key, vector in fresh.items():
+                embedding_cache.put(key, vector, ttl)
             
-            return result
+            return [vector if vector is not None else fresh[key] for key, vector in zip(keys, vectors)]
         
         return wrapper
     return decorator
@@ -180,8 +205,9 @@ def cache_search_results(ttl: Optional[float] = None):
     def decorator(func: Callable) -> Callable:
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # Create cache key
-            cache_key = search_results_cache._make_key(*args, **kwargs)
+            # Create cache key; the function name keeps different searches
+            # with the same arguments apart in the shared cache
+            cache_key = search_results_cache._make_key(func.__qualname__, *args, **kwargs)
             
             # Try to get from cache
             cached_result = search_results_cache.get(cache_key)
@@ -348,6 +374,7 @@ def get_cache_stats() -> Dict[str, Any]:
     return {
         "embedding_cache": embedding_cache.stats(),
         "search_results_cache": search_results_cache.stats(),
+        "vector_search_cache": vector_search_cache.stats(),
         "context_cache": context_cache.stats(),
         "timestamp": time.time()
     }
@@ -9,6 +9,8 @@ load_dotenv()
 class Settings:
     # LLM and embedding APIs
     openai_api_key: str | None = os.getenv("OPENAI_API_KEY")
+    # Texts per embeddings request; OpenAI accepts at most 2048 inputs per call
+    embed_batch_size: int = int(os.getenv("EMBED_BATCH_SIZE", "256"))
     voyage_api_key: str | None = os.getenv("VOYAGE_API_KEY")
     
     # Vector database (Pinecone)
@@ -17,6 +19,11 @@ class Settings:
     pinecone_cloud: str = os.getenv("PINECONE_CLOUD", "gcp")
     pinecone_region: str = os.getenv("PINECONE_REGION", "us-central1")
     pinecone_namespace: str = os.getenv("PINECONE_NAMESPACE", "default")
+    # Use the gRPC transport when pinecone-client[grpc] is installed
+    pinecone_grpc: bool = os.getenv("PINECONE_GRPC", "true").lower() == "true"
+    # Format of the local vector copy used to re-index unchanged chunks:
+    # "float16" or "int8" (half the size again, approximate on re-upsert)
+    vector_quantization: str = os.getenv("VECTOR_QUANTIZATION", "float16")
     
     # Local state database
     db_url: str = os.getenv("DB_URL", "sqlite:///./data/vectorpenter.db")
@@ -27,6 +34,7 @@ class Settings:
     typesense_port: int = int(os.getenv("TYPESENSE_PORT", "8108"))
     typesense_protocol: str = os.getenv("TYPESENSE_PROTOCOL", "http")
     typesense_collection: str = os.getenv("TYPESENSE_COLLECTION", "vectorpenter_chunks")
+    typesense_ingest_workers: int = int(os.getenv("TYPESENSE_INGEST_WORKERS", "8"))
     
     # GCP / Document AI (optional)
     google_application_credentials: str | None = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
@@ -35,6 +43,12 @@ class Settings:
     use_google_doc_ai: bool = os.getenv("USE_GOOGLE_DOC_AI", "false").lower() == "true"
     doc_ai_processor_id: str | None = os.getenv("DOC_AI_PROCESSOR_ID")
     
+    # Chat completions may go to any OpenAI-compatible server (e.g. vLLM, which
+    # batches concurrent requests continuously and, with chunked prefill, keeps
+    # a long context pack from stalling other decodes); embeddings stay on OpenAI
+    chat_base_url: str | None = os.getenv("CHAT_BASE_URL")
+    chat_api_key: str | None = os.getenv("CHAT_API_KEY")
+    
     # Vertex Chat (optional) - embeddings stay OpenAI
     use_vertex_chat: bool = os.getenv("USE_VERTEX_CHAT", "false").lower() == "true"
     vertex_chat_model: str = os.getenv("VERTEX_CHAT_MODEL", "gemini-1.5-pro")
@@ -46,6 +60,42 @@ class Settings:
     max_google_results: int = int(os.getenv("MAX_GOOGLE_RESULTS", "3"))
     grounding_sim_threshold: float = float(os.getenv("GROUNDING_SIM_THRESHOLD", "0.18"))
     
+    # Rerank short-circuit: skip the rerank call when the top vector hit is unambiguous
+    rerank_skip_score: float = float(os.getenv("RERANK_SKIP_SCORE", "0.92"))
+    rerank_skip_gap: float = float(os.getenv("RERANK_SKIP_GAP", "0.1"))
+    
+    # Conversation memory: per-thread cap on stored messages and approximate tokens
+    chat_max_turns: int = int(os.getenv("CHAT_MAX_TURNS", "200"))
+    chat_max_tokens: int = int(os.getenv("CHAT_MAX_TOKENS", "32000"))
+    # ...and on how many threads are kept and how long an idle one lives
+    chat_max_threads: int = int(os.getenv("CHAT_MAX_THREADS", "10000"))
+    chat_thread_ttl_seconds: float = float(os.getenv("CHAT_THREAD_TTL_SECONDS", "3600"))
+    # History beyond this many tokens is folded into a rolling summary before prompting
+    chat_history_token_budget: int = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "6000"))
+    
+    # Queries shorter than this (after stripping) are answered without embedding
+    # or searching; whitespace-only queries are always skipped
+    min_query_chars: int = int(os.getenv("MIN_QUERY_CHARS", "1"))
+    
+    # Keep query embeddings in the state database so repeat questions skip the
+    # embedding call across CLI runs and API restarts, not just within one
+    persist_query_embeddings: bool = os.getenv("PERSIST_QUERY_EMBEDDINGS", "true").lower() == "true"
+    # Stored query embeddings older than this are ignored and pruned on write
+    query_embeddings_retention_days: float = float(os.getenv("QUERY_EMBEDDINGS_RETENTION_DAYS", "30"))
+    
+    # Pinecone results for repeated query vectors are reused for this long;
+    # 0 disables the cache
+    vector_cache_ttl_seconds: float = float(os.getenv("VECTOR_CACHE_TTL_SECONDS", "300"))
+    
+    # Hydrated chunk bodies kept in process; hot chunks recur across queries (0 disables)
+    hydrate_cache_size: int = int(os.getenv("HYDRATE_CACHE_SIZE", "20000"))
+    
+    # Generated answers: LRU size, lifetime, and the query similarity at which a
+    # rephrased question against the same context reuses a cached answer
+    answer_cache_size: int = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+    answer_cache_ttl_seconds: float = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+    answer_cache_similarity: float = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.97"))
+    
     # Translation (optional)
     use_translation: bool = os.getenv("USE_TRANSLATION", "false").lower() == "true"
     translate_target_lang: str = os.getenv("TRANSLATE_TARGET_LANG", "en")
@@ -120,6 +170,14 @@ def grounding_threshold() -> float:
     """Get grounding similarity threshold"""
     return settings.grounding_sim_threshold
 
+def rerank_skip_score() -> float:
+    """Get the top-1 score above which reranking may be skipped"""
+    return settings.rerank_skip_score
+
+def rerank_skip_gap() -> float:
+    """Get the minimum #1 - #2 score gap required to skip reranking"""
+    return settings.rerank_skip_gap
+
 def max_google_results() -> int:
     """Get maximum Google search results"""
     return settings.max_google_results
@@ -0,0 +1,37 @@
+"""
+Compact JSON serialization for Vectorpenter hot paths
+Uses orjson when installed and falls back to the stdlib json module
+"""
+
+from __future__ import annotations
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+def dumps_bytes(obj: Any, sort_keys: bool = False) -> bytes:
+    """Serialize to compact UTF-8 JSON bytes (non-JSON values fall back to str)"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=str, option=option)
+    return json.dumps(
+        obj, sort_keys=sort_keys, default=str, separators=(",", ":"), ensure_ascii=False
+    ).encode("utf-8")
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> str:
+    """Serialize to a compact JSON string"""
+    return dumps_bytes(obj, sort_keys=sort_keys).decode("utf-8")
+
+
+def loads(data: str | bytes) -> Any:
+    """Parse JSON from str or bytes"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
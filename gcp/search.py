@@ -6,9 +6,14 @@ Fallback when local retrieval is weak
 from __future__ import annotations
 from typing import List, Dict, Any
 import requests
+from core.cache import cache_search_results
 from core.config import settings
 from core.logging import logger
 
+# One session per process keeps the HTTPS connection to googleapis.com alive,
+# so only the first grounding call pays for the TCP and TLS handshakes
+_session = requests.Session()
+
 def google_ground(query: str, max_results: int = 3) -> List[Dict[str, Any]]:
     """
     Search Google for grounding information when local retrieval is weak
@@ -26,53 +31,62 @@ def google_ground(query: str, max_results: int = 3) -> List[Dict[str, Any]]:
             logger.warning("Google Search API key or CX not configured")
             return []
         
-        # Prepare search parameters
-        url = "https://www.googleapis.com/customsearch/v1"
-        params = {
-            "key": settings.google_search_api_key,
-            "cx": settings.google_search_cx,
-            "q": query,
-            "num": min(max_results, 10),  # Google CSE max is 10
-            "safe": "off",
-            "fields": "items(title,link,snippet)"
-        }
-        
         logger.debug(f"Performing Google search: {query} (max_results={max_results})")
-        
-        # Make the search request
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
-        items = data.get("items", [])
-        
-        # Format results
-        results = []
-        for item in items[:max_results]:
-            result = {
-                "title": item.get("title", ""),
-                "link": item.get("link", ""),
-                "snippet": item.get("snippet", "")
-            }
-            
-            # Only include results with meaningful content
-            if result["title"] and result["snippet"]:
-                results.append(result)
-        
+        results = _google_search(query, max_results)
         logger.info(f"Google search completed: {len(results)} results for '{query}'")
         return results
         
-    except requests.exceptions.RequestException as e:
-        logger.warning(f"Google search request failed: {e}")
-        return []
     except requests.exceptions.Timeout:
         logger.warning("Google search request timed out")
         return []
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Google search request failed: {e}")
+        return []
     except Exception as e:
         logger.warning(f"Google search failed: {e}")
         return []
 
 
+# A question that grounded once is likely to be asked again within the hour;
+# serving its web results from memory takes the external round-trip (often
+# the slowest step of a grounded answer) off the repeat entirely. Failures
+# raise out of here, so they are never cached
+@cache_search_results(ttl=3600)
+def _google_search(query: str, max_results: int) -> List[Dict[str, Any]]:
+    """One Custom Search request, formatted; raises on HTTP errors"""
+    url = "https://www.googleapis.com/customsearch/v1"
+    params = {
+        "key": settings.google_search_api_key,
+        "cx": settings.google_search_cx,
+        "q": query,
+        "num": min(max_results, 10),  # Google CSE max is 10
+        "safe": "off",
+        "fields": "items(title,link,snippet)"
+    }
+    
+    # Make the search request
+    response = _session.get(url, params=params, timeout=10)
+    response.raise_for_status()
+    
+    data = response.json()
+    items = data.get("items", [])
+    
+    # Format results
+    results = []
+    for item in items[:max_results]:
+        result = {
+            "title": item.get("title", ""),
+            "link": item.get("link", ""),
+            "snippet": item.get("snippet", "")
+        }
+        
+        # Only include results with meaningful content
+        if result["title"] and result["snippet"]:
+            results.append(result)
+    
+    return results
+
+
 def is_google_search_available() -> bool:
     """
     Check if Google Search is properly configured
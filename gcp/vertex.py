@@ -4,7 +4,7 @@ Optional chat provider - embeddings stay with OpenAI
 """
 
 from __future__ import annotations
-from typing import Optional
+from typing import Iterator, Optional
 from core.config import settings
 from core.logging import logger
 
@@ -112,6 +112,61 @@ def vertex_chat(system: str, user: str, model_name: Optional[str] = None) -> str
         raise Exception(error_msg)
 
 
+def vertex_chat_stream(system: str, user: str, model_name: Optional[str] = None) -> Iterator[str]:
+    """
+    Stream a chat response from Vertex AI Gemini as text deltas
+    
+    Args:
+        system: System prompt/instructions
+        user: User message/question
+        model_name: Model to use (defaults to configured model)
+        
+    Yields:
+        Generated text fragments as they arrive
+        
+    Raises:
+        ImportError: If Google Cloud libraries not installed
+        Exception: If generation fails
+    """
+    try:
+        from vertexai.generative_models import GenerativeModel
+        
+        _ensure_vertex_initialized()
+        
+        model = model_name or settings.vertex_chat_model
+        generative_model = GenerativeModel(model)
+        
+        # Gemini doesn't have separate system/user roles like OpenAI
+        combined_prompt = f"{system}\n\nUser: {user}\n\nAssistant:"
+        
+        responses = generative_model.generate_content(
+            combined_prompt,
+            generation_config={
+                "temperature": 0.2,
+                "top_p": 0.8,
+                "top_k": 40,
+                "max_output_tokens": 2048,
+            },
+            stream=True,
+        )
+        
+        for response in responses:
+            if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
+                text = response.candidates[0].content.parts[0].text
+                if text:
+                    yield text
+        
+    except ImportError as e:
+        error_msg = f"Google Cloud libraries not installed: {e}"
+        logger.error(error_msg)
+        raise ImportError(error_msg)
+    
+    except Exception as e:
+        error_msg = f"Vertex AI generation failed: {e}"
+        logger.error(error_msg)
+        raise Exception(error_msg)
+
+
 def is_vertex_available() -> bool:
     """
     Check if Vertex AI is available and properly configured
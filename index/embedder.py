@@ -1,11 +1,16 @@
 from __future__ import annotations
-from typing import List
+import struct
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Tuple
 from core.config import settings
 from core.resilience import (
     retry_embedding_service, embedding_circuit_breaker, 
-    EmbeddingServiceError, track_service_call
+    EmbeddingServiceError
 )
-from core.cache import cache_embeddings
+from core.monitoring import track_service_call
+from core.cache import cache_embeddings, embedding_cache
+from state.db import load_query_embeddings, store_query_embeddings
 from core.logging import logger
 from openai import OpenAI
 
@@ -22,7 +27,7 @@ def client() -> OpenAI:
     return _client
 
 
-@cache_embeddings(ttl=3600)  # Cache for 1 hour
+@cache_embeddings(ttl=3600, model=EMBED_MODEL)  # Cache for 1 hour, per text
 @track_service_call("openai_embeddings")
 @retry_embedding_service(max_attempts=3)
 @embedding_circuit_breaker
@@ -57,13 +62,16 @@ def embed_texts(texts: List[str]) -> List[List[float]]:
         logger.info(f"Embed provider: OpenAI ({EMBED_MODEL})")
         logger.debug(f"Generating embeddings for {len(non_empty_texts)} texts")
         
-        resp = c.embeddings.create(
-            model=EMBED_MODEL, 
-            input=non_empty_texts,
-            encoding_format="float"
-        )
-        
-        embeddings = [d.embedding for d in resp.data]
+        # Large ingests are split into requests the API will accept
+        batch_size = max(1, settings.embed_batch_size)
+        embeddings = []
+        for start in range(0, len(non_empty_texts), batch_size):
+            resp = c.embeddings.create(
+                model=EMBED_MODEL, 
+                input=non_empty_texts[start:start + batch_size],
+                encoding_format="float"
+            )
+            embeddings.extend(d.embedding for d in resp.data)
         
         logger.debug(f"Successfully generated {len(embeddings)} embeddings")
         return embeddings
@@ -74,6 +82,105 @@ def embed_texts(texts: List[str]) -> List[List[float]]:
         raise EmbeddingServiceError("openai", str(e))
 
 
+class EmbedCoalescer:
+    """
+    Coalesce concurrent single-query embeddings into batched embed_texts calls
+    
+    The first caller to arrive becomes the batch leader: it waits up to
+    max_wait seconds (or until max_batch queries are queued), embeds every
+    pending query in one request and hands each waiter its vector.
+    
+    With persist=True, the leader first looks the batch up in the state
+    database and stores whatever it had to embed, so repeat queries are
+    free across processes too.
+    """
+    
+    def __init__(self, max_batch: int = 32, max_wait: float = 0.005, persist: bool = False):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.persist = persist
+        self._lock = threading.Lock()
+        self._full = threading.Event()
+        self._pending: List[Tuple[str, Future]] = []
+    
+    def embed(self, text: str) -> List[float]:
+        """Embed a single query, sharing the API call with concurrent callers"""
+        # Blank texts are dropped by embed_texts and would misalign the batch
+        if not text.strip():
+            return embed_texts([text])[0]
+        
+        # A repeated query is already in embed_texts' per-text cache; serve it
+        # here so it doesn't sit out the batching window first
+        cached = embedding_cache.get(embedding_cache._make_key(EMBED_MODEL, text))
+        if cached is not None:
+            return cached
+        
+        future: Future = Future()
+        with self._lock:
+            self._pending.append((text, future))
+            is_leader = len(self._pending) == 1
+            if len(self._pending) >= self.max_batch:
+                self._full.set()
+        
+        if is_leader:
+            self._full.wait(self.max_wait)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._full.clear()
+            self._flush(batch)
+        
+        return future.result()
+    
+    def _flush(self, batch: List[Tuple[str, Future]]) -> None:
+        """Embed a batch and resolve every waiter"""
+        try:
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            vectors = self._load(texts) if self.persist else {}
+            missing = [text for text in texts if text not in vectors]
+            if missing:
+                fresh = embed_texts(missing)
+                if len(fresh) != len(missing):
+                    raise EmbeddingServiceError("openai", f"expected {len(missing)} embeddings, got {len(fresh)}")
+                if len(missing) > 1:
+                    logger.debug(f"Coalesced {len(missing)} query embeddings into one request")
+                vectors.update(zip(missing, fresh))
+                if self.persist:
+                    self._store(dict(zip(missing, fresh)))
+            for text, future in batch:
+                future.set_result(vectors[text])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+    
+    def _load(self, texts: List[str]) -> Dict[str, List[float]]:
+        """Stored vectors for texts, also warming the in-process cache"""
+        try:
+            blobs = load_query_embeddings(EMBED_MODEL, texts)
+        except Exception as e:  # e.g. nothing ingested yet, so no tables
+            logger.debug(f"Stored query embeddings unavailable: {e}")
+            return {}
+        vectors = {text: list(struct.unpack(f"<{len(blob) // 4}f", blob)) for text, blob in blobs.items()}
+        for text, vector in vectors.items():
+            embedding_cache.put(embedding_cache._make_key(EMBED_MODEL, text), vector, 3600)
+        return vectors
+    
+    def _store(self, vectors: Dict[str, List[float]]) -> None:
+        try:
+            store_query_embeddings(EMBED_MODEL, {
+                text: struct.pack(f"<{len(vector)}f", *vector) for text, vector in vectors.items()
+            })
+        except Exception as e:
+            logger.debug(f"Could not store query embeddings: {e}")
+
+
+_coalescer = EmbedCoalescer(persist=settings.persist_query_embeddings)
+
+def embed_query(text: str) -> List[float]:
+    """Embed a single query, batching with concurrent callers in the same process"""
+    return _coalescer.embed(text)
+
+
 def health_check() -> bool:
     """Check if embedding service is healthy"""
     try:
@@ -2,16 +2,37 @@ from __future__ import annotations
 from pinecone import Pinecone, ServerlessSpec
 from core.config import settings
 
+try:
+    # pinecone-client[grpc]: vectors travel as packed protobuf floats instead
+    # of JSON number text, roughly a third of the bytes and far less encoding
+    # CPU on large upserts
+    from pinecone.grpc import PineconeGRPC
+except ImportError:  # optional extra
+    PineconeGRPC = None
+
 _pc: Pinecone | None = None
+_index = None
+
+def uses_grpc() -> bool:
+    """True when get_index() hands out a gRPC index, whose queries accept async_req=True"""
+    return settings.pinecone_grpc and PineconeGRPC is not None
+
+def _client() -> Pinecone:
+    if uses_grpc():
+        return PineconeGRPC(api_key=settings.pinecone_api_key)
+    return Pinecone(api_key=settings.pinecone_api_key)
 
 def get_index():
-    global _pc
-    _pc = _pc or Pinecone(api_key=settings.pinecone_api_key)
-    if settings.pinecone_index not in [i.name for i in _pc.list_indexes()]:
-        _pc.create_index(
-            name=settings.pinecone_index,
-            dimension=1536,
-            metric="dotproduct",
-            spec=ServerlessSpec(cloud=settings.pinecone_cloud, region=settings.pinecone_region),
-        )
-    return _pc.Index(settings.pinecone_index)
+    """Return a process-wide Pinecone index handle, creating the index on first use"""
+    global _pc, _index
+    if _index is None:
+        _pc = _pc or _client()
+        if settings.pinecone_index not in [i.name for i in _pc.list_indexes()]:
+            _pc.create_index(
+                name=settings.pinecone_index,
+                dimension=1536,
+                metric="dotproduct",
+                spec=ServerlessSpec(cloud=settings.pinecone_cloud, region=settings.pinecone_region),
+            )
+        _index = _pc.Index(settings.pinecone_index)
+    return _index
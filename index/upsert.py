@@ -1,25 +1,65 @@
 from __future__ import annotations
+import struct
+from datetime import datetime
 from typing import List, Dict
 from sqlalchemy import text as sql
-from state.db import engine
-from index.embedder import embed_texts
+from state.db import engine, SELECT_STORED_EMBEDDINGS, bulk_upsert_embeddings, content_hash
+from index.embedder import embed_texts, EMBED_MODEL
 from index.pinecone_client import get_index
+from core.cache import vector_search_cache
 from core.config import settings
+from core.logging import logger
+
+
+def pack_vector(vec: List[float], quantization: str = "float16") -> bytes:
+    """
+    Compact copy of a vector for the embeddings table
+    
+    float16 (the default) is half the size of float32 at negligible recall
+    cost. int8 stores the minimum and step as two float32s followed by one
+    byte per dimension, a quarter of float32; vectors restored from it are
+    approximations (cosine similarity to the original stays above 0.99).
+    """
+    if quantization == "int8":
+        lo, hi = min(vec), max(vec)
+        scale = (hi - lo) / 255 or 1.0
+        return struct.pack("<2f", lo, scale) + bytes(round((x - lo) / scale) for x in vec)
+    return struct.pack(f"<{len(vec)}e", *vec)
+
+
+def unpack_vector(blob: bytes, dim: int) -> List[float]:
+    """Inverse of pack_vector; the format follows from the blob size"""
+    if len(blob) == 2 * dim:
+        return list(struct.unpack(f"<{dim}e", blob))
+    lo, scale = struct.unpack_from("<2f", blob)
+    return [lo + q * scale for q in blob[8:]]
 
 
 def build_and_upsert(namespace: str | None = None) -> dict:
     ns = namespace or settings.pinecone_namespace
     idx = get_index()
     with engine.begin() as conn:
-        rows = conn.execute(sql("SELECT id, text, metadata FROM chunks")).fetchall()
+        rows = conn.execute(sql("SELECT id, text, metadata, content_hash FROM chunks")).fetchall()
+        stored = conn.execute(SELECT_STORED_EMBEDDINGS).fetchall()
     if not rows:
         return {"upserts": 0}
 
-    texts = [r[1] for r in rows]
-    vecs = embed_texts(texts)
+    # Vectors are content-addressed: any stored vector for the same text and
+    # model is reused, and each distinct new text is embedded only once
+    hashes = [r[3] or content_hash(r[1]) for r in rows]
+    by_hash = {h: unpack_vector(blob, dim) for _cid, model, h, dim, blob in stored if model == EMBED_MODEL and h}
+    stored_hash = {cid: h for cid, model, h, _dim, _blob in stored if model == EMBED_MODEL}
+    todo: Dict[str, str] = {}
+    for r, h in zip(rows, hashes):
+        if h not in by_hash:
+            todo.setdefault(h, r[1])
+    if todo:
+        by_hash.update(zip(todo, embed_texts(list(todo.values()))))
+    vecs = [by_hash[h] for h in hashes]
+    logger.info(f"Embedded {len(todo)} distinct texts for {len(rows)} chunks")
 
     items = []
-    for (rid, _t, meta), v in zip(rows, vecs):
+    for (rid, _t, meta, _h), v in zip(rows, vecs):
         items.append({
             "id": rid,
             "values": v,
@@ -30,4 +70,21 @@ def build_and_upsert(namespace: str | None = None) -> dict:
     B = 100
     for i in range(0, len(items), B):
         idx.upsert(vectors=items[i:i+B], namespace=ns)
+    vector_search_cache.clear()
+
+    # Record a vector for every chunk that doesn't already have this one
+    fresh = [i for i, (r, h) in enumerate(zip(rows, hashes)) if stored_hash.get(r[0]) != h]
+    if fresh:
+        now = datetime.utcnow().isoformat()
+        with engine.begin() as conn:
+            bulk_upsert_embeddings(conn, [{
+                "chunk_id": rows[i][0],
+                "provider": "openai",
+                "model": EMBED_MODEL,
+                "dim": len(vecs[i]),
+                "vector_id": rows[i][0],
+                "created_at": now,
+                "vector": pack_vector(vecs[i], settings.vector_quantization),
+                "content_hash": hashes[i],
+            } for i in fresh])
     return {"upserts": len(items), "namespace": ns}
@@ -1,12 +1,16 @@
 from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Tuple
+from typing import List, Tuple
 from pypdf import PdfReader
 import os
 
 # Supported image extensions for OCR
 IMAGE_EXTS = {".png", ".jpg", ".jpeg"}
 
+# PDFs with at least this many pages are extracted across worker processes
+PARALLEL_PDF_MIN_PAGES = 32
+
 try:
     import docx  # python-docx
 except Exception:
@@ -25,11 +29,42 @@ def read_text(path: Path) -> Tuple[str, dict]:
     if path.suffix.lower() in IMAGE_EXTS:
         return _parse_image_with_docai(path, meta)
         
+def _extract_page_range(path: str, start: int, stop: int) -> List[str]:
+    """Extract text for pages [start, stop) of a PDF (runs in a worker process)"""
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+def _extract_pdf_pages(path: Path, reader: PdfReader) -> List[str]:
+    """
+    Extract text for every page, fanning large PDFs out across CPU cores
+    
+    Each worker parses the file once and handles a contiguous page range,
+    so page order is preserved without re-sorting.
+    """
+    from core.logging import logger
+    
+    total_pages = len(reader.pages)
+    workers = min(os.cpu_count() or 1, total_pages // (PARALLEL_PDF_MIN_PAGES // 2) or 1)
+    if total_pages < PARALLEL_PDF_MIN_PAGES or workers < 2:
+        return [page.extract_text() or "" for page in reader.pages]
+    
+    step = -(-total_pages // workers)  # ceil division
+    starts = list(range(0, total_pages, step))
+    stops = [min(start + step, total_pages) for start in starts]
+    
+    try:
+        with ProcessPoolExecutor(max_workers=len(starts)) as pool:
+            parts = pool.map(_extract_page_range, [str(path)] * len(starts), starts, stops)
+            return [text for part in parts for text in part]
+    except Exception as e:
+        logger.debug(f"Parallel PDF extraction failed, falling back to sequential: {e}")
+        return [page.extract_text() or "" for page in reader.pages]
+
 def _parse_pdf_with_auto_upgrade(path: Path, base_meta: dict) -> Tuple[str, dict]:
     """
     Parse PDF with auto-upgrade to DocAI when local extraction yields poor results
     """
-    from core.config import is_docai_enabled
+    from core.config import is_docai_enabled, settings
     from core.logging import logger
     
     # Thresholds for auto-upgrade decision
@@ -41,15 +76,8 @@ def _parse_pdf_with_auto_upgrade(path: Path, base_meta: dict) -> Tuple[str, dict
         reader = PdfReader(str(path))
         total_pages = len(reader.pages)
         
-        page_texts = []
-        empty_pages = 0
-        
-        for page in reader.pages:
-            page_text = page.extract_text() or ""
-            page_texts.append(page_text)
-            
-            if not page_text.strip():
-                empty_pages += 1
+        page_texts = _extract_pdf_pages(path, reader)
+        empty_pages = sum(1 for page_text in page_texts if not page_text.strip())
         
         # Join all pages
         local_text = "\n".join(page_texts)
@@ -2,16 +2,27 @@ from __future__ import annotations
 from pathlib import Path
 from datetime import datetime
 import hashlib
-import json
 from ingest.loaders import iter_files
 from ingest.parsers import read_text
 from ingest.chunkers import simple_chunks
-from state.db import init_db, engine
-from sqlalchemy import text as sql
+from state.db import init_db, analyze, engine, documents_table, upsert_document, bulk_insert_chunks, content_hash
+from core.cache import chunk_cache
+from core.serialization import dumps
+from sqlalchemy import bindparam, select
 
+_DOCUMENT_HASH = select(documents_table.c.hash).where(documents_table.c.id == bindparam("id"))
 
-def _hash_bytes(b: bytes) -> str:
-    return hashlib.sha256(b).hexdigest()
+
+def _hash_file(path: Path, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a file, read through one reused 1 MiB buffer so a large PDF
+    is never held in memory whole while it is also being parsed"""
+    h = hashlib.sha256()
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    with path.open("rb") as fh:
+        while n := fh.readinto(buf):
+            h.update(view[:n])
+    return h.hexdigest()
 
 
 def ingest_path(root: str | Path) -> dict:
@@ -29,14 +40,11 @@ def ingest_path(root: str | Path) -> dict:
     
     with engine.begin() as conn:
         for f in iter_files(root):
-            raw = f.read_bytes()
-            h = _hash_bytes(raw)
+            h = _hash_file(f)
             # skip if same hash exists
-            exists = conn.execute(sql("SELECT id FROM documents WHERE id=:id"), {"id": str(f)}).fetchone()
-            if exists:
-                prev = conn.execute(sql("SELECT hash FROM documents WHERE id=:id"), {"id": str(f)}).fetchone()
-                if prev and prev[0] == h:
-                    continue
+            prev = conn.execute(_DOCUMENT_HASH, {"id": str(f)}).fetchone()
+            if prev and prev[0] == h:
+                continue
             
             # Step 1: Parse document (includes DocAI auto-upgrade)
             raw_text, meta = read_text(f)
@@ -101,10 +109,7 @@ def ingest_path(root: str | Path) -> dict:
                 "gcs_uris": gcs_uris
             }
             
-            conn.execute(sql(
-                "REPLACE INTO documents(id,path,source,title,author,mime,created_at,updated_at,hash,tags)"
-                " VALUES(:id,:path,:source,:title,:author,:mime,:created_at,:updated_at,:hash,:tags)"
-            ), {
+            upsert_document(conn, {
                 "id": str(f),
                 "path": str(f),
                 "source": "local",
@@ -114,23 +119,31 @@ def ingest_path(root: str | Path) -> dict:
                 "created_at": now,
                 "updated_at": now,
                 "hash": h,
-                "tags": json.dumps(enhanced_meta),
+                "tags": dumps(enhanced_meta),
             })
             
+            # Compact JSON: every chunk repeats the document metadata, so dropping
+            # the separator whitespace adds up across a large corpus
+            chunk_meta = dumps({"source": str(f), **enhanced_meta})
+            rows = []
             for c in seqs:
                 chunk_id = f"{f}::#{c['seq']}"
-                conn.execute(sql(
-                    "REPLACE INTO chunks(id,document_id,seq,text,tokens,metadata,created_at)"
-                    " VALUES(:id,:document_id,:seq,:text,:tokens,:metadata,:created_at)"
-                ), {
+                chunk_cache.delete(chunk_id)
+                rows.append({
                     "id": chunk_id,
                     "document_id": str(f),
                     "seq": c["seq"],
                     "text": c["text"],
                     "tokens": len(c["text"].split()),
-                    "metadata": json.dumps({"source": str(f), **enhanced_meta}),
+                    "metadata": chunk_meta,
                     "created_at": now,
+                    "content_hash": content_hash(c["text"]),
                 })
+            bulk_insert_chunks(conn, rows)
             docs += 1
             chs += len(seqs)
+    
+    # Fresh stats so chunk-id lookups keep choosing the indexes after a large load
+    if docs:
+        analyze()
     return {"documents": docs, "chunks": chs}
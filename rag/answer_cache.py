@@ -0,0 +1,125 @@
+"""
+Answer cache in front of the chat model
+
+Exact hits are keyed by (question, context pack). When the caller passes the
+query embedding, a near-duplicate question (cosine similarity at or above the
+threshold) asked against the same context pack reuses the stored answer too,
+so rephrasings skip the LLM round-trip without ever mixing contexts.
+
+Query embeddings are kept as int8 (unit vector scaled by 127): a 1536-dim
+entry takes 1.5 KB instead of ~48 KB of Python floats, and the rounding moves
+cosine similarity by well under 0.01, far finer than the threshold needs.
+"""
+
+from __future__ import annotations
+import hashlib
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+from core.config import settings
+from core.logging import logger
+
+
+@dataclass
+class _Entry:
+    context_key: bytes
+    vector: Optional[array]  # int8-quantized unit query embedding, when known
+    answer: str
+    created_at: float
+
+
+def _key(question: str, context_pack: str) -> bytes:
+    return hashlib.blake2b(question.encode("utf-8") + b"\0" + context_pack.encode("utf-8"),
+                           digest_size=16).digest()
+
+
+def _context_key(context_pack: str) -> bytes:
+    return hashlib.blake2b(context_pack.encode("utf-8"), digest_size=16).digest()
+
+
+def _unit(vec: Sequence[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return [x / norm for x in vec]
+
+
+def _quantize(vec: Sequence[float]) -> array:
+    """Unit vector as signed bytes; dot products against it carry a factor of 127"""
+    return array("b", [round(x * 127) for x in _unit(vec)])
+
+
+class AnswerCache:
+    """Thread-safe LRU of generated answers with TTL and a semantic fallback"""
+
+    def __init__(self, max_size: int | None = None, ttl: float | None = None,
+                 similarity: float | None = None):
+        # 0 (or less) disables caching; None means use the configured size
+        self.max_size = settings.answer_cache_size if max_size is None else max_size
+        self.ttl = settings.answer_cache_ttl_seconds if ttl is None else ttl
+        self.similarity = settings.answer_cache_similarity if similarity is None else similarity
+        self._entries: OrderedDict[bytes, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return now - entry.created_at > self.ttl
+
+    def get(self, question: str, context_pack: str,
+            query_vec: Sequence[float] | None = None) -> Optional[str]:
+        """Cached answer for this question and context, or None"""
+        key = _key(question, context_pack)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry, now):
+                    self._entries.move_to_end(key)
+                    return entry.answer
+                del self._entries[key]
+
+            if query_vec is None:
+                return None
+
+            # Semantic tier: only entries built from the same context pack qualify
+            context_key = _context_key(context_pack)
+            q = [x / 127 for x in _unit(query_vec)]
+            best_key, best_sim = None, self.similarity
+            for k, e in self._entries.items():
+                if e.context_key != context_key or e.vector is None or self._expired(e, now):
+                    continue
+                sim = sum(a * b for a, b in zip(q, e.vector))
+                if sim >= best_sim:
+                    best_key, best_sim = k, sim
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            logger.debug(f"Semantic answer cache hit (similarity {best_sim:.3f})")
+            return self._entries[best_key].answer
+
+    def put(self, question: str, context_pack: str, answer: str,
+            query_vec: Sequence[float] | None = None) -> None:
+        if self.max_size <= 0:
+            return
+        key = _key(question, context_pack)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                while len(self._entries) >= self.max_size:
+                    self._entries.popitem(last=False)
+            self._entries[key] = _Entry(
+                context_key=_context_key(context_pack),
+                vector=_quantize(query_vec) if query_vec is not None else None,
+                answer=answer,
+                created_at=time.time(),
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+answer_cache = AnswerCache()
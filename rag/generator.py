@@ -1,6 +1,8 @@
 from __future__ import annotations
+from typing import Any, Dict, Iterator, List, Sequence
 from core.config import settings, is_vertex_chat_enabled
 from core.logging import logger
+from rag.answer_cache import answer_cache
 from openai import OpenAI
 
 SYSTEM = (
@@ -9,20 +11,56 @@ SYSTEM = (
     "Cite with bracketed numbers like [#1] for local context and [G#1] for Google snippets."
 )
 
+# One shared, never-mutated system message leads every chat request, so the
+# prompt prefix is byte-identical across calls and provider prompt caching
+# (OpenAI's is automatic) can reuse it; only the user turn varies
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM}
+
+SUMMARY_SYSTEM = (
+    "Summarize this conversation so it can replace the original turns. Keep facts, "
+    "decisions, open questions and any [#n] citations; drop pleasantries. Be concise."
+)
+
+
+def _user_prompt(question: str, context_pack: str) -> str:
+    """The user turn: context pack first, then the question
+    
+    The system prompt alone is far below the 1024 tokens OpenAI needs before
+    it caches a prefix; a context pack usually is not. Putting the pack
+    ahead of the question lets follow-up questions over the same pack reuse
+    the cached prefill for as long as the provider keeps it (minutes).
+    """
+    return f"CONTEXT PACK:\n{context_pack}\n\nQUESTION: {question}"
+
+
 _llm: OpenAI | None = None
 
 def llm() -> OpenAI:
+    """Chat client, shared across threads so concurrent asks reuse its connection pool"""
     global _llm
-    _llm = _llm or OpenAI(api_key=settings.openai_api_key)
+    if _llm is None:
+        if settings.chat_base_url:
+            _llm = OpenAI(base_url=settings.chat_base_url,
+                          api_key=settings.chat_api_key or settings.openai_api_key or "EMPTY")
+        else:
+            _llm = OpenAI(api_key=settings.openai_api_key)
     return _llm
 
 
-def answer(question: str, context_pack: str) -> str:
+def answer(question: str, context_pack: str, query_vec: Sequence[float] | None = None) -> str:
     """
     Generate answer using configured chat provider (Vertex or OpenAI)
     Embeddings always use OpenAI regardless of chat provider
+    
+    Answers are cached per (question, context pack); passing the query
+    embedding also lets near-duplicate questions reuse a cached answer
     """
-    user_prompt = f"QUESTION: {question}\n\nCONTEXT PACK:\n{context_pack}"
+    cached = answer_cache.get(question, context_pack, query_vec)
+    if cached is not None:
+        logger.info("Answer cache hit")
+        return cached
+    
+    user_prompt = _user_prompt(question, context_pack)
     
     # Check if Vertex chat is enabled
     if is_vertex_chat_enabled():
@@ -36,6 +74,7 @@ def answer(question: str, context_pack: str) -> str:
                 model_name=settings.vertex_chat_model
             )
             
+            answer_cache.put(question, context_pack, response, query_vec)
             return response
             
         except ImportError:
@@ -50,13 +89,114 @@ def answer(question: str, context_pack: str) -> str:
         resp = llm().chat.completions.create(
             model="gpt-4o-mini",
             messages=[
-                {"role": "system", "content": SYSTEM},
+                SYSTEM_MESSAGE,
                 {"role": "user", "content": user_prompt},
             ],
             temperature=0.2,
         )
-        return resp.choices[0].message.content or ""
+        response = resp.choices[0].message.content or ""
         
     except Exception as e:
         logger.error(f"OpenAI chat generation failed: {e}")
         return f"I apologize, but I encountered an error while generating the response: {e}"
+    
+    answer_cache.put(question, context_pack, response, query_vec)
+    return response
+
+
+def summarize(messages: List[Dict[str, Any]]) -> str:
+    """Condense conversation messages into one short summary (OpenAI gpt-4o-mini)"""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    resp = llm().chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": SUMMARY_SYSTEM},
+            {"role": "user", "content": transcript},
+        ],
+        temperature=0.0,
+    )
+    return resp.choices[0].message.content or ""
+
+
+def answer_stream(question: str, context_pack: str,
+                  query_vec: Sequence[float] | None = None) -> Iterator[str]:
+    """
+    Stream the answer as text deltas, using the same provider selection,
+    fallbacks and answer cache as answer(); callers can show the first
+    tokens immediately
+    """
+    cached = answer_cache.get(question, context_pack, query_vec)
+    if cached is not None:
+        logger.info("Answer cache hit")
+        yield cached
+        return
+    
+    user_prompt = _user_prompt(question, context_pack)
+    
+    # Check if Vertex chat is enabled
+    if is_vertex_chat_enabled():
+        stream = None
+        try:
+            logger.info(f"Chat provider: Vertex ({settings.vertex_chat_model}, streaming)")
+            from gcp.vertex import vertex_chat_stream
+            
+            # Pull the first delta before yielding so a failed request can still
+            # fall back to OpenAI without emitting a partial answer
+            stream = vertex_chat_stream(
+                system=SYSTEM,
+                user=user_prompt,
+                model_name=settings.vertex_chat_model
+            )
+            first = next(stream, "")
+            if not first:
+                raise RuntimeError("empty response stream")
+            
+        except ImportError:
+            stream = None
+            logger.warning("Google Cloud libraries not installed, falling back to OpenAI")
+        except Exception as e:
+            stream = None
+            logger.warning(f"Vertex AI chat failed, falling back to OpenAI: {e}")
+        
+        if stream is not None:
+            # Output has reached the caller: a failure from here on can no
+            # longer fall back without repeating it, so it propagates
+            parts = [first]
+            yield first
+            try:
+                for delta in stream:
+                    parts.append(delta)
+                    yield delta
+            except Exception as e:
+                logger.error(f"Vertex AI chat stream failed mid-answer: {e}")
+                raise
+            answer_cache.put(question, context_pack, "".join(parts), query_vec)
+            return
+    
+    # Default to OpenAI (or fallback from Vertex)
+    logger.info("Chat provider: OpenAI (gpt-4o-mini, streaming)")
+    
+    parts = []
+    try:
+        resp = llm().chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                SYSTEM_MESSAGE,
+                {"role": "user", "content": user_prompt},
+            ],
+            temperature=0.2,
+            stream=True,
+        )
+        for event in resp:
+            if event.choices:
+                delta = event.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        
+    except Exception as e:
+        logger.error(f"OpenAI chat generation failed: {e}")
+        yield f"I apologize, but I encountered an error while generating the response: {e}"
+        return
+    
+    answer_cache.put(question, context_pack, "".join(parts), query_vec)
@@ -5,10 +5,36 @@ If VOYAGE_API_KEY is not configured, returns identity order.
 """
 
 from __future__ import annotations
+import threading
 from typing import List, Dict
-from core.config import settings
+from core.config import settings, rerank_skip_score, rerank_skip_gap
+from core.cache import rerank_cache
 from core.logging import logger
 
+try:
+    import voyageai
+except ImportError:  # optional dependency
+    voyageai = None
+
+# One client per process so its HTTP connection pool (and TLS session) is
+# reused across rerank calls instead of being rebuilt every query
+_voyage_client = None
+_voyage_client_key: str | None = None
+_voyage_lock = threading.Lock()
+
+def _get_voyage():
+    """Get or create the shared Voyage client for the configured API key"""
+    global _voyage_client, _voyage_client_key
+    if voyageai is None:
+        raise ImportError("voyageai")
+    api_key = settings.voyage_api_key
+    if _voyage_client is None or _voyage_client_key != api_key:
+        with _voyage_lock:
+            if _voyage_client is None or _voyage_client_key != api_key:
+                _voyage_client = voyageai.Client(api_key=api_key)
+                _voyage_client_key = api_key
+    return _voyage_client
+
 def rerank(question: str, snippets: List[Dict]) -> List[Dict]:
     """
     Rerank snippets using Voyage AI rerank-2 model.
@@ -19,6 +45,9 @@ def rerank(question: str, snippets: List[Dict]) -> List[Dict]:
     
     # Check if Voyage AI is configured
     if settings.voyage_api_key:
+        if _confident_top1(snippets):
+            logger.info("Rerank skipped (confident top-1)")
+            return snippets
         try:
             logger.info("Reranking with Voyage (rerank-2)")
             return _voyage_rerank(question, snippets)
@@ -30,32 +59,56 @@ def rerank(question: str, snippets: List[Dict]) -> List[Dict]:
         logger.info("No VOYAGE_API_KEY set, skipping rerank")
         return snippets
 
+def _confident_top1(snippets: List[Dict]) -> bool:
+    """True when the leading vector hit is strong and well clear of the runner-up
+    
+    Only cosine scores from the vector leg are comparable; keyword scores from
+    hybrid search are on a different scale, so those lists are always reranked.
+    """
+    head = snippets[:2]
+    if any(s.get('source') not in (None, 'vector') for s in head):
+        return False
+    top = head[0].get('score') or 0.0
+    gap = top - (head[1].get('score') or 0.0) if len(head) > 1 else 1.0
+    return top >= rerank_skip_score() and gap >= rerank_skip_gap()
+
 def _voyage_rerank(question: str, snippets: List[Dict]) -> List[Dict]:
     """Rerank using Voyage AI rerank-2 model"""
     try:
-        import voyageai
-        
-        client = voyageai.Client(api_key=settings.voyage_api_key)
-        
-        # Prepare documents for reranking
-        documents = [snippet.get('text', '') for snippet in snippets]
+        # Prepare documents for reranking, sending each distinct text once;
+        # hybrid results often repeat a chunk's text under several hits
+        positions: Dict[str, List[int]] = {}
+        for i, snippet in enumerate(snippets):
+            positions.setdefault(snippet.get('text', ''), []).append(i)
+        documents = list(positions)
         
-        # Call Voyage rerank API
-        rerank_result = client.rerank(
-            query=question,
-            documents=documents,
-            model="rerank-2",
-            top_k=len(snippets)
-        )
+        # The same question over the same candidates (a repeated ask, or a
+        # follow-up that retrieves the same chunks) reuses the last ranking
+        cache_key = rerank_cache._make_key("rerank-2", question, documents)
+        ranking = rerank_cache.get(cache_key)
+        if ranking is None:
+            client = _get_voyage()
+            
+            # Call Voyage rerank API
+            rerank_result = client.rerank(
+                query=question,
+                documents=documents,
+                model="rerank-2",
+                top_k=len(documents)
+            )
+            ranking = [(result.index, result.relevance_score) for result in rerank_result.results]
+            rerank_cache.put(cache_key, ranking)
+        else:
+            logger.debug("Rerank cache hit")
         
-        # Reorder snippets based on reranking scores
-        reranked_snippets = []
-        for result in rerank_result.results:
-            original_index = result.index
-            reranked_snippet = snippets[original_index].copy()
-            reranked_snippet['rerank_score'] = result.relevance_score
-            reranked_snippet['reranker'] = 'voyage'
-            reranked_snippets.append(reranked_snippet)
+        # Reorder snippets based on reranking scores, fanning each unique
+        # document's score back out to every snippet that shared its text
+        groups = list(positions.values())
+        reranked_snippets = [
+            {**snippets[i], 'rerank_score': score, 'reranker': 'voyage'}
+            for index, score in ranking
+            for i in groups[index]
+        ]
         
         logger.info(f"Voyage reranked {len(reranked_snippets)} snippets")
         return reranked_snippets
@@ -1,32 +1,109 @@
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Tuple
-from index.pinecone_client import get_index
+from index.pinecone_client import get_index, uses_grpc
+from core.cache import vector_search_cache
 from core.config import settings
+from core.logging import logger
 
+# Query vectors go over the wire as JSON; float64 reprs run ~20 chars per
+# component, while 6 decimals halve the payload and change cosine similarity by
+# ~1e-10 (Pinecone stores float32 anyway)
+QUERY_VECTOR_DECIMALS = 6
 
-def vector_search(query_vec: List[float], top_k: int = 12, namespace: str | None = None) -> Tuple[List[Dict], float]:
+# Pinecone's query endpoint takes one vector per request; over gRPC a batch is
+# sent as async requests multiplexed on the index's channel, otherwise it is
+# fanned out over the shared index handle (and its connection pool)
+_query_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="vector-search")
+
+
+def is_empty_query(q: str | None) -> bool:
+    """True for blank (or, with MIN_QUERY_CHARS, too short) queries that should skip embedding and search"""
+    return q is None or len(q.strip()) < max(1, settings.min_query_chars)
+
+
+def vector_search(query_vec: List[float], top_k: int = 12, namespace: str | None = None, index=None) -> Tuple[List[Dict], float]:
     """
     Perform vector search and return results with best score
     
+    Args:
+        query_vec: Query embedding (list of floats or numpy array)
+        index: Optional Pinecone index handle; defaults to the shared one from get_index()
+    
     Returns:
         Tuple of (results_list, best_score)
+    
+    Searches against the shared index are cached for VECTOR_CACHE_TTL_SECONDS,
+    keyed by the (rounded) query vector, top_k and namespace.
     """
-    idx = get_index()
+    ns, vector, cache_key, cached = _prepare(query_vec, top_k, namespace, index)
+    if cached is not None:
+        return cached
+    
+    idx = index if index is not None else get_index()
+    res = idx.query(namespace=ns, vector=vector, top_k=top_k, include_metadata=True)
+    return _results(res, cache_key)
+
+
+def _prepare(query_vec, top_k: int, namespace: str | None, index) -> tuple:
+    """Namespace, wire vector, cache key and any cached results for one search"""
     ns = namespace or settings.pinecone_namespace
-    res = idx.query(namespace=ns, vector=query_vec, top_k=top_k, include_metadata=True)
-    out = []
-    best_score = 0.0
+    if hasattr(query_vec, "tolist"):  # numpy arrays
+        query_vec = query_vec.tolist()
+    vector = [round(x, QUERY_VECTOR_DECIMALS) for x in query_vec]
+    if not vector:
+        raise ValueError("Query vector is empty")
+    if top_k < 1:
+        raise ValueError(f"top_k must be positive, got {top_k}")
     
-    for m in res.matches:
-        score = float(m.score)
-        if score > best_score:
-            best_score = score
-            
-        out.append({
+    cache_key = None
+    if index is None and settings.vector_cache_ttl_seconds > 0:
+        cache_key = vector_search_cache._make_key(settings.pinecone_index, ns, top_k, vector)
+        cached = vector_search_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("Cache hit for vector search")
+            # Callers hydrate matches in place, so hand out fresh dicts
+            return ns, vector, cache_key, ([dict(m) for m in cached[0]], cached[1])
+    return ns, vector, cache_key, None
+
+
+def _results(res, cache_key: str | None) -> Tuple[List[Dict], float]:
+    """Convert a Pinecone query response, caching it under cache_key"""
+    out = [
+        {
             "id": m.id,
-            "score": score,
+            "score": float(m.score),
             "text": None,  # filled by join step
             "meta": m.metadata,
-        })
+        }
+        for m in res.matches
+    ]
+    best_score = max(0.0, max((r["score"] for r in out), default=0.0))
     
+    if cache_key is not None:
+        vector_search_cache.put(cache_key, ([dict(m) for m in out], best_score))
     return out, best_score
+
+
+def vector_search_batch(query_vecs: List[List[float]], top_k: int = 12, namespace: str | None = None, index=None) -> List[Tuple[List[Dict], float]]:
+    """
+    Run vector_search for several query vectors with overlapping round-trips
+    
+    Returns:
+        One (results_list, best_score) tuple per query vector, in order
+    """
+    if len(query_vecs) <= 1:
+        return [vector_search(v, top_k=top_k, namespace=namespace, index=index) for v in query_vecs]
+    if index is None and uses_grpc():
+        idx = get_index()
+        prepared = [_prepare(v, top_k, namespace, None) for v in query_vecs]
+        pending = [
+            None if cached is not None else
+            idx.query(namespace=ns, vector=vector, top_k=top_k, include_metadata=True, async_req=True)
+            for ns, vector, _key, cached in prepared
+        ]
+        return [
+            cached if future is None else _results(future.result(), cache_key)
+            for (_ns, _vector, cache_key, cached), future in zip(prepared, pending)
+        ]
+    return list(_query_pool.map(lambda v: vector_search(v, top_k=top_k, namespace=namespace, index=index), query_vecs))
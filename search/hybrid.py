@@ -1,11 +1,31 @@
 from __future__ import annotations
-from typing import List, Dict, Tuple
+from typing import List, Dict, Iterable, Tuple
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from heapq import nlargest
+from itertools import islice
+import ntpath
 from sqlalchemy import text as sql
 from state.db import engine
 from search.typesense_client import ensure_collection, delete_collection, index_documents, search_keywords, is_available
 from core.logging import logger
 import time
 
+# Runs the Typesense leg of hybrid_search while the caller queries Pinecone;
+# both SDKs are blocking, so threads are enough to overlap the round-trips
+_keyword_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-keyword")
+
+def _epoch_seconds(created_at: str | None, default: int) -> int:
+    """Epoch seconds for a stored ISO timestamp (naive values are UTC), or default"""
+    try:
+        dt = datetime.fromisoformat(created_at)
+    except (TypeError, ValueError):
+        return default
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
 def index_typesense() -> dict:
     """Index all chunks from SQLite to Typesense"""
     if not is_available():
@@ -17,39 +37,50 @@ def index_typesense() -> dict:
         if not delete_collection():
             return {"indexed": 0, "error": "Failed to recreate collection"}
         
-        # Fetch all chunks from SQLite
-        with engine.begin() as conn:
-            rows = conn.execute(sql(
+        # Stream chunks from the database; index_documents imports batches
+        # while the rows are still read
+        now = int(time.time())
+        total = 0
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=10_000).execute(sql(
                 "SELECT c.id, c.document_id, c.seq, c.text, c.created_at, d.path "
                 "FROM chunks c JOIN documents d ON c.document_id = d.id"
-            )).fetchall()
-        
-        if not rows:
-            logger.info("No chunks found for Typesense indexing")
-            return {"indexed": 0, "total": 0}
-        
-        # Convert to Typesense document format
-        documents = []
-        for row in rows:
-            chunk_id, doc_id, seq, text, created_at, doc_path = row
+            ))
             
-            # Extract filename from path for doc field
-            doc_name = doc_path.split('/')[-1] if '/' in doc_path else doc_path.split('\\')[-1]
+            # Convert to Typesense document format
+            def documents():
+                nonlocal total
+                doc_names: Dict[str, str] = {}
+                timestamps: Dict[str, int] = {}
+                for chunk_id, doc_id, seq, text, created_at, doc_path in result:
+                    # Extract filename from path for doc field, once per document;
+                    # ntpath splits on both '/' and '\\'
+                    doc_name = doc_names.get(doc_path)
+                    if doc_name is None:
+                        doc_name = doc_names[doc_path] = ntpath.basename(doc_path) or doc_path
+                    # Chunks of one ingest share a created_at, so each is parsed once
+                    ts = timestamps.get(created_at)
+                    if ts is None:
+                        ts = timestamps[created_at] = _epoch_seconds(created_at, now)
+                    total += 1
+                    yield {
+                        'id': chunk_id,
+                        'doc': doc_name,
+                        'seq': seq,
+                        'text': text,
+                        'created_at': ts
+                    }
             
-            documents.append({
-                'id': chunk_id,
-                'doc': doc_name,
-                'seq': seq,
-                'text': text,
-                'created_at': int(time.time()) if not created_at else int(time.mktime(time.strptime(created_at, '%Y-%m-%dT%H:%M:%S.%f')))
-            })
+            # Index to Typesense
+            indexed_count = index_documents(documents())
         
-        # Index to Typesense
-        indexed_count = index_documents(documents)
+        if not total:
+            logger.info("No chunks found for Typesense indexing")
+            return {"indexed": 0, "total": 0}
         
         return {
             "indexed": indexed_count,
-            "total": len(documents),
+            "total": total,
             "skipped": False
         }
         
@@ -64,45 +95,37 @@ def keyword_search(query: str, k: int = 24) -> List[Dict]:
     
     return search_keywords(query, k)
 
-def hybrid_merge(keyword_results: List[Dict], vector_results: List[Dict], k: int = 12) -> List[Dict]:
-    """Merge keyword and vector search results using round-robin with deduplication"""
-    seen_ids = set()
-    merged = []
+def hybrid_merge(keyword_results: Iterable[Dict], vector_results: Iterable[Dict], k: int = 12,
+                 rrf_k: int = 60, depth: int | None = None) -> List[Dict]:
+    """Merge keyword and vector search results with Reciprocal Rank Fusion
     
-    # Convert to iterators for round-robin
-    keyword_iter = iter(keyword_results)
-    vector_iter = iter(vector_results)
+    Each result scores 1/(rrf_k + rank) per list it appears in, so chunks that
+    both legs agree on rise to the top; those are tagged with source 'hybrid'.
+    Either leg may be a lazy iterable; at most `depth` results are consumed
+    from each (None = all).
+    """
+    scores = defaultdict(float)
+    items: Dict[str, Dict] = {}
     
-    keyword_done = False
-    vector_done = False
+    for source, results in (("keyword", keyword_results), ("vector", vector_results)):
+        for rank, r in enumerate(islice(results, depth), start=1):
+            scores[r['id']] += 1.0 / (rrf_k + rank)
+            if r['id'] in items:
+                if items[r['id']]['source'] != source:
+                    items[r['id']]['source'] = 'hybrid'
+            else:
+                items[r['id']] = {**r, 'source': source}
     
-    while len(merged) < k and not (keyword_done and vector_done):
-        # Try to add from keyword results
-        if not keyword_done:
-            try:
-                kw_result = next(keyword_iter)
-                if kw_result['id'] not in seen_ids:
-                    seen_ids.add(kw_result['id'])
-                    kw_result['source'] = 'keyword'
-                    merged.append(kw_result)
-            except StopIteration:
-                keyword_done = True
-        
-        # Try to add from vector results
-        if not vector_done and len(merged) < k:
-            try:
-                vec_result = next(vector_iter)
-                if vec_result['id'] not in seen_ids:
-                    seen_ids.add(vec_result['id'])
-                    vec_result['source'] = 'vector'
-                    merged.append(vec_result)
-            except StopIteration:
-                vector_done = True
-    
-    return merged[:k]
+    return [items[i] for i, _ in nlargest(k, scores.items(), key=lambda kv: kv[1])]
 
-def hybrid_search(query: str, query_vec: List[float], k: int = 12) -> Tuple[List[Dict], float]:
-    """Perform hybrid search combining keyword and vector results"""
+def hybrid_search(query: str, query_vec: List[float], k: int = 12, index=None,
+                  namespace: str | None = None) -> Tuple[List[Dict], float]:
+    """Perform hybrid search combining keyword and vector results
+    
+    Args:
+        index: Optional Pinecone index handle passed through to vector_search
+        namespace: Pinecone namespace for the vector leg (defaults to settings)
+    """
     from rag.retriever import vector_search
     from core.config import has_commercial_license
     
@@ -110,19 +133,21 @@ def hybrid_search(query: str, query_vec: List[float], k: int = 12) -> Tuple[List
     if not has_commercial_license():
         logger.warning("Hybrid search requires commercial license. Using vector-only search.")
         logger.info("Get your license at: https://machinecraft.tech/vectorpenter/pricing")
-        return vector_search(query_vec, top_k=k)
+        return vector_search(query_vec, top_k=k, namespace=namespace, index=index)
     
     # Oversample for better hybrid merging
     oversample_k = k * 2
     
-    # Get keyword results
-    keyword_results = keyword_search(query, oversample_k)
+    # Get keyword results in the background while the vector leg runs here,
+    # so latency is the slower of the two rather than their sum
+    keyword_future = _keyword_pool.submit(keyword_search, query, oversample_k)
     
     # Get vector results with best score
-    vector_results, best_score = vector_search(query_vec, top_k=oversample_k)
+    vector_results, best_score = vector_search(query_vec, top_k=oversample_k, namespace=namespace, index=index)
+    keyword_results = keyword_future.result()
     
     # Merge results
-    merged_results = hybrid_merge(keyword_results, vector_results, k)
+    merged_results = hybrid_merge(keyword_results, vector_results, k, depth=oversample_k)
     
     logger.info(f"Hybrid search: {len(keyword_results)} keyword + {len(vector_results)} vector → {len(merged_results)} merged")
     
@@ -1,10 +1,26 @@
 from __future__ import annotations
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterable, Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 import typesense
 from core.config import settings
 from core.logging import logger
+from core.serialization import dumps_bytes, loads
 
 _client: Optional[typesense.Client] = None
+# Per-collection `documents` handles; the SDK builds fresh wrapper objects on
+# every collections[...] / .documents access
+_documents_api: Dict[str, object] = {}
+
+# Static collection schema, built once at import
+COLLECTION_FIELDS = [
+    {'name': 'id', 'type': 'string'},
+    {'name': 'doc', 'type': 'string'},
+    {'name': 'seq', 'type': 'int32'},
+    {'name': 'text', 'type': 'string'},
+    {'name': 'tags', 'type': 'string[]', 'optional': True},
+    {'name': 'created_at', 'type': 'int64', 'optional': True}
+]
 
 def get_client() -> typesense.Client:
     """Get or create Typesense client"""
@@ -22,8 +38,16 @@ def get_client() -> typesense.Client:
             }],
             'connection_timeout_seconds': 10
         })
+        _documents_api.clear()
     return _client
 
+def _documents(collection_name: str):
+    """Get the cached documents handle for a collection"""
+    docs = _documents_api.get(collection_name)
+    if docs is None:
+        docs = _documents_api[collection_name] = get_client().collections[collection_name].documents
+    return docs
+
 def ensure_collection() -> bool:
     """Ensure the Typesense collection exists with correct schema"""
     try:
@@ -39,17 +63,7 @@ def ensure_collection() -> bool:
             pass
         
         # Create collection with schema
-        schema = {
-            'name': collection_name,
-            'fields': [
-                {'name': 'id', 'type': 'string'},
-                {'name': 'doc', 'type': 'string'},
-                {'name': 'seq', 'type': 'int32'},
-                {'name': 'text', 'type': 'string'},
-                {'name': 'tags', 'type': 'string[]', 'optional': True},
-                {'name': 'created_at', 'type': 'int64', 'optional': True}
-            ]
-        }
+        schema = {'name': collection_name, 'fields': COLLECTION_FIELDS}
         
         client.collections.create(schema)
         logger.info(f"Created Typesense collection '{collection_name}'")
@@ -77,31 +91,45 @@ def delete_collection() -> bool:
         logger.warning(f"Failed to delete Typesense collection: {e}")
         return False
 
-def index_documents(documents: List[Dict]) -> int:
-    """Bulk index documents to Typesense"""
+def _import_batch(collection_name: str, batch: List[Dict]) -> int:
+    """Import one batch as a pre-serialized JSONL payload, returning successes"""
     try:
-        client = get_client()
+        payload = b"\n".join(dumps_bytes(doc) for doc in batch)
+        result = _documents(collection_name).import_(payload, {'action': 'create'})
+        return sum(1 for line in result.splitlines() if line and loads(line).get('success'))
+    except Exception as e:
+        logger.warning(f"Batch import failed: {e}")
+        return 0
+
+def index_documents(documents: Iterable[Dict], batch_size: int = 500, workers: int | None = None) -> int:
+    """Bulk index documents to Typesense
+    
+    Batches are imported by a thread pool (TYPESENSE_INGEST_WORKERS threads by
+    default) while the caller keeps producing documents, so SQLite reads
+    overlap the HTTP round-trips. At most 2 * workers batches are in flight,
+    bounding memory for large indexes.
+    """
+    try:
+        get_client()
         collection_name = settings.typesense_collection
+        workers = workers or settings.typesense_ingest_workers
         
-        if not documents:
-            return 0
-        
-        # Import documents in batches
-        batch_size = 100
+        total_docs = 0
         total_indexed = 0
-        
-        for i in range(0, len(documents), batch_size):
-            batch = documents[i:i + batch_size]
-            try:
-                result = client.collections[collection_name].documents.import_(batch)
-                # Count successful imports
-                for item in result:
-                    if item.get('success'):
-                        total_indexed += 1
-            except Exception as e:
-                logger.warning(f"Batch import failed: {e}")
-        
-        logger.info(f"Indexed {total_indexed}/{len(documents)} documents to Typesense")
+        in_flight = set()
+        doc_iter = iter(documents)
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="typesense-import") as pool:
+            while batch := list(islice(doc_iter, batch_size)):
+                total_docs += len(batch)
+                in_flight.add(pool.submit(_import_batch, collection_name, batch))
+                if len(in_flight) >= workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    total_indexed += sum(f.result() for f in done)
+            total_indexed += sum(f.result() for f in in_flight)
+        
+        if total_docs:
+            logger.info(f"Indexed {total_indexed}/{total_docs} documents to Typesense")
         return total_indexed
         
     except Exception as e:
@@ -111,7 +139,6 @@ def index_documents(documents: List[Dict]) -> int:
 def search_keywords(query: str, k: int = 24) -> List[Dict]:
     """Search Typesense for keyword matches"""
     try:
-        client = get_client()
         collection_name = settings.typesense_collection
         
         search_params = {
@@ -121,7 +148,7 @@ def search_keywords(query: str, k: int = 24) -> List[Dict]:
             'sort_by': '_text_match:desc'
         }
         
-        result = client.collections[collection_name].documents.search(search_params)
+        result = _documents(collection_name).search(search_params)
         
         matches = []
         for hit in result.get('hits', []):
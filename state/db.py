@@ -1,55 +1,414 @@
-from sqlalchemy import create_engine, text
-from sqlalchemy.engine import Engine
+import atexit
+import hashlib
+import queue
+import struct
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+from sqlalchemy import (
+    Column, Index, Integer, LargeBinary, MetaData, Table, Text, bindparam, create_engine, event, func,
+    inspect, select,
+)
+from sqlalchemy.dialects import mysql, postgresql
+from sqlalchemy.engine import Connection, Engine
 from core.config import settings
+from core.logging import logger
+from core.serialization import dumps, loads
+
+# A QueuePool gives concurrent API reads their own connection (and, on SQLite,
+# their own WAL reader) instead of queueing on one shared handle; only server
+# databases need stale-connection pings, and connections are recycled hourly
+# before a server-side idle timeout can drop them. Multi-row INSERTs are paged
+# so a large ingest batch stays well under SQLite's bound-parameter limit
+engine: Engine = create_engine(settings.db_url, future=True, pool_size=8, max_overflow=16,
+                               pool_pre_ping=not settings.db_url.startswith("sqlite"),
+                               pool_recycle=3600, insertmanyvalues_page_size=1000)
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        # WAL lets readers run alongside ingest writes, and under WAL
+        # synchronous=NORMAL only fsyncs at checkpoints; mmap and a 64 MB page
+        # cache keep repeated chunk lookups off the filesystem
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA mmap_size=268435456")
+        cur.execute("PRAGMA cache_size=-65536")
+        cur.close()
+
+    @atexit.register
+    def _sqlite_optimize():
+        # Once per process rather than on every pool checkin, and only if the
+        # database was used. Ingest already runs analyze(); this refreshes stale
+        # planner stats for API processes. 0x10002 checks every table, since
+        # the connection running it has not queried any
+        if not engine.pool.checkedin():
+            return
+        try:
+            with engine.connect() as conn:
+                conn.exec_driver_sql("PRAGMA optimize=0x10002")
+        except Exception as e:
+            logger.debug(f"PRAGMA optimize skipped: {e}")
+
+# Schema as Core Table objects, built once at import; init_db creates any
+# missing tables/indexes and the insert statements below are reused as-is
+metadata = MetaData()
+
+documents_table = Table(
+    "documents", metadata,
+    Column("id", Text, primary_key=True),
+    Column("path", Text),
+    Column("source", Text),
+    Column("title", Text),
+    Column("author", Text),
+    Column("mime", Text),
+    Column("created_at", Text),
+    Column("updated_at", Text),
+    Column("hash", Text),
+    Column("tags", Text),
+    Index("idx_documents_hash", "hash"),
+)
+
+chunks_table = Table(
+    "chunks", metadata,
+    Column("id", Text, primary_key=True),
+    Column("document_id", Text),
+    Column("seq", Integer),
+    Column("text", Text),
+    Column("tokens", Integer),
+    Column("metadata", Text),
+    Column("created_at", Text),
+    # Not unique: boilerplate chunks share text across documents but each
+    # keeps its own row; the indexer embeds each distinct hash once
+    Column("content_hash", Text),
+    Index("idx_chunks_document_seq", "document_id", "seq"),
+    Index("idx_chunks_content_hash", "content_hash"),
+)
+
+embeddings_table = Table(
+    "embeddings", metadata,
+    Column("chunk_id", Text, primary_key=True),
+    Column("provider", Text),
+    Column("model", Text),
+    Column("dim", Integer),
+    Column("vector_id", Text),
+    Column("created_at", Text),
+    # Float16 (or int8, see index.upsert.pack_vector) copy of the vector and
+    # the hash of the text it was computed from, so re-indexing only embeds
+    # chunks whose text changed
+    Column("vector", LargeBinary),
+    Column("content_hash", Text),
+    Index("idx_embeddings_vector_id", "vector_id"),
+)
+
+# Query vectors kept across processes, keyed by content_hash of model and
+# query text, so a CLI ask repeated in a new session needs no embedding call.
+# Rows older than QUERY_EMBEDDINGS_RETENTION_DAYS are ignored and pruned
+query_embeddings_table = Table(
+    "query_embeddings", metadata,
+    Column("key", Text, primary_key=True),
+    Column("model", Text),
+    Column("vector", LargeBinary),
+    Column("created_at", Text),
+    Index("idx_query_embeddings_created_at", "created_at"),
+)
+
+retrieval_logs_table = Table(
+    "retrieval_logs", metadata,
+    Column("id", Text, primary_key=True),
+    Column("query", Text),
+    Column("filters", Text),
+    Column("candidate_ids", Text),
+    Column("chosen_ids", Text),
+    # Little-endian float32s (see pack_scores); older databases stored a JSON
+    # list in a TEXT column, which migration 004 converts
+    Column("scores", LargeBinary),
+    Column("created_at", Text),
+)
+
+# Chunk hydration by id; the expanding parameter renders the IN list per call
+# while the compiled statement itself is cached
+SELECT_CHUNKS_BY_IDS = select(
+    chunks_table.c.id, chunks_table.c.document_id, chunks_table.c.seq, chunks_table.c.text
+).where(chunks_table.c.id.in_(bindparam("ids", expanding=True)))
+
+def content_hash(text: str) -> str:
+    """Content address for a chunk's text"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _upsert(table: Table):
+    """INSERT that overwrites the row with the same primary key, as REPLACE INTO did
+
+    None on dialects without an upsert clause; _write_upsert then deletes the
+    old rows before inserting
+    """
+    dialect = engine.dialect.name
+    if dialect == "sqlite":
+        return table.insert().prefix_with("OR REPLACE")
+    keys = [c.name for c in table.primary_key]
+    if dialect == "postgresql":
+        stmt = postgresql.insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=keys, set_={c.name: stmt.excluded[c.name] for c in table.c if c.name not in keys})
+    if dialect in ("mysql", "mariadb"):
+        stmt = mysql.insert(table)
+        return stmt.on_duplicate_key_update({c.name: stmt.inserted[c.name] for c in table.c if c.name not in keys})
+    return None
+
+
+def _write_upsert(conn: Connection, table: Table, stmt, rows: Dict | List[Dict]) -> None:
+    if stmt is None:
+        key = table.primary_key.columns[0]
+        ids = [r[key.name] for r in (rows if isinstance(rows, list) else [rows])]
+        conn.execute(table.delete().where(key.in_(ids)))
+        stmt = table.insert()
+    conn.execute(stmt, rows)
+
+
+# Re-ingesting a changed file overwrites its rows
+_upsert_document = _upsert(documents_table)
+_upsert_chunks = _upsert(chunks_table)
+
+
+_upsert_embeddings = _upsert(embeddings_table)
+
+SELECT_STORED_EMBEDDINGS = select(
+    embeddings_table.c.chunk_id, embeddings_table.c.model, embeddings_table.c.content_hash,
+    embeddings_table.c.dim, embeddings_table.c.vector,
+).where(embeddings_table.c.vector.is_not(None))
+
+
+_upsert_query_embeddings = _upsert(query_embeddings_table)
+
+SELECT_QUERY_EMBEDDINGS = select(
+    query_embeddings_table.c.key, query_embeddings_table.c.vector
+).where(query_embeddings_table.c.key.in_(bindparam("keys", expanding=True)),
+        query_embeddings_table.c.created_at >= bindparam("cutoff"))
+
+_PRUNE_QUERY_EMBEDDINGS = query_embeddings_table.delete().where(
+    query_embeddings_table.c.created_at < bindparam("cutoff"))
+
+
+def _query_embedding_key(model: str, text: str) -> str:
+    return content_hash(f"{model}\n{text}")
+
+
+def _query_embedding_cutoff(now: datetime) -> str:
+    return (now - timedelta(days=settings.query_embeddings_retention_days)).isoformat()
+
+
+def load_query_embeddings(model: str, texts: List[str]) -> Dict[str, bytes]:
+    """Stored vector blobs for whichever of texts have one, keyed by text"""
+    keys = {_query_embedding_key(model, t): t for t in texts}
+    with engine.connect() as conn:
+        rows = conn.execute(SELECT_QUERY_EMBEDDINGS, {
+            "keys": list(keys), "cutoff": _query_embedding_cutoff(datetime.utcnow())}).fetchall()
+    return {keys[key]: blob for key, blob in rows}
+
+
+def store_query_embeddings(model: str, blobs: Dict[str, bytes]) -> None:
+    """Persist vector blobs keyed by query text, pruning rows past the retention window"""
+    if not blobs:
+        return
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        _write_upsert(conn, query_embeddings_table, _upsert_query_embeddings, [
+            {"key": _query_embedding_key(model, t), "model": model, "vector": blob, "created_at": now.isoformat()}
+            for t, blob in blobs.items()
+        ])
+        # An index range scan that finds nothing on most calls
+        conn.execute(_PRUNE_QUERY_EMBEDDINGS, {"cutoff": _query_embedding_cutoff(now)})
+
+
+def upsert_document(conn: Connection, row: Dict) -> None:
+    _write_upsert(conn, documents_table, _upsert_document, row)
+
+
+def bulk_insert_chunks(conn: Connection, rows: List[Dict]) -> None:
+    """Write all chunk rows in one executemany instead of a statement per chunk"""
+    if rows:
+        _write_upsert(conn, chunks_table, _upsert_chunks, rows)
+
+
+def bulk_upsert_embeddings(conn: Connection, rows: List[Dict]) -> None:
+    if rows:
+        _write_upsert(conn, embeddings_table, _upsert_embeddings, rows)
+
+
+schema_meta_table = Table(
+    "schema_meta", metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", Text),
+    Column("applied_at", Text),
+)
+
+
+def _add_column(conn: Connection, table: str, column: str, col_type: str) -> None:
+    """ALTER TABLE ADD COLUMN, skipped when a pre-versioning database already has it"""
+    if column not in {c["name"] for c in inspect(conn).get_columns(table)}:
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}")
+
+
+def _migrate_secondary_indexes(conn: Connection) -> None:
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS idx_chunks_document_seq ON chunks(document_id, seq)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS idx_documents_hash ON documents(hash)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS idx_embeddings_vector_id ON embeddings(vector_id)")
+
+
+def _migrate_embedding_vectors(conn: Connection) -> None:
+    _add_column(conn, "embeddings", "vector", "BLOB")
+    _add_column(conn, "embeddings", "content_hash", "TEXT")
+
+
+def _migrate_chunk_content_hash(conn: Connection) -> None:
+    _add_column(conn, "chunks", "content_hash", "TEXT")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS idx_chunks_content_hash ON chunks(content_hash)")
+
+
+def _migrate_retrieval_log_scores(conn: Connection) -> None:
+    # Raw driver values: JSON text from before the change, or bytes SQLite
+    # already accepted into the TEXT column
+    rows = conn.exec_driver_sql("SELECT id, scores FROM retrieval_logs WHERE scores IS NOT NULL").fetchall()
+    if conn.dialect.name != "sqlite":
+        # SQLite stores BLOB values in a TEXT column as-is; other databases need a binary column
+        conn.exec_driver_sql("ALTER TABLE retrieval_logs DROP COLUMN scores")
+        conn.exec_driver_sql(f"ALTER TABLE retrieval_logs ADD COLUMN scores {LargeBinary().compile(dialect=conn.dialect)}")
+    packed = []
+    for row_id, scores in rows:
+        if not isinstance(scores, str):
+            continue
+        try:
+            packed.append({"row_id": row_id, "packed": pack_scores([s or 0.0 for s in loads(scores)])})
+        except (ValueError, TypeError):
+            logger.warning(f"Dropping unreadable scores of retrieval log {row_id}")
+            packed.append({"row_id": row_id, "packed": None})
+    if packed:
+        conn.execute(retrieval_logs_table.update()
+                     .where(retrieval_logs_table.c.id == bindparam("row_id"))
+                     .values(scores=bindparam("packed")), packed)
+
+
+def _migrate_query_embedding_retention(conn: Connection) -> None:
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS idx_query_embeddings_created_at "
+                         "ON query_embeddings(created_at)")
+
+
+# Upgrades from the original schema, applied in order. A fresh database is
+# created from the tables above and stamped with the latest version; append
+# new steps here whenever a table definition changes
+MIGRATIONS = [
+    ("001_secondary_indexes", _migrate_secondary_indexes),
+    ("002_embedding_vectors", _migrate_embedding_vectors),
+    ("003_chunk_content_hash", _migrate_chunk_content_hash),
+    ("004_retrieval_log_scores_blob", _migrate_retrieval_log_scores),
+    ("005_query_embedding_retention", _migrate_query_embedding_retention),
+]
+
+
+def analyze() -> None:
+    """Rebuild SQLite planner statistics, e.g. after a bulk ingest"""
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
 
-engine: Engine = create_engine(settings.db_url, future=True)
-
-INIT_SQL = r"""
-CREATE TABLE IF NOT EXISTS documents (
-  id TEXT PRIMARY KEY,
-  path TEXT,
-  source TEXT,
-  title TEXT,
-  author TEXT,
-  mime TEXT,
-  created_at TEXT,
-  updated_at TEXT,
-  hash TEXT,
-  tags TEXT
-);
-
-CREATE TABLE IF NOT EXISTS chunks (
-  id TEXT PRIMARY KEY,
-  document_id TEXT,
-  seq INTEGER,
-  text TEXT,
-  tokens INTEGER,
-  metadata TEXT,
-  created_at TEXT
-);
-
-CREATE TABLE IF NOT EXISTS embeddings (
-  chunk_id TEXT PRIMARY KEY,
-  provider TEXT,
-  model TEXT,
-  dim INTEGER,
-  vector_id TEXT,
-  created_at TEXT
-);
-
-CREATE TABLE IF NOT EXISTS retrieval_logs (
-  id TEXT PRIMARY KEY,
-  query TEXT,
-  filters TEXT,
-  candidate_ids TEXT,
-  chosen_ids TEXT,
-  scores TEXT,
-  created_at TEXT
-);
-"""
 
 def init_db() -> None:
     with engine.begin() as conn:
-        for stmt in INIT_SQL.split(";\n\n"):
-            if stmt.strip():
-                conn.execute(text(stmt))
+        fresh = not inspect(conn).has_table("chunks")
+        metadata.create_all(conn)
+        version = conn.execute(select(func.coalesce(func.max(schema_meta_table.c.version), 0))).scalar()
+        pending = list(enumerate(MIGRATIONS, start=1))[version:]
+        if not pending:
+            return
+        now = datetime.utcnow().isoformat()
+        for number, (name, migrate) in pending:
+            if not fresh:
+                logger.info(f"Applying schema migration {name}")
+                migrate(conn)
+            conn.execute(schema_meta_table.insert(), {"version": number, "name": name, "applied_at": now})
+
+
+# Retrieval logs are written behind the request path: /query only enqueues a
+# row, and a background thread inserts them in batches
+LOG_BATCH_SIZE = 100
+LOG_FLUSH_INTERVAL = 0.25
+
+_log_queue: "queue.Queue[Dict[str, Any] | None]" = queue.Queue(maxsize=10000)
+_log_flusher: threading.Thread | None = None
+_log_flusher_lock = threading.Lock()
+
+
+def pack_scores(scores: List[float]) -> bytes:
+    """4 bytes per score instead of ~10 characters of JSON"""
+    return struct.pack(f"<{len(scores)}f", *scores)
+
+
+def unpack_scores(blob: bytes) -> List[float]:
+    return list(struct.unpack(f"<{len(blob) // 4}f", blob))
+
+
+def log_retrieval(query: str, candidate_ids: List[str], chosen_ids: List[str],
+                  scores: List[float], filters: Dict[str, Any] | None = None) -> None:
+    """Queue a retrieval log row; never blocks, drops the row if the queue is full"""
+    _ensure_log_flusher()
+    try:
+        _log_queue.put_nowait({
+            "id": uuid.uuid4().hex,
+            "query": query,
+            "filters": dumps(filters or {}),
+            "candidate_ids": dumps(candidate_ids),
+            "chosen_ids": dumps(chosen_ids),
+            "scores": pack_scores(scores),
+            "created_at": datetime.utcnow().isoformat(),
+        })
+    except queue.Full:
+        logger.warning("Retrieval log queue full, dropping entry")
+
+
+def _ensure_log_flusher() -> None:
+    global _log_flusher
+    if _log_flusher is None:
+        with _log_flusher_lock:
+            if _log_flusher is None:
+                _log_flusher = threading.Thread(target=_flush_retrieval_logs, name="retrieval-log-flusher",
+                                                daemon=True)
+                _log_flusher.start()
+                atexit.register(_stop_log_flusher)
+
+
+def _flush_retrieval_logs() -> None:
+    """Insert queued rows every LOG_FLUSH_INTERVAL or LOG_BATCH_SIZE rows, until a None sentinel"""
+    insert = retrieval_logs_table.insert()
+    stopping = False
+    while not stopping:
+        row = _log_queue.get()
+        if row is None:
+            break
+        batch = [row]
+        deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+        while len(batch) < LOG_BATCH_SIZE:
+            try:
+                row = _log_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if row is None:
+                stopping = True
+                break
+            batch.append(row)
+        try:
+            with engine.begin() as conn:
+                conn.execute(insert, batch)
+        except Exception as e:
+            logger.warning(f"Failed to write {len(batch)} retrieval logs: {e}")
+
+
+def _stop_log_flusher(timeout: float = 5.0) -> None:
+    """Drain pending rows on shutdown"""
+    if _log_flusher is not None and _log_flusher.is_alive():
+        _log_queue.put(None)
+        _log_flusher.join(timeout)
@@ -1,32 +1,144 @@
 # Memory and conversation state management utilities
-from typing import Dict, List, Any
+from __future__ import annotations
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Any
+from core.config import settings
+from core.logging import logger
+
+
+# Default importance by role; callers can override it via metadata["importance"]
+ROLE_IMPORTANCE = {"system": 4.0, "tool": 2.0}
+
+
+def _approx_tokens(text: str) -> int:
+    # Same 4 chars/token estimate the context builder uses for token budgets
+    return len(text) // 4 + 1
+
+
+def _retention(message: Dict[str, Any], position: int, size: int) -> float:
+    """Value of keeping a message: recency plus importance plus times it was cited"""
+    meta = message["metadata"]
+    importance = meta.get("importance", ROLE_IMPORTANCE.get(message["role"], 1.0))
+    return (position + 1) / size + importance + meta.get("cite_count", 0)
+
 
 class ConversationMemory:
-    """Simple in-memory conversation state management"""
+    """Simple in-memory conversation state management
+    
+    Each thread keeps at most `max_turns` messages and roughly `max_tokens`
+    tokens. Past either cap, the lowest-value message among the oldest 10%
+    is evicted, so system/tool messages and cited turns outlive stale chatter.
     
-    def __init__(self):
-        self.conversations: Dict[str, List[Dict[str, Any]]] = {}
+    Threads idle for longer than `thread_ttl` seconds are dropped, as are the
+    least recently active ones beyond `max_threads`.
+    """
+    
+    def __init__(self, max_turns: int | None = None, max_tokens: int | None = None,
+                 max_threads: int | None = None, thread_ttl: float | None = None):
+        self.max_turns = max_turns or settings.chat_max_turns or 200
+        self.max_tokens = max_tokens or settings.chat_max_tokens
+        self.max_threads = max_threads or settings.chat_max_threads
+        self.thread_ttl = thread_ttl or settings.chat_thread_ttl_seconds
+        # Ordered by last write, so the stalest thread is always first
+        self.conversations: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._tokens: Dict[str, int] = {}
+        self._last_active: Dict[str, float] = {}
     
     def add_message(self, thread_id: str, role: str, content: str, metadata: Dict[str, Any] = None):
         """Add a message to a conversation thread"""
-        if thread_id not in self.conversations:
-            self.conversations[thread_id] = []
+        now = time.monotonic()
+        # An expired thread starts over rather than being revived by this write
+        self._expire(thread_id, now)
+        thread = self.conversations.pop(thread_id, None)
+        if thread is None:
+            thread = deque()
+            self._tokens[thread_id] = 0
+        # Re-inserting moves the thread to the back of the activity order
+        self.conversations[thread_id] = thread
+        self._last_active[thread_id] = now
+        self.sweep(now)
         
         message = {
             "role": role,
             "content": content,
             "metadata": metadata or {}
         }
-        self.conversations[thread_id].append(message)
+        thread.append(message)
+        self._tokens[thread_id] += _approx_tokens(content)
+        self._evict(thread_id)
+    
+    def _evict(self, thread_id: str):
+        """Drop low-value old messages until the thread fits both caps"""
+        thread = self.conversations[thread_id]
+        while len(thread) > 1 and (len(thread) > self.max_turns or
+                                   (self.max_tokens and self._tokens[thread_id] > self.max_tokens)):
+            size = len(thread)
+            window = max(1, size // 10)
+            victim = min(range(window), key=lambda i: _retention(thread[i], i, size))
+            self._tokens[thread_id] -= _approx_tokens(thread[victim]["content"])
+            del thread[victim]
+    
+    def summarize_if_over(self, thread_id: str, token_budget: int | None = None, keep_recent: int = 6,
+                          summarize: Callable[[List[Dict[str, Any]]], str] | None = None) -> bool:
+        """Fold all but the last `keep_recent` messages into one summary message
+        
+        Runs only when the thread exceeds `token_budget` tokens, so each turn's
+        prompt stays bounded instead of re-sending the whole history. An earlier
+        summary is folded into the new one. Returns True if the thread was compacted.
+        """
+        budget = token_budget or settings.chat_history_token_budget
+        thread = self.conversations.get(thread_id)
+        if not thread or self._tokens[thread_id] <= budget or len(thread) <= keep_recent + 1:
+            return False
+        
+        if summarize is None:
+            from rag.generator import summarize
+        old = [thread.popleft() for _ in range(len(thread) - keep_recent)]
+        try:
+            summary = summarize(old)
+        except Exception as e:
+            logger.warning(f"Conversation summary failed, keeping full history: {e}")
+            thread.extendleft(reversed(old))
+            return False
+        
+        thread.appendleft({
+            "role": "system",
+            "content": f"Summary of the earlier conversation:\n{summary}",
+            "metadata": {"summary": True, "importance": ROLE_IMPORTANCE["system"]},
+        })
+        self._tokens[thread_id] = sum(_approx_tokens(m["content"]) for m in thread)
+        return True
+    
+    def sweep(self, now: float | None = None) -> int:
+        """Drop expired and over-capacity threads; returns how many were removed"""
+        now = time.monotonic() if now is None else now
+        removed = 0
+        for thread_id in list(self.conversations):
+            idle = now - self._last_active[thread_id]
+            if idle <= self.thread_ttl and len(self.conversations) <= self.max_threads:
+                break
+            self.clear_conversation(thread_id)
+            removed += 1
+        return removed
     
     def get_conversation(self, thread_id: str) -> List[Dict[str, Any]]:
         """Get all messages in a conversation thread"""
-        return self.conversations.get(thread_id, [])
+        self._expire(thread_id, time.monotonic())
+        return list(self.conversations.get(thread_id, ()))
+    
+    def _expire(self, thread_id: str, now: float):
+        """Clear the thread if it has been idle longer than thread_ttl"""
+        last_active = self._last_active.get(thread_id)
+        if last_active is not None and now - last_active > self.thread_ttl:
+            self.clear_conversation(thread_id)
     
     def clear_conversation(self, thread_id: str):
         """Clear a conversation thread"""
         if thread_id in self.conversations:
             del self.conversations[thread_id]
+            del self._tokens[thread_id]
+            del self._last_active[thread_id]
 
 # Global memory instance
 memory = ConversationMemory()
@@ -51,6 +51,14 @@ CREATE TABLE IF NOT EXISTS embeddings (
     FOREIGN KEY (chunk_id) REFERENCES chunks (id) ON DELETE CASCADE
 );
 
+-- Query embeddings table: query vectors reused across processes
+CREATE TABLE IF NOT EXISTS query_embeddings (
+    key TEXT PRIMARY KEY,                  -- blake2b of model and query text
+    model TEXT NOT NULL,                   -- Embedding model (text-embedding-3-small)
+    vector BLOB NOT NULL,                  -- Packed little-endian float32 vector
+    created_at TEXT NOT NULL               -- When the query was first embedded
+);
+
 -- Retrieval logs table: tracks search queries and results for analytics
 CREATE TABLE IF NOT EXISTS retrieval_logs (
     id TEXT PRIMARY KEY,                    -- Unique log entry ID
@@ -60,7 +68,7 @@ CREATE TABLE IF NOT EXISTS retrieval_logs (
     filters TEXT DEFAULT '{}',             -- Applied filters as JSON
     candidate_ids TEXT DEFAULT '[]',       -- Retrieved chunk IDs as JSON array
     chosen_ids TEXT DEFAULT '[]',          -- Final selected chunk IDs as JSON array
-    scores TEXT DEFAULT '[]',              -- Relevance scores as JSON array
+    scores BLOB,                           -- Relevance scores as packed little-endian float32
     reranker TEXT,                         -- Reranker used (voyage, cohere, none)
     k INTEGER DEFAULT 12,                  -- Number of results requested
     response_time_ms INTEGER,              -- Query response time in milliseconds
@@ -133,6 +141,7 @@ CREATE INDEX IF NOT EXISTS idx_chunks_embedding_status ON chunks(embedding_statu
 
 CREATE INDEX IF NOT EXISTS idx_embeddings_provider ON embeddings(provider, model);
 CREATE INDEX IF NOT EXISTS idx_embeddings_created_at ON embeddings(created_at);
+CREATE INDEX IF NOT EXISTS idx_embeddings_vector_id ON embeddings(vector_id);
 
 -- Views for common queries
 CREATE VIEW IF NOT EXISTS document_stats AS
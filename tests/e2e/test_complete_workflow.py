@@ -2,206 +2,234 @@
 End-to-end tests for complete Vectorpenter workflow
 """
 
+import importlib
 import pytest
-import tempfile
 import os
 from pathlib import Path
 from unittest.mock import Mock, patch, MagicMock
 import json
 
-from apps.cli import cmd_ingest, cmd_index, cmd_ask
-from core.validation import startup_validation
+
+@pytest.fixture(scope="session")
+def temp_data_dir(tmp_path_factory):
+    """Create a temporary data directory with sample files, once per test run
+    
+    Tests only read from it; one that needs to write should take tmp_path instead.
+    """
+    data_dir = tmp_path_factory.mktemp("data")
+    inputs_dir = data_dir / "inputs"
+    inputs_dir.mkdir()
+    
+    # Create sample text file
+    sample_txt = inputs_dir / "sample.txt"
+    sample_txt.write_text("""
+    Vectorpenter is a local AI fabric for document processing.
+    It combines vector search with keyword search for better results.
+    The system supports multiple file formats including PDF and DOCX.
+    Users can ask questions about their documents using natural language.
+    """)
+    
+    # Create sample markdown file
+    sample_md = inputs_dir / "guide.md"
+    sample_md.write_text("""
+    # Vectorpenter User Guide
+    
+    ## Overview
+    Vectorpenter helps you search through your documents using AI.
+    
+    ## Features
+    - Hybrid search combining vector and keyword search
+    - Smart reranking with Voyage AI
+    - Support for multiple file formats
+    - Local-first architecture
+    
+    ## Getting Started
+    1. Install dependencies
+    2. Configure API keys
+    3. Ingest your documents
+    4. Start asking questions
+    """)
+    
+    return str(data_dir)
 
 
 class TestCompleteWorkflow:
     """Test complete workflow from ingestion to query"""
     
     @pytest.fixture
-    def temp_data_dir(self):
-        """Create temporary data directory with sample files"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            data_dir = Path(temp_dir) / "data"
-            inputs_dir = data_dir / "inputs"
-            inputs_dir.mkdir(parents=True)
-            
-            # Create sample text file
-            sample_txt = inputs_dir / "sample.txt"
-            sample_txt.write_text("""
-            Vectorpenter is a local AI fabric for document processing.
-            It combines vector search with keyword search for better results.
-            The system supports multiple file formats including PDF and DOCX.
-            Users can ask questions about their documents using natural language.
-            """)
-            
-            # Create sample markdown file
-            sample_md = inputs_dir / "guide.md"
-            sample_md.write_text("""
-            # Vectorpenter User Guide
-            
-            ## Overview
-            Vectorpenter helps you search through your documents using AI.
-            
-            ## Features
-            - Hybrid search combining vector and keyword search
-            - Smart reranking with Voyage AI
-            - Support for multiple file formats
-            - Local-first architecture
-            
-            ## Getting Started
-            1. Install dependencies
-            2. Configure API keys
-            3. Ingest your documents
-            4. Start asking questions
-            """)
-            
-            yield str(data_dir)
+    def cli(self):
+        """apps.cli, imported when a test runs rather than at collection
+        
+        apps.cli binds the pipeline functions at import, so tests patch them
+        on apps.cli itself rather than on the modules that define them.
+        """
+        return importlib.import_module("apps.cli")
     
     @patch('core.validation.startup_validation')
     def test_startup_validation(self, mock_startup_validation):
         """Test startup validation process"""
+        from core.validation import startup_validation
         mock_startup_validation.return_value = True
         
         result = startup_validation()
         assert result is True
         mock_startup_validation.assert_called_once()
     
-    @patch('ingest.pipeline.ingest_path')
-    def test_cmd_ingest_success(self, mock_ingest_path, temp_data_dir):
+    @patch('apps.cli.ingest_path')
+    def test_cmd_ingest_success(self, mock_ingest_path, temp_data_dir, cli):
         """Test successful document ingestion"""
         mock_ingest_path.return_value = {"documents": 2, "chunks": 8}
         
         inputs_path = str(Path(temp_data_dir) / "inputs")
         
         # Should not raise exception
-        cmd_ingest(inputs_path)
+        cli.cmd_ingest(inputs_path)
         
         mock_ingest_path.assert_called_once_with(inputs_path)
     
-    @patch('index.upsert.build_and_upsert')
-    @patch('search.hybrid.index_typesense')
-    def test_cmd_index_success(self, mock_index_typesense, mock_build_and_upsert):
+    @patch('apps.cli.build_and_upsert')
+    @patch('apps.cli.index_typesense')
+    def test_cmd_index_success(self, mock_index_typesense, mock_build_and_upsert, cli):
         """Test successful indexing"""
         mock_build_and_upsert.return_value = {"upserts": 8, "namespace": "default"}
         mock_index_typesense.return_value = {"indexed": 8, "skipped": False}
         
         # Should not raise exception
-        cmd_index()
+        cli.cmd_index()
         
         mock_build_and_upsert.assert_called_once()
         mock_index_typesense.assert_called_once()
     
-    @patch('index.embedder.embed_texts')
-    @patch('rag.retriever.vector_search')
-    @patch('rag.context_builder.hydrate_matches')
-    @patch('rag.context_builder.build_context')
-    @patch('rag.generator.answer')
-    def test_cmd_ask_vector_only(self, mock_answer, mock_build_context, mock_hydrate, 
-                                 mock_vector_search, mock_embed):
+    @pytest.fixture
+    def deps(self, cli):
+        """cmd_ask pipeline with every stage replaced by a Mock
+        
+        Defaults describe one local hit; tests override only the stages they
+        exercise instead of patching each module the stage lives in.
+        """
+        hit = {"id": "chunk1", "text": "Test", "doc": "test.txt", "seq": 0}
+        return cli.Deps(
+            embed=Mock(return_value=[0.1] * 1536),
+            vector_search=Mock(return_value=([{"id": "chunk1", "score": 0.9}], 0.9)),
+            hybrid_search=Mock(return_value=([{"id": "chunk1", "score": 0.9}], 0.9)),
+            typesense_available=Mock(return_value=False),
+            hydrate=Mock(return_value=[hit]),
+            rerank=Mock(side_effect=lambda q, snippets: snippets),
+            rerank_available=Mock(return_value=False),
+            expand=Mock(side_effect=lambda snippets, **kw: snippets),
+            build_context=Mock(return_value="[#1] test.txt::0\nTest"),
+            answer=Mock(return_value=["Test answer [#1]."]),
+        )
+    
+    def test_cmd_ask_vector_only(self, cli, deps):
         """Test asking questions with vector-only search"""
-        # Setup mocks
-        mock_embed.return_value = [[0.1] * 1536]
-        mock_vector_search.return_value = [
-            {"id": "chunk1", "score": 0.9, "text": None, "meta": {}}
-        ]
-        mock_hydrate.return_value = [
+        deps.hydrate.return_value = [
             {"id": "chunk1", "text": "Vectorpenter is a local AI fabric", "doc": "sample.txt", "seq": 0}
         ]
-        mock_build_context.return_value = "[#1] sample.txt::0\nVectorpenter is a local AI fabric"
-        mock_answer.return_value = "Vectorpenter is a local AI fabric for document processing [#1]."
+        deps.build_context.return_value = "[#1] sample.txt::0\nVectorpenter is a local AI fabric"
+        deps.answer.return_value = ["Vectorpenter is a local AI fabric ", "for document processing [#1]."]
         
         # Test the command (this will print output)
         with patch('builtins.print') as mock_print:
-            cmd_ask("What is Vectorpenter?", k=5, hybrid=False, rerank=False)
+            cli.cmd_ask("What is Vectorpenter?", k=5, hybrid=False, rerank=False, deps=deps)
         
         # Verify pipeline was called correctly
-        mock_embed.assert_called_once_with(["What is Vectorpenter?"])
-        mock_vector_search.assert_called_once()
-        mock_hydrate.assert_called_once()
-        mock_build_context.assert_called_once()
-        mock_answer.assert_called_once()
+        deps.embed.assert_called_once_with("What is Vectorpenter?")
+        deps.vector_search.assert_called_once()
+        assert deps.vector_search.call_args.kwargs["top_k"] == 5
+        deps.hydrate.assert_called_once()
+        deps.build_context.assert_called_once()
+        deps.answer.assert_called_once_with("What is Vectorpenter?", deps.build_context.return_value,
+                                            query_vec=deps.embed.return_value)
+        deps.hybrid_search.assert_not_called()
         
         # Verify output was printed
         mock_print.assert_called()
         print_calls = [call[0][0] for call in mock_print.call_args_list]
         output_text = " ".join(print_calls)
         assert "Vectorpenter is a local AI fabric" in output_text
+        
+        # Each streamed delta is printed as it arrives, in order, without a newline
+        streamed = [c for c in mock_print.call_args_list if c.kwargs.get("end") == ""]
+        assert [c[0][0] for c in streamed] == deps.answer.return_value
+        assert all(c.kwargs.get("flush") for c in streamed)
     
-    @patch('search.hybrid.hybrid_search')
-    @patch('search.hybrid.is_available')
-    @patch('index.embedder.embed_texts')
-    @patch('rag.context_builder.hydrate_matches')
-    @patch('rag.context_builder.build_context')
-    @patch('rag.generator.answer')
-    def test_cmd_ask_hybrid_search(self, mock_answer, mock_build_context, mock_hydrate,
-                                   mock_embed, mock_typesense_available, mock_hybrid_search):
+    def test_cmd_ask_hybrid_search(self, cli, deps):
         """Test asking questions with hybrid search"""
-        # Setup mocks
-        mock_embed.return_value = [[0.1] * 1536]
-        mock_typesense_available.return_value = True
-        mock_hybrid_search.return_value = [
+        deps.typesense_available.return_value = True
+        deps.hybrid_search.return_value = ([
             {"id": "chunk1", "score": 0.9, "source": "vector"},
             {"id": "chunk2", "score": 0.8, "source": "keyword"}
-        ]
-        mock_hydrate.return_value = [
+        ], 0.9)
+        deps.hydrate.return_value = [
             {"id": "chunk1", "text": "Vector search content", "doc": "sample.txt", "seq": 0},
             {"id": "chunk2", "text": "Keyword search content", "doc": "guide.md", "seq": 1}
         ]
-        mock_build_context.return_value = "[#1] sample.txt::0\nVector search content\n\n[#2] guide.md::1\nKeyword search content"
-        mock_answer.return_value = "The system uses both vector [#1] and keyword search [#2]."
+        deps.answer.return_value = ["The system uses both vector [#1] and keyword search [#2]."]
         
         with patch('builtins.print') as mock_print:
-            cmd_ask("How does search work?", k=5, hybrid=True, rerank=False)
+            cli.cmd_ask("How does search work?", k=5, hybrid=True, rerank=False, deps=deps)
         
         # Verify hybrid search was used
-        mock_hybrid_search.assert_called_once()
-        mock_typesense_available.assert_called_once()
+        deps.hybrid_search.assert_called_once()
+        deps.typesense_available.assert_called_once()
+        deps.vector_search.assert_not_called()
         
         # Verify output contains hybrid indication
         print_calls = [call[0][0] for call in mock_print.call_args_list]
         output_text = " ".join(print_calls)
         assert "hybrid" in output_text.lower()
     
-    @patch('rag.reranker.rerank')
-    @patch('rag.reranker.is_rerank_available')
-    @patch('index.embedder.embed_texts')
-    @patch('rag.retriever.vector_search')
-    @patch('rag.context_builder.hydrate_matches')
-    @patch('rag.context_builder.build_context')
-    @patch('rag.generator.answer')
-    def test_cmd_ask_with_reranking(self, mock_answer, mock_build_context, mock_hydrate,
-                                    mock_vector_search, mock_embed, mock_rerank_available, mock_rerank):
+    def test_cmd_ask_with_reranking(self, cli, deps):
         """Test asking questions with reranking"""
-        # Setup mocks
-        mock_embed.return_value = [[0.1] * 1536]
-        mock_rerank_available.return_value = True
-        mock_vector_search.return_value = [
+        deps.rerank_available.return_value = True
+        deps.vector_search.return_value = ([
             {"id": "chunk1", "score": 0.9},
             {"id": "chunk2", "score": 0.8}
-        ]
-        mock_hydrate.return_value = [
+        ], 0.9)
+        deps.hydrate.return_value = [
             {"id": "chunk1", "text": "First result", "doc": "doc1.txt", "seq": 0},
             {"id": "chunk2", "text": "Second result", "doc": "doc2.txt", "seq": 0}
         ]
         # Mock reranking to reverse order
-        mock_rerank.return_value = [
+        reranked = [
             {"id": "chunk2", "text": "Second result", "doc": "doc2.txt", "seq": 0, "rerank_score": 0.95},
             {"id": "chunk1", "text": "First result", "doc": "doc1.txt", "seq": 0, "rerank_score": 0.85}
         ]
-        mock_build_context.return_value = "[#1] doc2.txt::0\nSecond result\n\n[#2] doc1.txt::0\nFirst result"
-        mock_answer.return_value = "The reranked results show improved relevance [#1] [#2]."
+        deps.rerank.side_effect = None
+        deps.rerank.return_value = reranked
         
         with patch('builtins.print') as mock_print:
-            cmd_ask("Test query", k=5, hybrid=False, rerank=True)
+            cli.cmd_ask("Test query", k=5, hybrid=False, rerank=True, deps=deps)
         
-        # Verify reranking was used
-        mock_rerank.assert_called_once()
-        mock_rerank_available.assert_called_once()
+        # Verify reranking was used on an oversampled candidate set
+        deps.rerank.assert_called_once()
+        deps.rerank_available.assert_called_once()
+        assert deps.vector_search.call_args.kwargs["top_k"] == 10
+        assert deps.expand.call_args.args[0] == reranked
         
         # Verify output contains rerank indication
         print_calls = [call[0][0] for call in mock_print.call_args_list]
         output_text = " ".join(print_calls)
         assert "rerank" in output_text.lower()
     
+    def test_concurrent_asks_share_one_embedding_request(self, cli, deps):
+        """Concurrent asks embed their queries in a single embed_texts call"""
+        from concurrent.futures import ThreadPoolExecutor
+        from index.embedder import EmbedCoalescer
+        
+        queries = [f"question {i}" for i in range(32)]
+        deps.embed = EmbedCoalescer(max_batch=len(queries), max_wait=5.0).embed
+        
+        with patch('index.embedder.embed_texts') as mock_embed, patch('builtins.print'):
+            mock_embed.side_effect = lambda texts: [[0.1] * 1536 for _ in texts]
+            with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+                list(executor.map(lambda q: cli.cmd_ask(q, k=5, deps=deps), queries))
+        
+        assert mock_embed.call_count == 1
+        assert sorted(mock_embed.call_args[0][0]) == sorted(queries)
+        assert deps.vector_search.call_count == len(queries)
+    
     def test_error_handling_missing_api_key(self):
         """Test error handling when API keys are missing"""
         with patch('core.config.settings') as mock_settings:
@@ -216,31 +244,18 @@ class TestCompleteWorkflow:
             assert "API key not configured" in str(exc_info.value)
     
     @patch('core.monitoring.metrics_collector')
-    def test_metrics_collection_during_query(self, mock_metrics):
+    def test_metrics_collection_during_query(self, mock_metrics, cli, deps):
         """Test that metrics are collected during query processing"""
         mock_metrics.start_query.return_value = "test-query-id"
         
-        with patch('index.embedder.embed_texts') as mock_embed, \
-             patch('rag.retriever.vector_search') as mock_search, \
-             patch('rag.context_builder.hydrate_matches') as mock_hydrate, \
-             patch('rag.context_builder.build_context') as mock_build, \
-             patch('rag.generator.answer') as mock_answer:
-            
-            # Setup mocks
-            mock_embed.return_value = [[0.1] * 1536]
-            mock_search.return_value = [{"id": "chunk1", "score": 0.9}]
-            mock_hydrate.return_value = [{"id": "chunk1", "text": "Test", "doc": "test.txt", "seq": 0}]
-            mock_build.return_value = "[#1] test.txt::0\nTest"
-            mock_answer.return_value = "Test answer [#1]."
-            
-            with patch('builtins.print'):
-                cmd_ask("test query", k=5, hybrid=False, rerank=False)
-            
-            # Verify metrics were tracked
-            # Note: This would need actual integration with the monitoring decorators
-            # For now, we just verify the mocks were called
-            assert mock_embed.called
-            assert mock_search.called
+        with patch('builtins.print'):
+            cli.cmd_ask("test query", k=5, hybrid=False, rerank=False, deps=deps)
+        
+        # Verify metrics were tracked
+        # Note: This would need actual integration with the monitoring decorators
+        # For now, we just verify the mocks were called
+        assert deps.embed.called
+        assert deps.vector_search.called
 
 
 @pytest.mark.integration
@@ -335,6 +350,37 @@ class TestAPIWorkflow:
             assert data["search_type"] == "vector"
             assert data["sources_count"] == 1
 
+    def test_api_query_stream_endpoint(self):
+        """Test that /query/stream returns the answer deltas as a text stream"""
+        from fastapi.testclient import TestClient
+        from apps.api import app
+        from core.auth import get_current_user
+
+        app.dependency_overrides[get_current_user] = lambda: Mock()
+        client = TestClient(app)
+
+        try:
+            with patch('apps.api.engine'), \
+                 patch('apps.api.embed_query', return_value=[0.1] * 1536), \
+                 patch('apps.api.vector_search', return_value=([{"id": "chunk1", "score": 0.9}], 0.9)), \
+                 patch('apps.api.hydrate_matches') as mock_hydrate, \
+                 patch('rag.context_builder.expand_with_neighbors', side_effect=lambda s, **kw: s), \
+                 patch('rag.context_builder.build_combined_context', return_value="[#1] test.txt::0\nTest content"), \
+                 patch('apps.api.log_retrieval'), \
+                 patch('apps.api.answer_stream') as mock_stream:
+
+                mock_hydrate.return_value = [{"id": "chunk1", "text": "Test content", "doc": "test.txt", "seq": 0}]
+                mock_stream.return_value = iter(["This is ", "a test answer [#1]."])
+
+                response = client.post("/query/stream", json={"q": "What is this about?", "k": 5})
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert response.text == "This is a test answer [#1]."
+        assert response.headers["x-search-type"] == "vector"
+        assert response.headers["x-sources-count"] == "1"
+
 
 @pytest.mark.e2e
 class TestRealWorkflow:
@@ -365,28 +411,30 @@ class TestRealWorkflow:
             assert all("text" in chunk for chunk in chunks)
             assert all("seq" in chunk for chunk in chunks)
     
-    @patch('state.db.engine')
-    def test_database_operations(self, mock_engine):
+    @patch('ingest.pipeline.analyze')
+    @patch('ingest.pipeline.init_db')
+    @patch('ingest.pipeline.engine')
+    def test_database_operations(self, mock_engine, mock_init_db, mock_analyze):
         """Test database operations with mocked SQLite"""
         from ingest.pipeline import ingest_path
         
-        # Mock database connection
+        # Mock database connection; schema setup needs a real engine, so it is skipped
         mock_conn = Mock()
         mock_engine.begin.return_value.__enter__.return_value = mock_conn
         mock_conn.execute.return_value.fetchone.return_value = None  # No existing document
         
         # Test ingestion (will use mocked DB)
-        with patch('ingest.loaders.iter_files') as mock_iter_files, \
-             patch('ingest.parsers.read_text') as mock_read_text, \
-             patch('pathlib.Path.read_bytes') as mock_read_bytes:
+        with patch('ingest.pipeline.iter_files') as mock_iter_files, \
+             patch('ingest.pipeline.read_text') as mock_read_text, \
+             patch('ingest.pipeline._hash_file', return_value="abc123"):
             
             # Setup file mocks
             mock_file = Mock()
             mock_file.suffix = ".txt"
-            mock_file.__str__ = lambda: "test.txt"
+            mock_file.name = "test.txt"
+            mock_file.__str__ = Mock(return_value="test.txt")
             mock_iter_files.return_value = [mock_file]
             mock_read_text.return_value = ("Test content", {"source": "test.txt"})
-            mock_read_bytes.return_value = b"test content"
             
             result = ingest_path("/fake/path")
             
@@ -395,6 +443,7 @@ class TestRealWorkflow:
             
             # Verify database calls were made
             assert mock_conn.execute.call_count >= 2  # At least document + chunk inserts
+            mock_analyze.assert_called_once()
 
 
 @pytest.mark.slow
@@ -420,29 +469,46 @@ class TestPerformanceWorkflow:
         assert all(len(chunk["text"].split()) <= 700 for chunk in chunks)
     
     def test_concurrent_embedding_requests(self):
-        """Test handling of concurrent embedding requests"""
-        import asyncio
+        """Test that concurrent query embeddings are coalesced into one API call"""
         from concurrent.futures import ThreadPoolExecutor
+        from index.embedder import EmbedCoalescer
         
-        def mock_embed_single(text: str):
-            """Mock single embedding call"""
-            time.sleep(0.1)  # Simulate API call
-            return [0.1] * 1536
+        queries = [f"test query {i}" for i in range(10)]
+        # A generous window so the batch only closes once all ten have queued
+        coalescer = EmbedCoalescer(max_batch=len(queries), max_wait=5.0)
         
         with patch('index.embedder.embed_texts') as mock_embed:
-            mock_embed.side_effect = lambda texts: [mock_embed_single(t) for t in texts]
+            mock_embed.side_effect = lambda texts: [[float(t.split()[-1])] * 1536 for t in texts]
+            
+            with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+                results = list(executor.map(coalescer.embed, queries))
             
-            # Test concurrent requests
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                futures = [
-                    executor.submit(mock_embed, [f"test query {i}"])
-                    for i in range(10)
-                ]
-                
-                results = [future.result() for future in futures]
-                
-                assert len(results) == 10
-                assert all(len(result) == 1 for result in results)
+            assert mock_embed.call_count == 1
+            assert sorted(mock_embed.call_args[0][0]) == sorted(queries)
+            assert all(result == [float(i)] * 1536 for i, result in enumerate(results))
+    
+    def test_document_hashing_streams_large_files(self, tmp_path):
+        """Test that change detection hashes files without loading them whole"""
+        import hashlib
+        import os
+        import tracemalloc
+        from ingest.pipeline import _hash_file
+        
+        content = os.urandom(16 * 1024 * 1024)
+        big_pdf = tmp_path / "big.pdf"
+        big_pdf.write_bytes(content)
+        expected = hashlib.sha256(content).hexdigest()
+        del content
+        
+        tracemalloc.start()
+        try:
+            digest = _hash_file(big_pdf)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        
+        assert digest == expected
+        assert peak < 4 * 1024 * 1024  # one 1 MiB buffer, not the 16 MiB file
 
 
 if __name__ == "__main__":
@@ -3,21 +3,65 @@ Integration tests for the complete RAG pipeline
 """
 
 import pytest
+from contextlib import ExitStack
+from dataclasses import dataclass
 from unittest.mock import Mock, patch, MagicMock
 from typing import List, Dict
 import tempfile
 import os
 
 from apps.cli import cmd_ask
+from core.cache import LRUCache, chunk_cache
+from rag.answer_cache import answer_cache
 from rag.retriever import vector_search
-from rag.context_builder import hydrate_matches, build_context
-from rag.generator import answer
+from rag.context_builder import hydrate_matches, build_context, expand_with_neighbors
+from rag.generator import answer, answer_stream
 from rag.reranker import rerank
+from search.hybrid import hybrid_search
+
+
+@dataclass
+class RagMocks:
+    """Stand-ins for every pipeline stage, patched where each one lives"""
+    embed: Mock
+    vector_search: Mock
+    hybrid_search: Mock
+    rerank: Mock
+    hydrate: Mock
+    build_context: Mock
+    answer: Mock
+
+
+RAG_PATCH_TARGETS = {
+    "embed": "index.embedder.embed_texts",
+    "vector_search": "rag.retriever.vector_search",
+    "hybrid_search": "search.hybrid.hybrid_search",
+    "rerank": "rag.reranker.rerank",
+    "hydrate": "rag.context_builder.hydrate_matches",
+    "build_context": "rag.context_builder.build_context",
+    "answer": "rag.generator.answer",
+}
+
+
+@pytest.fixture
+def rag_mocks():
+    """Every pipeline stage patched for the duration of one test"""
+    with ExitStack() as stack:
+        yield RagMocks(**{name: stack.enter_context(patch(target)) for name, target in RAG_PATCH_TARGETS.items()})
 
 
 class TestRAGPipelineIntegration:
     """Test suite for end-to-end RAG pipeline functionality"""
     
+    @pytest.fixture(autouse=True)
+    def clear_chunk_cache(self):
+        """Keep hydrated chunks and generated answers from leaking between tests"""
+        chunk_cache.clear()
+        answer_cache.clear()
+        yield
+        chunk_cache.clear()
+        answer_cache.clear()
+    
     @pytest.fixture
     def mock_database_chunks(self):
         """Mock database chunks for hydration testing"""
@@ -41,7 +85,7 @@ class TestRAGPipelineIntegration:
         """Test hydrating vector results with database content"""
         # Mock database connection and query
         mock_conn = Mock()
-        mock_engine.begin.return_value.__enter__.return_value = mock_conn
+        mock_engine.connect.return_value.__enter__.return_value = mock_conn
         mock_conn.execute.return_value.fetchall.return_value = mock_database_chunks
         
         hydrated_results = hydrate_matches(mock_vector_results)
@@ -54,6 +98,70 @@ class TestRAGPipelineIntegration:
         # Verify SQL query was called
         mock_conn.execute.assert_called_once()
     
+    @patch('rag.context_builder.engine')
+    def test_hydrate_matches_uses_chunk_cache(self, mock_engine, mock_vector_results, mock_database_chunks):
+        """Test that repeat hydrations only query the database for uncached chunks"""
+        mock_conn = Mock()
+        mock_engine.connect.return_value.__enter__.return_value = mock_conn
+        mock_conn.execute.return_value.fetchall.return_value = mock_database_chunks[:2]
+        
+        hydrate_matches(mock_vector_results[:2])
+        
+        mock_conn.execute.return_value.fetchall.return_value = mock_database_chunks[2:]
+        hydrated_results = hydrate_matches([dict(m) for m in mock_vector_results])
+        
+        assert [r["doc"] for r in hydrated_results] == ["doc1", "doc2", "doc1"]
+        assert mock_conn.execute.call_count == 2
+        assert mock_conn.execute.call_args[0][1] == {"ids": ["chunk3"]}
+        
+        # Every id is cached now, so overlapping repeats never reach the database
+        hydrate_matches([dict(m) for m in mock_vector_results[1:]])
+        assert mock_conn.execute.call_count == 2
+
+    @patch('rag.context_builder.engine')
+    def test_hydrate_matches_with_chunk_cache_disabled(self, mock_engine, mock_vector_results, mock_database_chunks):
+        """Test that HYDRATE_CACHE_SIZE=0 hydrates from the database every time instead of failing"""
+        mock_conn = Mock()
+        mock_engine.connect.return_value.__enter__.return_value = mock_conn
+        mock_conn.execute.return_value.fetchall.return_value = mock_database_chunks
+        
+        with patch.object(chunk_cache, 'max_size', 0):
+            hydrate_matches([dict(m) for m in mock_vector_results])
+            hydrated_results = hydrate_matches([dict(m) for m in mock_vector_results])
+        
+        assert [r["doc"] for r in hydrated_results] == ["doc1", "doc2", "doc1"]
+        assert mock_conn.execute.call_count == 2
+        assert chunk_cache.get("chunk1") is None
+    
+    def test_chunk_cache_reput_keeps_other_entries(self):
+        """Test that rewriting a cached chunk at capacity evicts nothing else"""
+        cache = LRUCache(max_size=2)
+        cache.put("chunk1", "old")
+        cache.put("chunk2", "text 2")
+        
+        cache.put("chunk1", "new")
+        cache.put("chunk3", "text 3")
+        
+        assert cache.get("chunk1") == "new"
+        assert cache.get("chunk2") is None
+        assert cache.get("chunk3") == "text 3"
+
+    @patch('rag.context_builder.engine')
+    def test_hydrate_matches_single_query_for_many_matches(self, mock_engine):
+        """Test that hydration issues one query however many matches there are"""
+        matches = [{"id": f"chunk{i}", "score": 1.0 - i / 100} for i in range(100)]
+        # Rows come back in arbitrary order; hydration must keep the ranked order
+        rows = [(f"chunk{i}", f"doc{i % 7}", i, f"text {i}") for i in reversed(range(100))]
+        mock_conn = Mock()
+        mock_engine.connect.return_value.__enter__.return_value = mock_conn
+        mock_conn.execute.return_value.fetchall.return_value = rows
+
+        hydrated_results = hydrate_matches(matches)
+
+        assert mock_conn.execute.call_count == 1
+        assert mock_conn.execute.call_args[0][1] == {"ids": [m["id"] for m in matches]}
+        assert [r["text"] for r in hydrated_results] == [f"text {i}" for i in range(100)]
+
     def test_build_context_integration(self):
         """Test building context from hydrated snippets"""
         hydrated_snippets = [
@@ -71,6 +179,35 @@ class TestRAGPipelineIntegration:
         assert "Machine learning is powerful." in context
         assert "Vector search is semantic." in context
     
+    def test_expand_with_neighbors_single_query(self):
+        """Test neighbor expansion fetches all neighbors in one round-trip"""
+        from sqlalchemy import create_engine, text
+        
+        test_engine = create_engine("sqlite://", future=True)
+        with test_engine.begin() as conn:
+            conn.execute(text("CREATE TABLE chunks (id TEXT, document_id TEXT, seq INTEGER, text TEXT)"))
+            for doc in ("doc1", "doc2"):
+                for seq in range(4):
+                    conn.execute(text("INSERT INTO chunks VALUES (:id, :doc, :seq, :text)"),
+                                 {"id": f"{doc}::#{seq}", "doc": doc, "seq": seq, "text": f"{doc} part {seq}"})
+        
+        snippets = [
+            {"id": "doc1::#1", "doc": "doc1", "seq": 1, "text": "doc1 part 1", "score": 0.9},
+            {"id": "doc2::#3", "doc": "doc2", "seq": 3, "text": "doc2 part 3", "score": 0.5},
+        ]
+        
+        with patch('rag.context_builder.engine', test_engine), \
+             patch.object(test_engine, 'connect', wraps=test_engine.connect) as mock_connect:
+            expanded = expand_with_neighbors(snippets, left=1, right=1)
+        
+        assert mock_connect.call_count == 1
+        assert [s["id"] for s in expanded] == [
+            "doc1::#0", "doc1::#1", "doc1::#2", "doc2::#2", "doc2::#3"
+        ]
+        neighbor = next(s for s in expanded if s["id"] == "doc2::#2")
+        assert neighbor["neighbor_of"] == "doc2::#3"
+        assert neighbor["score"] == 0.5
+    
     def test_build_context_truncation(self):
         """Test context building with character limits"""
         long_snippets = [
@@ -85,6 +222,20 @@ class TestRAGPipelineIntegration:
         # Should still include at least first snippet
         assert "[#1] doc0.pdf::0" in context
     
+    def test_build_context_prefers_relevant_snippets(self):
+        """Test that a long low-scoring snippet doesn't crowd out better ones"""
+        snippets = [
+            {"id": "chunk1", "text": "A" * 250, "doc": "long.pdf", "seq": 0, "score": 0.2},
+            {"id": "chunk2", "text": "Key answer.", "doc": "short.pdf", "seq": 3, "score": 0.9},
+            {"id": "chunk3", "text": "Supporting detail.", "doc": "short.pdf", "seq": 4, "score": 0.7}
+        ]
+        
+        context = build_context(snippets, max_chars=200)
+        
+        assert "long.pdf" not in context
+        # Admitted snippets keep their input order and citation numbers
+        assert context.index("[#2] short.pdf::3") < context.index("[#3] short.pdf::4")
+    
     @patch('rag.generator.llm')
     def test_answer_generation_integration(self, mock_llm_client):
         """Test answer generation with context"""
@@ -110,6 +261,205 @@ Machine learning models require large amounts of training data."""
         assert call_args[1]["model"] == "gpt-4o-mini"
         assert call_args[1]["temperature"] == 0.2
     
+    @patch('rag.generator.llm')
+    def test_answer_with_long_context_is_one_request(self, mock_llm_client):
+        """Test that a large context pack is sent whole; any prefill chunking is server-side"""
+        mock_response = Mock()
+        mock_response.choices = [Mock()]
+        mock_response.choices[0].message.content = "Summary across sources [#1] [#50]."
+        create = mock_llm_client.return_value.chat.completions.create
+        create.return_value = mock_response
+        snippets = [
+            {"id": f"chunk{i}", "text": f"Section {i}. " + "Detail " * 40, "doc": f"doc{i}.pdf", "seq": i}
+            for i in range(50)
+        ]
+        context_pack = build_context(snippets, max_chars=100000)
+        
+        with patch('rag.generator.is_vertex_chat_enabled', return_value=False):
+            result = answer("Summarize everything", context_pack)
+        
+        assert result == "Summary across sources [#1] [#50]."
+        create.assert_called_once()
+        assert context_pack in create.call_args[1]["messages"][1]["content"]
+    
+    @patch('rag.generator.llm')
+    def test_system_prompt_prefix_is_stable(self, mock_llm_client):
+        """Test that every request leads with the same system message object"""
+        mock_response = Mock()
+        mock_response.choices = [Mock()]
+        mock_response.choices[0].message.content = "Answer [#1]."
+        create = mock_llm_client.return_value.chat.completions.create
+        create.return_value = mock_response
+        
+        with patch('rag.generator.is_vertex_chat_enabled', return_value=False):
+            answer("Why is Python good for AI?", "[#1] python_guide.pdf::0\nPython is versatile.")
+            answer("What is machine learning?", "[#1] ml_intro.pdf::1\nModels learn from data.")
+        
+        first, second = (c[1]["messages"] for c in create.call_args_list)
+        assert first[0] is second[0]
+        assert first[0]["role"] == "system"
+        assert first[1]["content"] != second[1]["content"]
+        assert all(c[1]["model"] == "gpt-4o-mini" and c[1]["temperature"] == 0.2 for c in create.call_args_list)
+    
+    @patch('rag.generator.llm')
+    def test_follow_up_questions_share_the_context_prefix(self, mock_llm_client):
+        """Test that the context pack precedes the question so providers can cache it"""
+        mock_response = Mock()
+        mock_response.choices = [Mock()]
+        mock_response.choices[0].message.content = "Answer [#1]."
+        create = mock_llm_client.return_value.chat.completions.create
+        create.return_value = mock_response
+        context_pack = "[#1] python_guide.pdf::0\nPython is versatile."
+        
+        with patch('rag.generator.is_vertex_chat_enabled', return_value=False):
+            answer("Why is Python good for AI?", context_pack)
+            answer("Which libraries does it have?", context_pack)
+        
+        first, second = (c[1]["messages"][1]["content"] for c in create.call_args_list)
+        prefix = f"CONTEXT PACK:\n{context_pack}\n\nQUESTION: "
+        assert first.startswith(prefix) and second.startswith(prefix)
+        assert first.endswith("Why is Python good for AI?")
+    
+    @patch('rag.generator.llm')
+    def test_repeated_answer_served_from_cache(self, mock_llm_client):
+        """Test that asking the same question over the same context calls the LLM once"""
+        mock_response = Mock()
+        mock_response.choices = [Mock()]
+        mock_response.choices[0].message.content = "Python is excellent for AI development [#1]."
+        mock_llm_client.return_value.chat.completions.create.return_value = mock_response
+        context_pack = "[#1] python_guide.pdf::0\nPython is a versatile programming language used for AI development."
+        
+        with patch('rag.generator.is_vertex_chat_enabled', return_value=False):
+            first = answer("Why is Python good for AI?", context_pack)
+            second = answer("Why is Python good for AI?", context_pack)
+        
+        assert first == second
+        assert mock_llm_client.return_value.chat.completions.create.call_count == 1
+    
+    @patch('rag.generator.llm')
+    def test_similar_question_served_from_cache(self, mock_llm_client):
+        """Test that a near-duplicate query embedding reuses the answer only for the same context"""
+        mock_response = Mock()
+        mock_response.choices = [Mock()]
+        mock_response.choices[0].message.content = "Python is excellent for AI development [#1]."
+        mock_llm_client.return_value.chat.completions.create.return_value = mock_response
+        context_pack = "[#1] python_guide.pdf::0\nPython is a versatile programming language used for AI development."
+        
+        with patch('rag.generator.is_vertex_chat_enabled', return_value=False):
+            answer("Why is Python good for AI?", context_pack, query_vec=[1.0, 0.0, 0.1])
+            answer("Why is Python so good for AI?", context_pack, query_vec=[1.0, 0.0, 0.11])
+            assert mock_llm_client.return_value.chat.completions.create.call_count == 1
+            
+            answer("Why is Python so good for AI?", context_pack + "\n\n[#2] other.pdf::0\nMore.",
+                   query_vec=[1.0, 0.0, 0.11])
+            answer("What is Rust?", context_pack, query_vec=[0.0, 1.0, 0.0])
+            assert mock_llm_client.return_value.chat.completions.create.call_count == 3
+    
+    def test_semantic_cache_keeps_int8_query_vectors(self):
+        """Test that cached query embeddings take one byte per dimension and still match rephrasings"""
+        import math
+        import random
+        
+        rng = random.Random(7)
+        vec = [rng.gauss(0, 1) for _ in range(1536)]
+        nearby = [x + rng.gauss(0, 0.15) for x in vec]
+        unrelated = [rng.gauss(0, 1) for _ in range(1536)]
+        norm = lambda v: math.sqrt(sum(x * x for x in v))
+        assert sum(a * b for a, b in zip(vec, nearby)) / (norm(vec) * norm(nearby)) > 0.98
+        
+        answer_cache.clear()
+        try:
+            answer_cache.put("question", "context", "cached answer", vec)
+            entry = next(iter(answer_cache._entries.values()))
+            assert entry.vector.itemsize == 1 and len(entry.vector) == 1536
+            
+            assert answer_cache.get("rephrased question", "context", nearby) == "cached answer"
+            assert answer_cache.get("other question", "context", unrelated) is None
+        finally:
+            answer_cache.clear()
+    
+    def test_answer_cache_size_zero_disables_caching(self):
+        """Test that ANSWER_CACHE_SIZE=0 stores nothing instead of failing the put"""
+        from rag.answer_cache import AnswerCache
+        
+        cache = AnswerCache(max_size=0)
+        cache.put("question", "context", "answer")
+        
+        assert cache.get("question", "context") is None
+        assert len(cache._entries) == 0
+    
+    def test_answer_cache_reput_refreshes_without_evicting(self):
+        """Test that re-putting a cached key updates it in place and marks it most recent"""
+        from rag.answer_cache import AnswerCache
+        
+        cache = AnswerCache(max_size=2)
+        cache.put("a", "context", "first")
+        cache.put("b", "context", "b answer")
+        cache.put("a", "context", "second")
+        cache.put("c", "context", "c answer")
+        
+        assert cache.get("a", "context") == "second"
+        assert cache.get("b", "context") is None
+        assert cache.get("c", "context") == "c answer"
+    
+    @patch('rag.generator.llm')
+    def test_answer_stream_yields_deltas(self, mock_llm_client):
+        """Test streamed answer generation yields non-empty text deltas in order"""
+        events = []
+        for content in ["Python is ", None, "great [#1]."]:
+            event = Mock()
+            event.choices = [Mock()]
+            event.choices[0].delta.content = content
+            events.append(event)
+        mock_llm_client.return_value.chat.completions.create.return_value = iter(events)
+        
+        with patch('rag.generator.is_vertex_chat_enabled', return_value=False):
+            deltas = list(answer_stream("Why Python?", "[#1] guide.pdf::0\nPython is great."))
+        
+        assert deltas == ["Python is ", "great [#1]."]
+        call_args = mock_llm_client.return_value.chat.completions.create.call_args
+        assert call_args[1]["stream"] is True
+    
+    @patch('rag.generator.llm')
+    def test_answer_stream_vertex_mid_stream_error_does_not_fall_back(self, mock_llm_client):
+        """Test a Vertex stream failing after its first delta raises instead of replaying via OpenAI"""
+        def vertex_chat_stream(**kwargs):
+            yield "Python is "
+            raise ConnectionError("stream reset")
+        
+        answer_cache.clear()
+        deltas = []
+        with patch('rag.generator.is_vertex_chat_enabled', return_value=True), \
+             patch('gcp.vertex.vertex_chat_stream', side_effect=vertex_chat_stream):
+            with pytest.raises(ConnectionError):
+                for delta in answer_stream("Why Python?", "[#1] guide.pdf::0\nPython is great."):
+                    deltas.append(delta)
+        
+        assert deltas == ["Python is "]
+        mock_llm_client.assert_not_called()
+        assert answer_cache.get("Why Python?", "[#1] guide.pdf::0\nPython is great.") is None
+    
+    @patch('rag.generator.llm')
+    def test_answer_stream_vertex_empty_or_failed_first_pull_falls_back(self, mock_llm_client):
+        """Test an empty or failing first Vertex pull falls back to OpenAI before any output"""
+        def failing_stream(**kwargs):
+            raise ConnectionError("refused")
+            yield  # pragma: no cover
+        
+        for vertex_stream in (lambda **kwargs: iter([]), failing_stream):
+            event = Mock()
+            event.choices = [Mock()]
+            event.choices[0].delta.content = "From OpenAI."
+            mock_llm_client.return_value.chat.completions.create.return_value = iter([event])
+            
+            answer_cache.clear()
+            with patch('rag.generator.is_vertex_chat_enabled', return_value=True), \
+                 patch('gcp.vertex.vertex_chat_stream', side_effect=vertex_stream):
+                deltas = list(answer_stream("Why Python?", "[#1] guide.pdf::0\nPython is great."))
+            
+            assert deltas == ["From OpenAI."]
+        answer_cache.clear()
+    
     @patch('rag.generator.llm')
     def test_answer_generation_insufficient_context(self, mock_llm_client):
         """Test answer generation with insufficient context"""
@@ -123,90 +473,201 @@ Machine learning models require large amounts of training data."""
         
         assert "don't have enough information" in result.lower()
     
-    @patch('index.embedder.embed_texts')
-    @patch('rag.retriever.vector_search')
-    @patch('rag.context_builder.hydrate_matches')
-    @patch('rag.context_builder.build_context')
-    @patch('rag.generator.answer')
-    def test_complete_rag_pipeline(self, mock_answer, mock_build_context, mock_hydrate, 
-                                   mock_vector_search, mock_embed):
+    def test_complete_rag_pipeline(self, rag_mocks):
         """Test complete RAG pipeline from query to answer"""
         # Setup mocks
-        mock_embed.return_value = [[0.1] * 1536]
-        mock_vector_search.return_value = [
+        rag_mocks.embed.return_value = [[0.1] * 1536]
+        rag_mocks.vector_search.return_value = [
             {"id": "chunk1", "score": 0.9, "text": None, "meta": {}}
         ]
-        mock_hydrate.return_value = [
+        rag_mocks.hydrate.return_value = [
             {"id": "chunk1", "text": "Python is great for AI", "doc": "guide.pdf", "seq": 0}
         ]
-        mock_build_context.return_value = "[#1] guide.pdf::0\nPython is great for AI"
-        mock_answer.return_value = "Python is excellent for AI development [#1]."
+        rag_mocks.build_context.return_value = "[#1] guide.pdf::0\nPython is great for AI"
+        rag_mocks.answer.return_value = "Python is excellent for AI development [#1]."
         
         # This would normally be called through CLI, but we'll test the components
         query = "Why is Python good for AI?"
         
         # Simulate the pipeline
-        query_vec = mock_embed([query])[0]
-        matches = mock_vector_search(query_vec, top_k=5)
-        snippets = mock_hydrate(matches)
-        context = mock_build_context(snippets)
-        result = mock_answer(query, context)
+        query_vec = rag_mocks.embed([query])[0]
+        matches = rag_mocks.vector_search(query_vec, top_k=5)
+        snippets = rag_mocks.hydrate(matches)
+        context = rag_mocks.build_context(snippets)
+        result = rag_mocks.answer(query, context)
         
         assert result == "Python is excellent for AI development [#1]."
         
         # Verify all components were called
-        mock_embed.assert_called_once_with([query])
-        mock_vector_search.assert_called_once_with(query_vec, top_k=5)
-        mock_hydrate.assert_called_once_with(matches)
-        mock_build_context.assert_called_once_with(snippets)
-        mock_answer.assert_called_once_with(query, context)
-    
-    @patch('index.embedder.embed_texts')
-    @patch('search.hybrid.hybrid_search')
-    @patch('rag.reranker.rerank')
-    @patch('rag.context_builder.hydrate_matches')
-    @patch('rag.context_builder.build_context')
-    @patch('rag.generator.answer')
-    def test_hybrid_search_with_reranking_pipeline(self, mock_answer, mock_build_context, 
-                                                   mock_hydrate, mock_rerank, mock_hybrid_search, mock_embed):
+        rag_mocks.embed.assert_called_once_with([query])
+        rag_mocks.vector_search.assert_called_once_with(query_vec, top_k=5)
+        rag_mocks.hydrate.assert_called_once_with(matches)
+        rag_mocks.build_context.assert_called_once_with(snippets)
+        rag_mocks.answer.assert_called_once_with(query, context)
+    
+    def test_hybrid_search_with_reranking_pipeline(self, rag_mocks):
         """Test complete pipeline with hybrid search and reranking"""
         # Setup mocks for hybrid search pipeline
-        mock_embed.return_value = [[0.1] * 1536]
-        mock_hybrid_search.return_value = [
+        rag_mocks.embed.return_value = [[0.1] * 1536]
+        rag_mocks.hybrid_search.return_value = [
             {"id": "chunk1", "score": 0.9, "source": "vector"},
             {"id": "chunk2", "score": 0.8, "source": "keyword"}
         ]
-        mock_rerank.return_value = [
+        rag_mocks.rerank.return_value = [
             {"id": "chunk2", "score": 0.8, "rerank_score": 0.95, "reranker": "voyage"},
             {"id": "chunk1", "score": 0.9, "rerank_score": 0.85, "reranker": "voyage"}
         ]
-        mock_hydrate.return_value = [
+        rag_mocks.hydrate.return_value = [
             {"id": "chunk2", "text": "Advanced AI techniques", "doc": "advanced.pdf", "seq": 0},
             {"id": "chunk1", "text": "Basic AI concepts", "doc": "basics.pdf", "seq": 0}
         ]
-        mock_build_context.return_value = "[#1] advanced.pdf::0\nAdvanced AI techniques\n\n[#2] basics.pdf::0\nBasic AI concepts"
-        mock_answer.return_value = "AI involves both basic concepts [#2] and advanced techniques [#1]."
+        rag_mocks.build_context.return_value = "[#1] advanced.pdf::0\nAdvanced AI techniques\n\n[#2] basics.pdf::0\nBasic AI concepts"
+        rag_mocks.answer.return_value = "AI involves both basic concepts [#2] and advanced techniques [#1]."
         
         query = "What is artificial intelligence?"
         
         # Simulate hybrid + rerank pipeline
-        query_vec = mock_embed([query])[0]
-        matches = mock_hybrid_search(query, query_vec, top_k=5)
-        reranked = mock_rerank(query, matches)
-        snippets = mock_hydrate(reranked)
-        context = mock_build_context(snippets)
-        result = mock_answer(query, context)
+        query_vec = rag_mocks.embed([query])[0]
+        matches = rag_mocks.hybrid_search(query, query_vec, top_k=5)
+        reranked = rag_mocks.rerank(query, matches)
+        snippets = rag_mocks.hydrate(reranked)
+        context = rag_mocks.build_context(snippets)
+        result = rag_mocks.answer(query, context)
         
         assert "basic concepts" in result
         assert "advanced techniques" in result
         assert "[#1]" in result and "[#2]" in result
         
         # Verify reranking changed order (chunk2 should be first after reranking)
-        mock_rerank.assert_called_once()
-        reranked_result = mock_rerank.return_value
+        rag_mocks.rerank.assert_called_once()
+        reranked_result = rag_mocks.rerank.return_value
         assert reranked_result[0]["id"] == "chunk2"  # Higher rerank score
         assert reranked_result[0]["rerank_score"] == 0.95
     
+    def test_hybrid_merge_ranks_start_at_one(self):
+        """Test that RRF scores use 1-based ranks, 1/(rrf_k + 1) for a top result"""
+        from search.hybrid import hybrid_merge
+        
+        keyword = [{"id": "a"}, {"id": "b"}]
+        vector = [{"id": "c"}, {"id": "b"}]
+        
+        # With rrf_k=1, 'b' scores 2/3 against 1/2 for 'a' and 'c'; 0-based
+        # ranks would tie all three at 1
+        merged = hybrid_merge(keyword, vector, k=3, rrf_k=1)
+        
+        assert [r["id"] for r in merged] == ["b", "a", "c"]
+        assert merged[0]["source"] == "hybrid"
+    
+    def test_upsert_batches_all_vectors_in_one_call(self):
+        """Test that indexing sends vectors to Pinecone in 100-vector requests"""
+        from sqlalchemy import create_engine
+        from state.db import metadata, chunks_table
+        from index.upsert import build_and_upsert
+        
+        test_engine = create_engine("sqlite://", future=True)
+        metadata.create_all(test_engine)
+        with test_engine.begin() as conn:
+            conn.execute(chunks_table.insert(), [
+                {"id": f"doc::#{i}", "document_id": "doc", "seq": i, "text": f"chunk {i}", "metadata": "{}"}
+                for i in range(250)
+            ])
+        
+        with patch('index.upsert.engine', test_engine), \
+             patch('index.upsert.get_index') as mock_get_index, \
+             patch('index.upsert.embed_texts', side_effect=lambda texts: [[0.1] * 8 for _ in texts]):
+            result = build_and_upsert(namespace="test")
+        
+        mock_upsert = mock_get_index.return_value.upsert
+        assert result == {"upserts": 250, "namespace": "test"}
+        assert mock_upsert.call_count == 3  # ceil(250 / 100)
+        assert [len(c[1]["vectors"]) for c in mock_upsert.call_args_list] == [100, 100, 50]
+    
+    def test_index_typesense_converts_created_at_in_python(self):
+        """Test that chunk timestamps become epoch seconds without dialect-specific SQL"""
+        from sqlalchemy import create_engine
+        from state.db import metadata, chunks_table, documents_table
+        from search.hybrid import index_typesense
+        
+        test_engine = create_engine("sqlite://", future=True)
+        metadata.create_all(test_engine)
+        with test_engine.begin() as conn:
+            conn.execute(documents_table.insert(), {"id": "doc", "path": "C:\\docs\\guide.pdf"})
+            conn.execute(chunks_table.insert(), [
+                {"id": "doc::#0", "document_id": "doc", "seq": 0, "text": "a", "created_at": "2025-01-01T00:00:00.5"},
+                {"id": "doc::#1", "document_id": "doc", "seq": 1, "text": "b", "created_at": None},
+            ])
+        
+        indexed = []
+        with patch('search.hybrid.engine', test_engine), \
+             patch('search.hybrid.is_available', return_value=True), \
+             patch('search.hybrid.delete_collection', return_value=True), \
+             patch('search.hybrid.index_documents', side_effect=lambda docs: indexed.extend(docs) or len(indexed)), \
+             patch('search.hybrid.time.time', return_value=1234.5):
+            result = index_typesense()
+        
+        assert result == {"indexed": 2, "total": 2, "skipped": False}
+        assert [d["created_at"] for d in indexed] == [1735689600, 1234]
+        assert {d["doc"] for d in indexed} == {"guide.pdf"}
+    
+    def test_pinecone_index_prefers_grpc_transport(self):
+        """Test that the index handle uses gRPC when installed and enabled"""
+        import index.pinecone_client as pinecone_client
+        
+        for grpc_enabled, expected in ((True, "grpc"), (False, "http")):
+            with patch.object(pinecone_client, '_pc', None), \
+                 patch.object(pinecone_client, '_index', None), \
+                 patch.object(pinecone_client, 'PineconeGRPC') as mock_grpc, \
+                 patch.object(pinecone_client, 'Pinecone') as mock_http, \
+                 patch.object(pinecone_client, 'settings') as mock_settings:
+                mock_settings.pinecone_grpc = grpc_enabled
+                mock_settings.pinecone_index = "vectorpenter"
+                for client in (mock_grpc, mock_http):
+                    client.return_value.list_indexes.return_value = [Mock()]
+                    client.return_value.list_indexes.return_value[0].name = "vectorpenter"
+                
+                index = pinecone_client.get_index()
+            
+            chosen = mock_grpc if expected == "grpc" else mock_http
+            other = mock_http if expected == "grpc" else mock_grpc
+            assert index is chosen.return_value.Index.return_value
+            other.assert_not_called()
+    
+    def test_int8_vector_copies_round_trip(self):
+        """Test that int8 vector copies are a quarter of float32 and reused on re-index"""
+        import math
+        import random
+        from sqlalchemy import create_engine
+        from state.db import metadata, chunks_table
+        from index.upsert import build_and_upsert, pack_vector, unpack_vector
+        
+        rng = random.Random(0)
+        vec = [rng.gauss(0, 1) for _ in range(1536)]
+        blob = pack_vector(vec, "int8")
+        restored = unpack_vector(blob, len(vec))
+        cosine = sum(a * b for a, b in zip(vec, restored)) / (
+            math.sqrt(sum(a * a for a in vec)) * math.sqrt(sum(b * b for b in restored)))
+        assert len(blob) == 1536 + 8
+        assert cosine > 0.99
+        assert unpack_vector(pack_vector(vec), len(vec)) == pytest.approx(vec, abs=1e-2)
+        
+        test_engine = create_engine("sqlite://", future=True)
+        metadata.create_all(test_engine)
+        with test_engine.begin() as conn:
+            conn.execute(chunks_table.insert(), [
+                {"id": f"doc::#{i}", "document_id": "doc", "seq": i, "text": f"chunk {i}", "metadata": "{}"}
+                for i in range(3)
+            ])
+        
+        with patch('index.upsert.engine', test_engine), \
+             patch('index.upsert.get_index'), \
+             patch('index.upsert.settings') as mock_settings, \
+             patch('index.upsert.embed_texts', side_effect=lambda texts: [vec[:16] for _ in texts]) as mock_embed:
+            mock_settings.vector_quantization = "int8"
+            build_and_upsert(namespace="test")
+            build_and_upsert(namespace="test")
+        
+        assert mock_embed.call_count == 1
+    
     def test_error_handling_in_pipeline(self):
         """Test error handling throughout the pipeline"""
         # Test with various error conditions
@@ -221,7 +682,7 @@ Machine learning models require large amounts of training data."""
     @patch('rag.context_builder.engine')
     def test_database_connection_error_handling(self, mock_engine):
         """Test handling of database connection errors"""
-        mock_engine.begin.side_effect = Exception("Database connection failed")
+        mock_engine.connect.side_effect = Exception("Database connection failed")
         
         mock_matches = [{"id": "chunk1", "score": 0.9}]
         
@@ -231,50 +692,143 @@ Machine learning models require large amounts of training data."""
         assert "Database connection failed" in str(exc_info.value)
     
     def test_empty_query_handling(self):
-        """Test handling of empty or invalid queries"""
-        with patch('index.embedder.embed_texts') as mock_embed:
-            # Test empty query
-            mock_embed.return_value = [[0.0] * 1536]  # Zero vector
-            
-            result = mock_embed([""])
-            assert len(result[0]) == 1536
-            assert all(x == 0.0 for x in result[0])
+        """Test that blank queries are answered without embedding or searching"""
+        from apps.cli import Deps
+        
+        deps = Deps(embed=Mock(return_value=[0.0] * 1536), vector_search=Mock(), hybrid_search=Mock())
+        
+        for query in ["", "   ", "\n\t"]:
+            with patch('builtins.print') as mock_print:
+                cmd_ask(query, k=5, deps=deps)
+            output_text = " ".join(str(c) for c in mock_print.call_args_list)
+            assert "empty" in output_text
+        
+        assert deps.embed.call_count == 0
+        assert deps.vector_search.call_count == 0
+        assert deps.hybrid_search.call_count == 0
+    
+    def test_min_query_chars_skips_short_queries(self):
+        """Test that MIN_QUERY_CHARS treats very short queries as empty"""
+        from rag.retriever import is_empty_query
+        
+        assert is_empty_query("  ")
+        assert not is_empty_query("ai")
+        with patch('rag.retriever.settings') as mock_settings:
+            mock_settings.min_query_chars = 3
+            assert is_empty_query(" ai ")
+            assert not is_empty_query("RAG")
 
 
 @pytest.mark.integration
 class TestRAGPipelinePerformance:
     """Performance tests for RAG pipeline"""
     
-    def test_pipeline_latency_benchmark(self):
-        """Benchmark pipeline latency with mocked services"""
+    @pytest.mark.asyncio
+    async def test_pipeline_latency_benchmark(self):
+        """100 concurrent asks against realistic stage latencies share a few embedding requests"""
+        import asyncio
         import time
+        from concurrent.futures import ThreadPoolExecutor
+        from apps.cli import Deps
+        from index.embedder import EmbedCoalescer
         
-        with patch('index.embedder.embed_texts') as mock_embed, \
-             patch('rag.retriever.vector_search') as mock_search, \
-             patch('rag.context_builder.hydrate_matches') as mock_hydrate, \
-             patch('rag.generator.answer') as mock_answer:
-            
-            # Setup fast mocks
-            mock_embed.return_value = [[0.1] * 1536]
-            mock_search.return_value = [{"id": "chunk1", "score": 0.9}]
-            mock_hydrate.return_value = [{"id": "chunk1", "text": "Test", "doc": "test.pdf", "seq": 0}]
-            mock_answer.return_value = "Test answer"
-            
-            start_time = time.time()
-            
-            # Simulate pipeline calls
-            query_vec = mock_embed(["test query"])[0]
-            matches = mock_search(query_vec, top_k=5)
-            snippets = mock_hydrate(matches)
-            result = mock_answer("test query", "context")
-            
-            end_time = time.time()
-            latency = end_time - start_time
-            
-            # Pipeline should be fast with mocks
-            assert latency < 0.1  # Less than 100ms
-            assert result == "Test answer"
+        def slow(seconds, result):
+            def stage(*args, **kwargs):
+                time.sleep(seconds)
+                return result(*args) if callable(result) else result
+            return stage
+        
+        def slow_answer(q, pack, query_vec=None):
+            time.sleep(0.3)
+            yield "Test answer [#1]."
+        
+        snippets = [{"id": "chunk1", "text": "Test", "doc": "test.pdf", "seq": 0, "score": 0.9}]
+        queries = [f"question {i}" for i in range(100)]
+        deps = Deps(
+            embed=EmbedCoalescer(max_batch=len(queries)).embed,
+            vector_search=Mock(return_value=([{"id": "chunk1", "score": 0.9}], 0.9)),
+            hydrate=slow(0.01, snippets),
+            expand=lambda snips, **kwargs: snips,
+            answer=slow_answer,
+        )
+        
+        loop = asyncio.get_running_loop()
+        with patch('index.embedder.embed_texts', side_effect=slow(0.05, lambda texts: [[0.1] * 1536 for _ in texts])) as mock_embed, \
+             patch('core.config.is_grounding_enabled', return_value=False), \
+             patch('builtins.print'), \
+             ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            await asyncio.gather(*[loop.run_in_executor(executor, lambda q=q: cmd_ask(q, k=5, deps=deps))
+                                   for q in queries])
+        
+        # Coalescing batches the concurrent asks' query embeddings into a few requests
+        assert mock_embed.call_count < len(queries)
+        assert sum(len(c.args[0]) for c in mock_embed.call_args_list) == len(queries)
 
+    def test_build_context_large_candidate_set(self):
+        """Building a pack from 10k candidates only formats headers for the few that fit"""
+        header_reads = 0
+        
+        class Snippet(dict):
+            def __getitem__(self, key):
+                nonlocal header_reads
+                if key == "doc":
+                    header_reads += 1
+                return super().__getitem__(key)
+        
+        snippets = [
+            Snippet(id=f"chunk{i}", text="word " * 40, doc=f"doc{i % 50}.pdf", seq=i, score=1 - i / 10000)
+            for i in range(10000)
+        ]
+        
+        context = build_context(snippets, max_chars=12000)
+        
+        assert len(context) <= 12000
+        assert context.startswith("[#1] doc0.pdf::0\n")
+        admitted = context.count("\n\n")
+        # Candidates rejected on text length alone never get a header
+        assert header_reads <= admitted + 1
+    
+    def test_hybrid_search_overlaps_vector_and_keyword_legs(self):
+        """Hybrid latency is the slower leg, not the sum of both"""
+        import threading
+        
+        # Each leg waits for the other, so run back to back they break the barrier
+        both_legs = threading.Barrier(2, timeout=5)
+        
+        def vector_leg(query_vec, top_k=12, namespace=None, index=None):
+            both_legs.wait()
+            return [{"id": "chunk1", "score": 0.9}], 0.9
+        
+        def keyword_leg(query, k):
+            both_legs.wait()
+            return [{"id": "chunk2", "score": 5.0}]
+        
+        with patch('core.config.has_commercial_license', return_value=True), \
+             patch('rag.retriever.vector_search', side_effect=vector_leg), \
+             patch('search.hybrid.keyword_search', side_effect=keyword_leg):
+            matches, best_score = hybrid_search("test query", [0.1] * 1536, k=2)
+        
+        assert not both_legs.broken
+        assert {m["id"] for m in matches} == {"chunk1", "chunk2"}
+        assert best_score == 0.9
+    
+    def test_llm_client_uses_chat_endpoint_settings(self):
+        """The shared chat client points at CHAT_BASE_URL with CHAT_API_KEY when one is set"""
+        from rag import generator
+        
+        with patch.object(generator, '_llm', None), \
+             patch('rag.generator.OpenAI') as mock_openai, \
+             patch('rag.generator.settings') as mock_settings:
+            mock_settings.chat_base_url = "http://localhost:8000/v1"
+            mock_settings.chat_api_key = "chat-key"
+            mock_settings.openai_api_key = "openai-key"
+            
+            client = generator.llm()
+            # Built once, then shared by every later ask
+            assert generator.llm() is client
+        
+        mock_openai.assert_called_once_with(base_url="http://localhost:8000/v1", api_key="chat-key")
+        assert client is mock_openai.return_value
 
 if __name__ == "__main__":
     pytest.main([__file__])
@@ -8,151 +8,137 @@ from unittest.mock import Mock, patch, MagicMock
 from pathlib import Path
 import tempfile
 import json
+from types import SimpleNamespace
+
+@pytest.fixture
+def mocked_pipeline(monkeypatch):
+    """Mock the CLI's indexing commands, grounding and print in one place
+    
+    Query stages are injected per test through apps.cli.Deps; grounding is
+    off unless a test flips grounding_enabled.
+    """
+    mocks = SimpleNamespace(
+        ingest=Mock(return_value={"documents": 1, "chunks": 3}),
+        upsert=Mock(return_value={"upserts": 3, "namespace": "default"}),
+        typesense=Mock(return_value={"skipped": True}),
+        grounding_enabled=Mock(return_value=False),
+        should_ground=Mock(return_value=False),
+        google_ground=Mock(return_value=[]),
+        print=Mock(),
+    )
+    monkeypatch.setattr("apps.cli.ingest_path", mocks.ingest)
+    monkeypatch.setattr("apps.cli.build_and_upsert", mocks.upsert)
+    monkeypatch.setattr("apps.cli.index_typesense", mocks.typesense)
+    # Grounding helpers are resolved inside cmd_ask, so patch their modules
+    monkeypatch.setattr("core.config.is_grounding_enabled", mocks.grounding_enabled)
+    monkeypatch.setattr("gcp.search.should_use_grounding", mocks.should_ground)
+    monkeypatch.setattr("gcp.search.google_ground", mocks.google_ground)
+    monkeypatch.setattr("builtins.print", mocks.print)
+    return mocks
+
+
+def _printed(mock_print) -> str:
+    return " ".join(str(call) for call in mock_print.call_args_list)
+
 
 class TestCriticalWorkflows:
     """Test the 3 most important workflows"""
     
-    def test_basic_ingest_index_ask_workflow(self):
+    def test_basic_ingest_index_ask_workflow(self, mocked_pipeline):
         """Test 1: Basic ingest → index → ask (vector only)"""
+        from apps.cli import Deps, cmd_ingest, cmd_index, cmd_ask
         
-        # Mock all external services
-        with patch('index.embedder.embed_texts') as mock_embed, \
-             patch('index.upsert.build_and_upsert') as mock_upsert, \
-             patch('rag.retriever.vector_search') as mock_search, \
-             patch('rag.context_builder.hydrate_matches') as mock_hydrate, \
-             patch('rag.generator.answer') as mock_answer, \
-             patch('ingest.pipeline.ingest_path') as mock_ingest:
-            
-            # Setup mocks
-            mock_ingest.return_value = {"documents": 1, "chunks": 3}
-            mock_upsert.return_value = {"upserts": 3, "namespace": "default"}
-            mock_embed.return_value = [[0.1] * 1536]
-            mock_search.return_value = ([
+        deps = Deps(
+            embed=Mock(return_value=[0.1] * 1536),
+            vector_search=Mock(return_value=([
                 {"id": "doc1::0", "score": 0.9, "text": None, "meta": {}}
-            ], 0.9)
-            mock_hydrate.return_value = [
+            ], 0.9)),
+            hydrate=Mock(return_value=[
                 {"id": "doc1::0", "text": "Vectorpenter is a local AI fabric", "doc": "doc1", "seq": 0}
-            ]
-            mock_answer.return_value = "Vectorpenter is a local AI fabric for document processing [#1]."
-            
-            # Test the workflow
-            from apps.cli import cmd_ingest, cmd_index, cmd_ask
-            
-            # 1. Ingest
-            cmd_ingest("./data/inputs")
-            mock_ingest.assert_called_once()
-            
-            # 2. Index
-            cmd_index()
-            mock_upsert.assert_called_once()
-            
-            # 3. Ask
-            with patch('builtins.print') as mock_print:
-                cmd_ask("What is Vectorpenter?", k=5, hybrid=False, rerank=False)
-            
-            # Verify the complete pipeline was called
-            mock_embed.assert_called()
-            mock_search.assert_called()
-            mock_hydrate.assert_called()
-            mock_answer.assert_called()
-            
-            # Verify output was printed
-            print_calls = [str(call) for call in mock_print.call_args_list]
-            output_text = " ".join(print_calls)
-            assert "vectorpenter" in output_text.lower()
+            ]),
+            expand=Mock(side_effect=lambda snippets, **kw: snippets),
+            build_context=Mock(return_value="[#1] doc1::0\nVectorpenter is a local AI fabric"),
+            answer=Mock(return_value=["Vectorpenter is a local AI fabric for document processing [#1]."]),
+            connect=Mock(),
+        )
+        
+        # 1. Ingest
+        cmd_ingest("./data/inputs")
+        mocked_pipeline.ingest.assert_called_once()
+        
+        # 2. Index
+        cmd_index()
+        mocked_pipeline.upsert.assert_called_once()
+        
+        # 3. Ask
+        cmd_ask("What is Vectorpenter?", k=5, hybrid=False, rerank=False, deps=deps)
+        
+        # Verify the complete pipeline was called
+        deps.embed.assert_called()
+        deps.vector_search.assert_called()
+        deps.hydrate.assert_called()
+        deps.answer.assert_called()
+        # Mocked hydrate/expand need no database connection
+        deps.connect.assert_not_called()
+        
+        # Verify output was printed
+        assert "vectorpenter" in _printed(mocked_pipeline.print).lower()
     
-    def test_hybrid_rerank_workflow(self):
+    def test_hybrid_rerank_workflow(self, mocked_pipeline):
         """Test 2: Hybrid + rerank path"""
+        from apps.cli import Deps, cmd_ask
         
-        with patch('index.embedder.embed_texts') as mock_embed, \
-             patch('search.hybrid.hybrid_search') as mock_hybrid, \
-             patch('search.hybrid.is_available') as mock_typesense_available, \
-             patch('rag.reranker.rerank') as mock_rerank, \
-             patch('rag.reranker.is_rerank_available') as mock_rerank_available, \
-             patch('rag.context_builder.hydrate_matches') as mock_hydrate, \
-             patch('rag.context_builder.expand_with_neighbors') as mock_expand, \
-             patch('rag.context_builder.build_combined_context') as mock_build, \
-             patch('rag.generator.answer') as mock_answer:
-            
-            # Setup mocks for hybrid + rerank
-            mock_embed.return_value = [[0.1] * 1536]
-            mock_typesense_available.return_value = True
-            mock_rerank_available.return_value = True
-            
-            mock_hybrid.return_value = ([
+        reranked = [
+            {"id": "chunk2", "text": "Keyword result", "doc": "doc2", "seq": 0, "rerank_score": 0.95},
+            {"id": "chunk1", "text": "Vector result", "doc": "doc1", "seq": 0, "rerank_score": 0.85}
+        ]
+        deps = Deps(
+            embed=Mock(return_value=[0.1] * 1536),
+            typesense_available=Mock(return_value=True),
+            rerank_available=Mock(return_value=True),
+            hybrid_search=Mock(return_value=([
                 {"id": "chunk1", "score": 0.9, "source": "vector"},
                 {"id": "chunk2", "score": 0.8, "source": "keyword"}
-            ], 0.9)
-            
-            mock_hydrate.return_value = [
+            ], 0.9)),
+            hydrate=Mock(return_value=[
                 {"id": "chunk1", "text": "Vector result", "doc": "doc1", "seq": 0},
                 {"id": "chunk2", "text": "Keyword result", "doc": "doc2", "seq": 0}
-            ]
-            
+            ]),
             # Mock reranking to reverse order
-            mock_rerank.return_value = [
-                {"id": "chunk2", "text": "Keyword result", "doc": "doc2", "seq": 0, "rerank_score": 0.95},
-                {"id": "chunk1", "text": "Vector result", "doc": "doc1", "seq": 0, "rerank_score": 0.85}
-            ]
-            
-            mock_expand.return_value = mock_rerank.return_value  # No change for simplicity
-            mock_build.return_value = "[#1] doc2::0\nKeyword result\n\n[#2] doc1::0\nVector result"
-            mock_answer.return_value = "The results show both vector [#2] and keyword [#1] matches."
-            
-            # Test hybrid + rerank workflow
-            from apps.cli import cmd_ask
-            
-            with patch('builtins.print') as mock_print:
-                cmd_ask("test query", k=5, hybrid=True, rerank=True)
-            
-            # Verify hybrid search was used
-            mock_hybrid.assert_called_once()
-            mock_rerank.assert_called_once()
-            mock_expand.assert_called_once()  # Late windowing
-            
-            # Verify output indicates hybrid+rerank
-            print_calls = [str(call) for call in mock_print.call_args_list]
-            output_text = " ".join(print_calls)
-            assert "hybrid" in output_text.lower()
-            assert "rerank" in output_text.lower()
+            rerank=Mock(return_value=reranked),
+            expand=Mock(return_value=reranked),  # No change for simplicity
+            build_context=Mock(return_value="[#1] doc2::0\nKeyword result\n\n[#2] doc1::0\nVector result"),
+            answer=Mock(return_value=["The results show both vector [#2] and keyword [#1] matches."]),
+        )
+        
+        # Test hybrid + rerank workflow
+        cmd_ask("test query", k=5, hybrid=True, rerank=True, deps=deps)
+        
+        # Verify hybrid search was used
+        deps.hybrid_search.assert_called_once()
+        deps.rerank.assert_called_once()
+        deps.expand.assert_called_once()  # Late windowing
+        
+        # Verify output indicates hybrid+rerank
+        output_text = _printed(mocked_pipeline.print).lower()
+        assert "hybrid" in output_text
+        assert "rerank" in output_text
     
-    def test_weak_retrieval_grounding_fallback(self):
+    def test_weak_retrieval_grounding_fallback(self, mocked_pipeline):
         """Test 3: Weak local retrieval → Google grounding kicks in"""
+        from apps.cli import Deps, cmd_ask
         
-        with patch('index.embedder.embed_texts') as mock_embed, \
-             patch('rag.retriever.vector_search') as mock_search, \
-             patch('core.config.is_grounding_enabled') as mock_grounding_enabled, \
-             patch('gcp.search.should_use_grounding') as mock_should_ground, \
-             patch('gcp.search.google_ground') as mock_google_ground, \
-             patch('rag.context_builder.hydrate_matches') as mock_hydrate, \
-             patch('rag.context_builder.expand_with_neighbors') as mock_expand, \
-             patch('rag.context_builder.build_combined_context') as mock_build, \
-             patch('rag.generator.answer') as mock_answer:
-            
-            # Setup mocks for weak local retrieval
-            mock_embed.return_value = [[0.1] * 1536]
-            mock_grounding_enabled.return_value = True
-            mock_should_ground.return_value = True  # Trigger grounding
-            
-            # Weak local results (low scores)
-            mock_search.return_value = ([
+        # Weak local results (low scores)
+        weak = [{"id": "chunk1", "text": "Weak local result", "doc": "doc1", "seq": 0}]
+        deps = Deps(
+            embed=Mock(return_value=[0.1] * 1536),
+            vector_search=Mock(return_value=([
                 {"id": "chunk1", "score": 0.15, "text": None, "meta": {}}  # Below 0.18 threshold
-            ], 0.15)
-            
-            mock_hydrate.return_value = [
-                {"id": "chunk1", "text": "Weak local result", "doc": "doc1", "seq": 0}
-            ]
-            
-            # Mock Google grounding results
-            mock_google_ground.return_value = [
-                {"title": "External Article", "snippet": "Recent developments in AI", "link": "https://example.com"},
-                {"title": "News Update", "snippet": "Market trends analysis", "link": "https://news.com"}
-            ]
-            
-            mock_expand.return_value = mock_hydrate.return_value  # No expansion for simplicity
-            
+            ], 0.15)),
+            hydrate=Mock(return_value=weak),
+            expand=Mock(return_value=weak),  # No expansion for simplicity
             # Mock combined context building
-            mock_build.return_value = """[#1] doc1::0
+            build_context=Mock(return_value="""[#1] doc1::0
 Weak local result
 
 ### External Web Context (Google)
@@ -162,30 +148,31 @@ Recent developments in AI
 
 [G#2] News Update  
 Market trends analysis
-(https://news.com)"""
-            
-            mock_answer.return_value = "Based on local docs [#1] and external sources [G#1] [G#2], here's the analysis."
-            
-            # Test grounding workflow
-            from apps.cli import cmd_ask
-            
-            with patch('builtins.print') as mock_print:
-                cmd_ask("recent AI trends", k=5, hybrid=False, rerank=False)
-            
-            # Verify grounding was triggered
-            mock_should_ground.assert_called_once()
-            mock_google_ground.assert_called_once()
-            mock_build.assert_called_once()
-            
-            # Verify Google results were included
-            build_call_args = mock_build.call_args
-            external_snippets = build_call_args[0][1]  # Second argument should be external snippets
-            assert len(external_snippets) == 2
-            
-            # Verify output indicates grounding
-            print_calls = [str(call) for call in mock_print.call_args_list]
-            output_text = " ".join(print_calls)
-            assert "grounding" in output_text.lower()
+(https://news.com)"""),
+            answer=Mock(return_value=["Based on local docs [#1] and external sources [G#1] [G#2], here's the analysis."]),
+        )
+        
+        mocked_pipeline.grounding_enabled.return_value = True
+        mocked_pipeline.should_ground.return_value = True  # Trigger grounding
+        mocked_pipeline.google_ground.return_value = [
+            {"title": "External Article", "snippet": "Recent developments in AI", "link": "https://example.com"},
+            {"title": "News Update", "snippet": "Market trends analysis", "link": "https://news.com"}
+        ]
+        
+        cmd_ask("recent AI trends", k=5, hybrid=False, rerank=False, deps=deps)
+        
+        # Verify grounding was triggered
+        mocked_pipeline.should_ground.assert_called_once()
+        mocked_pipeline.google_ground.assert_called_once()
+        deps.build_context.assert_called_once()
+        
+        # Verify Google results were included
+        build_call_args = deps.build_context.call_args
+        external_snippets = build_call_args[0][1]  # Second argument should be external snippets
+        assert len(external_snippets) == 2
+        
+        # Verify output indicates grounding
+        assert "grounding" in _printed(mocked_pipeline.print).lower()
     
     def test_screenshot_ingestion_workflow(self):
         """Test 4: Screenshot capture → ingest → OCR workflow"""
@@ -294,6 +281,46 @@ class TestServiceIntegration:
             result = should_use_grounding(0.1, 2, 10)  # Weak similarity, few results
             assert result is False
     
+    @pytest.fixture
+    def google_search(self):
+        """Configured Google Search over a mocked HTTP session, with an empty result cache"""
+        from core.cache import search_results_cache
+        
+        search_results_cache.clear()
+        with patch('gcp.search.settings') as mock_settings, \
+             patch('gcp.search._session') as mock_session:
+            mock_settings.google_search_api_key = "key"
+            mock_settings.google_search_cx = "cx"
+            mock_session.get.return_value.json.return_value = {
+                "items": [{"title": "Result", "link": "https://example.com", "snippet": "Snippet"}]
+            }
+            yield mock_session
+        search_results_cache.clear()
+    
+    def test_grounding_reuses_one_http_session(self, google_search):
+        """Test that grounding calls share a keep-alive session"""
+        from gcp.search import google_ground
+        
+        for query in ("first query", "second query"):
+            assert google_ground(query, max_results=1)[0]["title"] == "Result"
+        
+        assert google_search.get.call_count == 2
+    
+    def test_repeated_grounding_served_from_cache(self, google_search):
+        """Test that a repeated grounded question skips the web search, but failures are retried"""
+        import requests
+        from gcp.search import google_ground
+        
+        google_search.get.side_effect = requests.exceptions.ConnectionError("offline")
+        assert google_ground("recent AI trends") == []
+        
+        google_search.get.side_effect = None
+        first = google_ground("recent AI trends")
+        second = google_ground("recent AI trends")
+        
+        assert first == second and first[0]["title"] == "Result"
+        assert google_search.get.call_count == 2  # the failure, then one successful search
+    
     def test_docai_fallback_to_local(self):
         """Test DocAI fallback to local parsing"""
         
@@ -0,0 +1,147 @@
+"""
+Unit tests for web crawler module
+"""
+
+import io
+import pytest
+from unittest.mock import MagicMock, patch
+
+from tools.crawler import WebCrawler
+
+
+def _response(body: bytes, status_code: int = 200, headers=None):
+    """Streamed response whose body is read from raw"""
+    response = MagicMock(status_code=status_code, headers=headers or {})
+    response.raw = io.BytesIO(body)
+    response.text = body.decode()
+    response.__enter__.return_value = response
+    return response
+
+
+SITEMAP_INDEX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>https://example.com/pages.xml</loc></sitemap>
+  <sitemap><loc>https://example.com/index.xml</loc></sitemap>
+</sitemapindex>"""
+
+PAGES = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>https://example.com/a</loc><lastmod>2025-01-01</lastmod></url>
+  <url><loc> https://example.com/b </loc></url>
+</urlset>"""
+
+
+class TestWebCrawler:
+    """Test suite for sitemap and page crawling"""
+
+    def test_sitemap_index_is_followed_lazily(self):
+        """Test that sitemap entries stream out and nested sitemaps are visited once"""
+        crawler = WebCrawler()
+        bodies = {
+            "https://example.com/index.xml": SITEMAP_INDEX,
+            "https://example.com/pages.xml": PAGES,
+        }
+
+        with patch.object(crawler.session, 'get', side_effect=lambda url, **kw: _response(bodies[url])) as mock_get:
+            entries = crawler.crawl_sitemap("https://example.com/index.xml")
+            mock_get.assert_not_called()
+            entries = list(entries)
+
+        assert entries == [
+            {"url": "https://example.com/a", "lastmod": "2025-01-01"},
+            {"url": "https://example.com/b", "lastmod": None},
+        ]
+        assert mock_get.call_count == 2
+
+    def test_unchanged_page_is_not_reparsed(self):
+        """Test that a 304 revalidation returns the stored page"""
+        crawler = WebCrawler()
+        first = _response(b"<title>Hi</title><p>Hello <b>world</b></p><script>x()</script>",
+                          headers={"ETag": '"v1"'})
+
+        with patch.object(crawler.session, 'get', side_effect=[first, _response(b"", status_code=304)]) as mock_get, \
+             patch.object(crawler, '_extract', wraps=crawler._extract) as mock_extract:
+            page = crawler.fetch_page("https://example.com/a")
+            assert crawler.fetch_page("https://example.com/a") is page
+
+        assert page["title"] == "Hi"
+        assert "Hello world" in page["content"] and "x()" not in page["content"]
+        assert mock_extract.call_count == 1
+        assert mock_get.call_args.kwargs["headers"] == {"If-None-Match": '"v1"'}
+
+    def test_last_modified_revalidation_and_bounded_store(self):
+        """Test a Last-Modified 304 round-trip and that only max_cached_pages are kept"""
+        crawler = WebCrawler(max_cached_pages=2)
+        stamp = "Wed, 01 Jan 2025 00:00:00 GMT"
+        responses = {
+            "https://example.com/a": [_response(b"<title>A</title>", headers={"Last-Modified": stamp}),
+                                      _response(b"", status_code=304)],
+            "https://example.com/b": [_response(b"<title>B</title>", headers={"ETag": '"b"'})],
+            "https://example.com/c": [_response(b"<title>C</title>", headers={"ETag": '"c"'})],
+        }
+        requests_sent = []
+
+        def get(url, headers=None, **kwargs):
+            requests_sent.append((url, headers))
+            return responses[url].pop(0)
+
+        with patch.object(crawler.session, 'get', side_effect=get):
+            page = crawler.fetch_page("https://example.com/a")
+            assert crawler.fetch_page("https://example.com/a") is page
+            crawler.fetch_page("https://example.com/b")
+            crawler.fetch_page("https://example.com/c")
+
+        assert requests_sent[1] == ("https://example.com/a", {"If-Modified-Since": stamp})
+        assert len(crawler._pages._cache) == 2
+        assert crawler._pages.get("https://example.com/a") is None
+
+    def test_crawl_urls_overlaps_fetches(self):
+        """Test that pages are fetched concurrently and every successful one is yielded"""
+        import threading
+        import time
+
+        crawler = WebCrawler(max_workers=8)
+        lock = threading.Lock()
+        in_flight = peak = 0
+
+        def slow_get(url, **kwargs):
+            nonlocal in_flight, peak
+            with lock:
+                in_flight += 1
+                peak = max(peak, in_flight)
+            time.sleep(0.05)
+            with lock:
+                in_flight -= 1
+            if url.endswith("/broken"):
+                raise ConnectionError("reset")
+            return _response(f"<title>{url}</title>".encode())
+
+        urls = [f"https://example.com/{i}" for i in range(8)] + ["https://example.com/broken"]
+        with patch.object(crawler.session, 'get', side_effect=slow_get):
+            pages = list(crawler.crawl_urls(urls))
+
+        assert sorted(p["title"] for p in pages) == sorted(urls[:8])
+        assert peak > 1
+
+    def test_crawl_urls_reads_input_lazily(self):
+        """Test that only a bounded window of URLs is pulled ahead of the pages yielded"""
+        crawler = WebCrawler(max_workers=2)
+        pulled = 0
+
+        def source():
+            nonlocal pulled
+            for i in range(100):
+                pulled += 1
+                yield f"https://example.com/{i}"
+
+        with patch.object(crawler.session, 'get', side_effect=lambda url, **kw: _response(b"<title>x</title>")):
+            pages = crawler.crawl_urls(source())
+            next(pages)
+            assert pulled <= 8  # a window of 2 * max_workers, plus one refill
+            pages.close()
+
+        assert pulled < 100
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
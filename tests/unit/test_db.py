@@ -0,0 +1,191 @@
+"""
+Unit tests for database schema setup, migrations and the retrieval log writer
+"""
+
+import queue
+import threading
+
+import pytest
+from unittest.mock import Mock, patch
+from sqlalchemy import create_engine, event, inspect, select
+
+import state.db as db
+
+# The schema as the original CREATE TABLE script left it, before schema_meta
+BASELINE_SCHEMA = [
+    "CREATE TABLE documents (id TEXT PRIMARY KEY, path TEXT, source TEXT, title TEXT, author TEXT,"
+    " mime TEXT, created_at TEXT, updated_at TEXT, hash TEXT, tags TEXT)",
+    "CREATE TABLE chunks (id TEXT PRIMARY KEY, document_id TEXT, seq INTEGER, text TEXT, tokens INTEGER,"
+    " metadata TEXT, created_at TEXT)",
+    "CREATE TABLE embeddings (chunk_id TEXT PRIMARY KEY, provider TEXT, model TEXT, dim INTEGER,"
+    " vector_id TEXT, created_at TEXT)",
+    "CREATE TABLE retrieval_logs (id TEXT PRIMARY KEY, query TEXT, filters TEXT, candidate_ids TEXT,"
+    " chosen_ids TEXT, scores TEXT, created_at TEXT)",
+]
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """A throwaway SQLite database standing in for the configured one"""
+    test_engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", future=True)
+    with patch.object(db, "engine", test_engine):
+        yield test_engine
+    test_engine.dispose()
+
+
+@pytest.fixture
+def log_queue():
+    """An empty retrieval log queue with no flusher running yet"""
+    with patch.object(db, "_log_queue", queue.Queue(maxsize=10000)) as log_queue, \
+         patch.object(db, "_log_flusher", None):
+        yield log_queue
+
+
+def _applied_versions(engine):
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(select(db.schema_meta_table.c.version).order_by("version"))]
+
+
+def _columns(engine, table):
+    return {c["name"] for c in inspect(engine).get_columns(table)}
+
+
+class TestInitDb:
+    """Test suite for schema creation and versioned upgrades"""
+
+    def test_fresh_database_is_stamped_without_migrating(self, engine):
+        """Test that a new database gets the current schema and every version, running no migration"""
+        with patch.object(db, "MIGRATIONS", [(name, _fail) for name, _ in db.MIGRATIONS]):
+            db.init_db()
+
+        assert _applied_versions(engine) == list(range(1, len(db.MIGRATIONS) + 1))
+        assert {"vector", "content_hash"} <= _columns(engine, "embeddings")
+        assert "content_hash" in _columns(engine, "chunks")
+
+    def test_baseline_database_is_upgraded(self, engine):
+        """Test that a database from the original schema gets the new columns and indexes"""
+        with engine.begin() as conn:
+            for statement in BASELINE_SCHEMA:
+                conn.exec_driver_sql(statement)
+            conn.exec_driver_sql("INSERT INTO chunks (id, document_id, seq, text) VALUES ('a::#0', 'a', 0, 'hello')")
+            conn.exec_driver_sql("INSERT INTO retrieval_logs (id, scores) VALUES ('json', '[0.5, null, 0.25]')")
+            conn.exec_driver_sql("INSERT INTO retrieval_logs (id, scores) VALUES ('packed', ?)",
+                                 (db.pack_scores([0.75]),))
+
+        db.init_db()
+
+        assert _applied_versions(engine) == list(range(1, len(db.MIGRATIONS) + 1))
+        assert {"vector", "content_hash"} <= _columns(engine, "embeddings")
+        assert "content_hash" in _columns(engine, "chunks")
+        indexes = {i["name"] for i in inspect(engine).get_indexes("chunks")}
+        assert {"idx_chunks_document_seq", "idx_chunks_content_hash"} <= indexes
+        with engine.connect() as conn:
+            assert conn.exec_driver_sql("SELECT text FROM chunks").scalar() == "hello"
+            scores = dict(conn.execute(select(db.retrieval_logs_table.c.id, db.retrieval_logs_table.c.scores)).fetchall())
+        assert db.unpack_scores(scores["json"]) == [0.5, 0.0, 0.25]
+        assert db.unpack_scores(scores["packed"]) == [0.75]
+
+    def test_second_run_is_a_no_op(self, engine):
+        """Test that init_db on an up-to-date database applies and records nothing"""
+        db.init_db()
+        versions = _applied_versions(engine)
+
+        with patch.object(db, "MIGRATIONS", [(name, _fail) for name, _ in db.MIGRATIONS]):
+            db.init_db()
+
+        assert _applied_versions(engine) == versions
+
+
+class TestUpsert:
+    """Test suite for primary-key upserts"""
+
+    @pytest.mark.parametrize("generic", [False, True])
+    def test_upsert_replaces_existing_row(self, engine, generic):
+        """Test that rewriting a chunk id replaces its row, with and without a dialect upsert clause"""
+        db.init_db()
+        stmt = None if generic else db._upsert_chunks
+        row = {"id": "a::#0", "document_id": "a", "seq": 0, "text": "old", "tokens": 1,
+               "metadata": "{}", "created_at": "", "content_hash": "h1"}
+
+        with engine.begin() as conn:
+            db._write_upsert(conn, db.chunks_table, stmt, [row])
+            db._write_upsert(conn, db.chunks_table, stmt, [{**row, "text": "new", "content_hash": "h2"}])
+
+        with engine.connect() as conn:
+            rows = conn.execute(select(db.chunks_table.c.text, db.chunks_table.c.content_hash)).fetchall()
+        assert [tuple(r) for r in rows] == [("new", "h2")]
+
+
+class TestQueryEmbeddings:
+    """Test suite for persisted query embeddings"""
+
+    def test_rows_past_retention_are_ignored_and_pruned(self, engine):
+        """Test that an expired embedding is not loaded and is deleted by the next store"""
+        db.init_db()
+        with engine.begin() as conn:
+            conn.execute(db.query_embeddings_table.insert().values(
+                key=db._query_embedding_key("m", "old"), model="m", vector=b"old",
+                created_at="2000-01-01T00:00:00"))
+
+        assert db.load_query_embeddings("m", ["old"]) == {}
+
+        db.store_query_embeddings("m", {"new": b"new"})
+
+        assert db.load_query_embeddings("m", ["old", "new"]) == {"new": b"new"}
+        with engine.connect() as conn:
+            keys = conn.execute(select(db.query_embeddings_table.c.key)).scalars().all()
+        assert keys == [db._query_embedding_key("m", "new")]
+
+
+class TestRetrievalLogs:
+    """Test suite for the background retrieval log writer"""
+
+    def _start_flusher(self):
+        db._log_flusher = threading.Thread(target=db._flush_retrieval_logs, daemon=True)
+        db._log_flusher.start()
+
+    def test_stop_drains_pending_rows_in_bounded_batches(self, engine, log_queue):
+        """Test that shutdown writes every queued row, at most LOG_BATCH_SIZE per insert"""
+        db.init_db()
+        batches = []
+
+        @event.listens_for(engine, "before_execute")
+        def record_batch(conn, clauseelement, multiparams, params, execution_options):
+            if getattr(clauseelement, "table", None) is db.retrieval_logs_table:
+                # A one-row batch arrives as params rather than multiparams
+                batches.append(len(multiparams) or 1)
+
+        with patch.object(db, "_ensure_log_flusher"):
+            for i in range(5):
+                db.log_retrieval(f"query {i}", ["a", "b"], ["a"], [0.5, 0.25])
+
+        with patch.object(db, "LOG_BATCH_SIZE", 2):
+            self._start_flusher()
+            db._stop_log_flusher()
+
+        assert not db._log_flusher.is_alive()
+        assert batches == [2, 2, 1]
+        with engine.connect() as conn:
+            rows = conn.execute(select(db.retrieval_logs_table.c.query, db.retrieval_logs_table.c.scores)).fetchall()
+        assert sorted(r.query for r in rows) == [f"query {i}" for i in range(5)]
+        assert all(db.unpack_scores(r.scores) == [0.5, 0.25] for r in rows)
+
+    def test_full_queue_drops_rows_without_blocking(self):
+        """Test that log_retrieval discards a row rather than wait on a full queue"""
+        with patch.object(db, "_log_queue", queue.Queue(maxsize=1)) as log_queue, \
+             patch.object(db, "_log_flusher", Mock()), \
+             patch.object(db, "logger") as mock_logger:
+            db.log_retrieval("kept", ["a"], ["a"], [0.5])
+            db.log_retrieval("dropped", ["b"], ["b"], [0.5])
+
+            assert log_queue.qsize() == 1
+            assert log_queue.get_nowait()["query"] == "kept"
+        mock_logger.warning.assert_called_once_with("Retrieval log queue full, dropping entry")
+
+
+def _fail(conn):
+    raise AssertionError("migration should not run")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,131 @@
+"""
+Unit tests for index embedder module
+"""
+
+import pytest
+import threading
+import time
+from unittest.mock import Mock, patch
+
+from index.embedder import EmbedCoalescer
+
+
+class TestEmbedCoalescer:
+    """Test suite for query embedding coalescing"""
+    
+    def test_concurrent_queries_share_one_request(self):
+        """Test that concurrent queries are embedded in a single batch"""
+        batches = []
+        
+        def fake_embed(texts):
+            batches.append(list(texts))
+            time.sleep(0.01)
+            return [[float(len(t))] for t in texts]
+        
+        coalescer = EmbedCoalescer(max_batch=8, max_wait=0.05)
+        results = {}
+        
+        def worker(i):
+            results[i] = coalescer.embed("q" * i)
+        
+        with patch('index.embedder.embed_texts', side_effect=fake_embed):
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(1, 9)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        
+        assert len(batches) == 1
+        assert sorted(len(t) for t in batches[0]) == list(range(1, 9))
+        assert all(results[i] == [float(i)] for i in range(1, 9))
+    
+    def test_errors_propagate_to_every_waiter(self):
+        """Test that a failed batch raises for the caller"""
+        coalescer = EmbedCoalescer(max_wait=0.0)
+        
+        with patch('index.embedder.embed_texts', side_effect=RuntimeError("API down")):
+            with pytest.raises(RuntimeError, match="API down"):
+                coalescer.embed("test query")
+    
+    def test_cached_query_skips_batching_window(self):
+        """Test that a repeated query is served from the embedding cache without waiting"""
+        from core.cache import embedding_cache
+        from index.embedder import EMBED_MODEL
+        
+        coalescer = EmbedCoalescer(max_wait=5.0)
+        key = embedding_cache._make_key(EMBED_MODEL, "repeated question")
+        embedding_cache.put(key, [0.5, 0.5])
+        try:
+            with patch('index.embedder.embed_texts') as mock_embed:
+                start = time.perf_counter()
+                assert coalescer.embed("repeated question") == [0.5, 0.5]
+                assert time.perf_counter() - start < 1.0
+            mock_embed.assert_not_called()
+        finally:
+            embedding_cache.delete(key)
+    
+    def test_persisted_queries_survive_a_new_process(self, tmp_path):
+        """Test that a query embedded by one coalescer is reused by a fresh one from the state DB"""
+        from sqlalchemy import create_engine
+        from core.cache import embedding_cache
+        from state.db import metadata
+        
+        test_engine = create_engine(f"sqlite:///{tmp_path / 'state.db'}", future=True)
+        metadata.create_all(test_engine)
+        
+        with patch('state.db.engine', test_engine), \
+             patch('index.embedder.embed_texts', side_effect=lambda texts: [[0.25, -0.5] for _ in texts]) as mock_embed:
+            try:
+                assert EmbedCoalescer(max_wait=0.0, persist=True).embed("asked yesterday") == [0.25, -0.5]
+                # A new process starts with an empty in-memory cache
+                embedding_cache.clear()
+                assert EmbedCoalescer(max_wait=0.0, persist=True).embed("asked yesterday") == [0.25, -0.5]
+            finally:
+                embedding_cache.clear()
+        
+        assert mock_embed.call_count == 1
+    
+    def test_missing_state_tables_fall_back_to_embedding(self, tmp_path):
+        """Test that persistence is skipped when nothing has been ingested yet"""
+        from sqlalchemy import create_engine
+        
+        test_engine = create_engine(f"sqlite:///{tmp_path / 'empty.db'}", future=True)
+        
+        with patch('state.db.engine', test_engine), \
+             patch('index.embedder.embed_texts', return_value=[[1.0]]) as mock_embed:
+            assert EmbedCoalescer(max_wait=0.0, persist=True).embed("first question") == [1.0]
+        
+        assert mock_embed.call_count == 1
+
+
+
+class TestEmbedTexts:
+    """Test suite for batch embedding requests"""
+    
+    def test_large_inputs_are_split_into_batches(self):
+        """Test that embed_texts sends at most embed_batch_size texts per request"""
+        from core.cache import embedding_cache
+        from index.embedder import embed_texts
+        
+        def fake_create(model, input, encoding_format):
+            response = Mock()
+            response.data = [Mock(embedding=[float(text.split()[-1])]) for text in input]
+            return response
+        
+        texts = [f"batch text {i}" for i in range(600)]
+        try:
+            with patch('index.embedder.client') as mock_client, \
+                 patch('index.embedder.settings') as mock_settings:
+                mock_settings.embed_batch_size = 256
+                mock_client.return_value.embeddings.create.side_effect = fake_create
+                vectors = embed_texts(texts)
+        finally:
+            embedding_cache.clear()
+        
+        create = mock_client.return_value.embeddings.create
+        assert [len(c.kwargs["input"]) for c in create.call_args_list] == [256, 256, 88]
+        assert vectors == [[float(i)] for i in range(600)]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
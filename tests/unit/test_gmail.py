@@ -0,0 +1,147 @@
+"""
+Unit tests for Gmail email ingestion
+"""
+
+import base64
+
+import pytest
+from unittest.mock import Mock
+
+from tools.gmail import GmailIngester
+
+
+def _b64(text):
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def _message(message_id, body="hello"):
+    return {
+        "id": message_id,
+        "threadId": f"thread-{message_id}",
+        "snippet": body[:10],
+        "payload": {
+            "mimeType": "text/plain",
+            "headers": [{"name": "Subject", "value": f"Subject {message_id}"}],
+            "body": {"data": _b64(body)},
+        },
+    }
+
+
+class FakeBatch:
+    """Stand-in for a Gmail batch request that answers each added get on execute"""
+
+    def __init__(self, callback, failing):
+        self.callback = callback
+        self.failing = failing
+        self.request_ids = []
+
+    def add(self, request, request_id):
+        self.request_ids.append(request_id)
+
+    def execute(self):
+        for request_id in self.request_ids:
+            if request_id in self.failing:
+                self.callback(request_id, None, RuntimeError("404 Not Found"))
+            else:
+                self.callback(request_id, _message(request_id), None)
+
+
+def _service(pages, failing=()):
+    """A Gmail service whose list() returns the given id pages in turn"""
+    service = Mock()
+    responses = []
+    for i, page in enumerate(pages):
+        response = {"messages": [{"id": message_id} for message_id in page]}
+        if i < len(pages) - 1:
+            response["nextPageToken"] = f"page-{i + 1}"
+        responses.append(response)
+    service.users.return_value.messages.return_value.list.return_value.execute.side_effect = responses
+    service.batches = []
+
+    def new_batch(callback):
+        service.batches.append(FakeBatch(callback, set(failing)))
+        return service.batches[-1]
+
+    service.new_batch_http_request.side_effect = new_batch
+    return service
+
+
+def _ingester(service):
+    ingester = GmailIngester(credentials_path="token.json")
+    ingester._service = service
+    return ingester
+
+
+class TestFetchEmails:
+    """Test suite for listing and batch-fetching messages"""
+
+    def test_pages_until_max_results(self):
+        """Test that list pages are followed and the ids are capped at max_results"""
+        service = _service([["m1", "m2"], ["m3", "m4"], ["m5", "m6"]])
+
+        emails = _ingester(service).fetch_emails("from:alice", max_results=3)
+
+        assert [e["id"] for e in emails] == ["m1", "m2", "m3"]
+        list_calls = service.users.return_value.messages.return_value.list.call_args_list
+        assert [c.kwargs["pageToken"] for c in list_calls] == [None, "page-1"]
+        assert [c.kwargs["maxResults"] for c in list_calls] == [3, 1]
+        assert emails[0]["subject"] == "Subject m1"
+        assert emails[0]["body"] == "hello"
+
+    def test_ids_are_batched(self):
+        """Test that message gets go out _BATCH_SIZE per batch request"""
+        ids = [f"m{i}" for i in range(120)]
+        service = _service([ids])
+
+        emails = _ingester(service).fetch_emails(max_results=120)
+
+        assert [len(batch.request_ids) for batch in service.batches] == [50, 50, 20]
+        assert [e["id"] for e in emails] == ids
+
+    def test_failed_message_is_skipped(self):
+        """Test that one message failing in a batch drops only that message"""
+        service = _service([["m1", "m2", "m3"]], failing={"m2"})
+
+        emails = _ingester(service).fetch_emails()
+
+        assert [e["id"] for e in emails] == ["m1", "m3"]
+
+    def test_list_failure_returns_no_emails(self):
+        """Test that an API error while listing returns an empty list"""
+        service = _service([])
+        service.users.return_value.messages.return_value.list.return_value.execute.side_effect = RuntimeError("403")
+
+        assert _ingester(service).fetch_emails() == []
+
+
+class TestPlainText:
+    """Test suite for extracting the text/plain body"""
+
+    def test_nested_multipart_body_is_decoded(self):
+        """Test that the first text/plain part is found inside nested multiparts and URL-safe decoded"""
+        payload = {
+            "mimeType": "multipart/mixed",
+            "parts": [
+                {
+                    "mimeType": "multipart/alternative",
+                    "parts": [
+                        {"mimeType": "text/html", "body": {"data": _b64("<p>skip</p>")}},
+                        {"mimeType": "text/plain", "body": {"data": _b64("Grüße from the thread >>>???")}},
+                    ],
+                },
+                {"mimeType": "text/plain", "body": {"data": _b64("attachment text")}},
+            ],
+        }
+
+        assert GmailIngester()._plain_text(payload) == "Grüße from the thread >>>???"
+
+    def test_payload_without_plain_text_is_empty(self):
+        """Test that a message with only HTML parts has an empty body"""
+        payload = {"mimeType": "multipart/alternative",
+                   "parts": [{"mimeType": "text/html", "body": {"data": _b64("<p>hi</p>")}}]}
+
+        assert GmailIngester()._plain_text(payload) == ""
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,166 @@
+"""
+Unit tests for conversation memory
+"""
+
+import pytest
+from unittest.mock import Mock, patch
+
+from state.memory import ConversationMemory
+
+
+@pytest.fixture
+def clock():
+    """A controllable time.monotonic for the memory module"""
+    with patch('state.memory.time.monotonic', return_value=1000.0) as mock_monotonic:
+        yield mock_monotonic
+
+
+class TestMessageCaps:
+    """Test suite for the per-thread turn and token caps"""
+
+    def test_turn_cap_keeps_newest_messages(self):
+        """Test that a thread never holds more than max_turns messages"""
+        memory = ConversationMemory(max_turns=5)
+        for i in range(12):
+            memory.add_message("t1", "user", f"message {i}")
+
+        messages = memory.get_conversation("t1")
+        assert len(messages) == 5
+        assert messages[-1]["content"] == "message 11"
+
+    def test_token_cap_bounds_thread_size(self):
+        """Test that old messages are dropped once the thread exceeds max_tokens"""
+        memory = ConversationMemory(max_tokens=100)
+        for i in range(20):
+            memory.add_message("t1", "user", "x" * 76)  # 20 tokens each
+
+        assert memory._tokens["t1"] <= 100
+        assert memory._tokens["t1"] == sum(len(m["content"]) // 4 + 1 for m in memory.get_conversation("t1"))
+        assert len(memory.get_conversation("t1")) == 5
+
+    def test_oversized_message_is_kept_alone(self):
+        """Test that a single message over the token cap is not evicted"""
+        memory = ConversationMemory(max_tokens=10)
+        memory.add_message("t1", "user", "x" * 400)
+
+        assert len(memory.get_conversation("t1")) == 1
+
+
+class TestRetentionEviction:
+    """Test suite for value-based eviction among the oldest messages"""
+
+    def test_system_message_outlives_older_chatter(self):
+        """Test that a system message in the eviction window is kept over user turns"""
+        memory = ConversationMemory(max_turns=30)
+        memory.add_message("t1", "system", "You are helpful")
+        for i in range(60):
+            memory.add_message("t1", "user", f"message {i}")
+
+        messages = memory.get_conversation("t1")
+        assert len(messages) == 30
+        assert messages[0]["content"] == "You are helpful"
+        assert messages[-1]["content"] == "message 59"
+
+    def test_cited_turn_outlives_uncited_one(self):
+        """Test that cite_count in metadata raises a message's retention"""
+        # The oldest 10% of a 21-message thread are the eviction candidates
+        memory = ConversationMemory(max_turns=20)
+        memory.add_message("t1", "assistant", "cited answer", {"cite_count": 3})
+        memory.add_message("t1", "assistant", "plain answer")
+        for i in range(19):
+            memory.add_message("t1", "user", f"message {i}")
+
+        contents = [m["content"] for m in memory.get_conversation("t1")]
+        assert contents[0] == "cited answer"
+        assert "plain answer" not in contents
+
+
+class TestThreadExpiry:
+    """Test suite for thread TTL and the thread-count cap"""
+
+    def test_expired_thread_is_not_revived_by_a_write(self, clock):
+        """Test that writing to an idle-expired thread starts it over"""
+        memory = ConversationMemory(thread_ttl=60)
+        memory.add_message("t1", "user", "old question")
+
+        clock.return_value += 61
+        memory.add_message("t1", "user", "new question")
+
+        assert [m["content"] for m in memory.get_conversation("t1")] == ["new question"]
+        assert memory._tokens["t1"] == len("new question") // 4 + 1
+
+    def test_sweep_drops_idle_threads(self, clock):
+        """Test that sweep removes threads idle past the TTL and keeps active ones"""
+        memory = ConversationMemory(thread_ttl=60)
+        memory.add_message("idle", "user", "hello")
+        clock.return_value += 30
+        memory.add_message("active", "user", "hello")
+
+        clock.return_value += 45
+        assert memory.sweep() == 1
+
+        assert list(memory.conversations) == ["active"]
+        assert "idle" not in memory._tokens and "idle" not in memory._last_active
+
+    def test_least_recently_active_thread_is_evicted(self, clock):
+        """Test that past max_threads the thread written longest ago is dropped"""
+        memory = ConversationMemory(max_threads=2)
+        for thread_id in ("a", "b"):
+            memory.add_message(thread_id, "user", "hello")
+            clock.return_value += 1
+        memory.add_message("a", "user", "still here")
+        clock.return_value += 1
+
+        memory.add_message("c", "user", "hello")
+
+        assert list(memory.conversations) == ["a", "c"]
+        assert len(memory.get_conversation("a")) == 2
+
+
+class TestSummarizeIfOver:
+    """Test suite for folding old turns into a summary"""
+
+    def _thread(self, turns=10):
+        memory = ConversationMemory()
+        for i in range(turns):
+            memory.add_message("t1", "user" if i % 2 == 0 else "assistant", f"turn {i} " + "x" * 40)
+        return memory
+
+    def test_under_budget_is_left_alone(self):
+        """Test that a thread within the token budget is not summarized"""
+        memory = self._thread()
+        summarize = Mock()
+
+        assert memory.summarize_if_over("t1", token_budget=10_000, summarize=summarize) is False
+        summarize.assert_not_called()
+        assert len(memory.get_conversation("t1")) == 10
+
+    def test_old_turns_fold_into_summary(self):
+        """Test that all but the recent turns become one system summary with recounted tokens"""
+        memory = self._thread()
+        summarize = Mock(return_value="they talked")
+
+        assert memory.summarize_if_over("t1", token_budget=50, keep_recent=4, summarize=summarize) is True
+
+        folded = summarize.call_args[0][0]
+        assert [m["content"][:6] for m in folded] == [f"turn {i}" for i in range(6)]
+        messages = memory.get_conversation("t1")
+        assert len(messages) == 5
+        assert messages[0]["role"] == "system" and messages[0]["metadata"]["summary"] is True
+        assert "they talked" in messages[0]["content"]
+        assert messages[-1]["content"].startswith("turn 9")
+        assert memory._tokens["t1"] == sum(len(m["content"]) // 4 + 1 for m in messages)
+
+    def test_failed_summary_keeps_history(self):
+        """Test that a summarizer error restores the original messages in order"""
+        memory = self._thread()
+        before = memory.get_conversation("t1")
+
+        summarize = Mock(side_effect=RuntimeError("rate limited"))
+        assert memory.summarize_if_over("t1", token_budget=50, keep_recent=4, summarize=summarize) is False
+
+        assert memory.get_conversation("t1") == before
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -7,12 +7,21 @@ from unittest.mock import Mock, patch, MagicMock
 from typing import List, Dict
 
 from rag.reranker import rerank, _voyage_rerank, is_rerank_available
+from core.cache import rerank_cache
 from core.config import settings
 
 
 class TestReranker:
     """Test suite for reranking functionality"""
     
+    @pytest.fixture(autouse=True)
+    def reset_voyage_client(self):
+        """Don't let a client or ranking cached by one test leak into the next"""
+        rerank_cache.clear()
+        with patch('rag.reranker._voyage_client', None):
+            yield
+        rerank_cache.clear()
+    
     @pytest.fixture
     def sample_snippets(self):
         """Sample snippets for testing"""
@@ -125,6 +134,38 @@ class TestReranker:
         assert result[0]["rerank_score"] == 0.95
         assert result[0]["reranker"] == "voyage"
     
+    @patch('rag.reranker.settings')
+    @patch('rag.reranker.voyageai')
+    def test_voyage_client_reused_across_calls(self, mock_voyageai, mock_settings, sample_snippets, mock_voyage_client):
+        """Test that the Voyage client is created once and reused"""
+        mock_settings.voyage_api_key = "test-key"
+        mock_voyageai.Client.return_value = mock_voyage_client
+        
+        _voyage_rerank("first query", sample_snippets)
+        _voyage_rerank("second query", sample_snippets)
+        
+        mock_voyageai.Client.assert_called_once_with(api_key="test-key")
+        assert mock_voyage_client.rerank.call_count == 2
+    
+    @patch('rag.reranker.settings')
+    @patch('rag.reranker.voyageai')
+    def test_repeated_rerank_served_from_cache(self, mock_voyageai, mock_settings, sample_snippets, mock_voyage_client):
+        """Test that reranking the same question and snippets calls Voyage once"""
+        mock_settings.voyage_api_key = "test-key"
+        mock_voyageai.Client.return_value = mock_voyage_client
+        
+        first = rerank("test query", sample_snippets)
+        second = rerank("test query", sample_snippets)
+        
+        assert second == first
+        assert [s["id"] for s in second] == ["chunk2", "chunk1", "chunk3"]
+        assert mock_voyage_client.rerank.call_count == 1
+        
+        # Different text under the same ids is a different ranking request
+        changed = [{**s, "text": s["text"] + " (revised)"} for s in sample_snippets]
+        rerank("test query", changed)
+        assert mock_voyage_client.rerank.call_count == 2
+    
     def test_is_rerank_available_with_key(self):
         """Test is_rerank_available when Voyage key is present"""
         with patch('rag.reranker.settings') as mock_settings:
@@ -177,6 +218,23 @@ class TestReranker:
         assert result[0]["id"] == "chunk1"
         assert result[0]["rerank_score"] == 0.9
     
+    @patch('rag.reranker.settings')
+    def test_rerank_skipped_for_confident_top_hit(self, mock_settings):
+        """Test that an unambiguous top vector hit skips the rerank call"""
+        mock_settings.voyage_api_key = "test-key"
+        confident_snippets = [
+            {"id": "chunk1", "text": "Exact answer", "score": 0.97},
+            {"id": "chunk2", "text": "Loosely related", "score": 0.61}
+        ]
+        
+        with patch('rag.reranker._voyage_rerank') as mock_voyage_rerank, \
+             patch('rag.reranker.logger') as mock_logger:
+            result = rerank("test query", confident_snippets)
+            
+            assert result == confident_snippets
+            mock_voyage_rerank.assert_not_called()
+            mock_logger.info.assert_called_with("Rerank skipped (confident top-1)")
+    
     def test_rerank_with_none_input(self):
         """Test reranking handles None input gracefully"""
         with pytest.raises(TypeError):
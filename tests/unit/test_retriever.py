@@ -3,13 +3,27 @@ Unit tests for RAG retriever module
 """
 
 import pytest
+from collections import namedtuple
 from unittest.mock import Mock, patch, MagicMock
 from typing import List, Dict
 import numpy as np
 
 from rag.retriever import vector_search
+from core.cache import vector_search_cache
 from core.config import settings
 
+# Plain stand-ins for Pinecone's match and query response objects
+Match = namedtuple('Match', 'id score metadata')
+QueryResult = namedtuple('QueryResult', 'matches')
+
+
+@pytest.fixture(autouse=True)
+def clear_vector_search_cache():
+    """Each test sees Pinecone, not results cached by an earlier test"""
+    vector_search_cache.clear()
+    yield
+    vector_search_cache.clear()
+
 
 class TestVectorRetriever:
     """Test suite for vector retrieval functionality"""
@@ -18,12 +32,11 @@ class TestVectorRetriever:
     def mock_pinecone_index(self):
         """Mock Pinecone index for testing"""
         mock_index = Mock()
-        mock_result = Mock()
-        mock_result.matches = [
-            Mock(id="chunk1", score=0.95, metadata={"rid": "chunk1", "meta": "{}"}),
-            Mock(id="chunk2", score=0.87, metadata={"rid": "chunk2", "meta": "{}"}),
-            Mock(id="chunk3", score=0.73, metadata={"rid": "chunk3", "meta": "{}"})
-        ]
+        mock_result = QueryResult(matches=[
+            Match(id="chunk1", score=0.95, metadata={"rid": "chunk1", "meta": "{}"}),
+            Match(id="chunk2", score=0.87, metadata={"rid": "chunk2", "meta": "{}"}),
+            Match(id="chunk3", score=0.73, metadata={"rid": "chunk3", "meta": "{}"})
+        ])
         mock_index.query.return_value = mock_result
         return mock_index
     
@@ -37,9 +50,10 @@ class TestVectorRetriever:
         """Test successful vector search"""
         mock_get_index.return_value = mock_pinecone_index
         
-        results = vector_search(sample_query_vector, top_k=3)
+        results, best_score = vector_search(sample_query_vector, top_k=3)
         
         assert len(results) == 3
+        assert best_score == 0.95
         assert results[0]['id'] == 'chunk1'
         assert results[0]['score'] == 0.95
         assert results[1]['id'] == 'chunk2'
@@ -57,14 +71,14 @@ class TestVectorRetriever:
     def test_vector_search_empty_results(self, mock_get_index, sample_query_vector):
         """Test vector search with empty results"""
         mock_index = Mock()
-        mock_result = Mock()
-        mock_result.matches = []
+        mock_result = QueryResult(matches=[])
         mock_index.query.return_value = mock_result
         mock_get_index.return_value = mock_index
         
-        results = vector_search(sample_query_vector, top_k=5)
+        results, best_score = vector_search(sample_query_vector, top_k=5)
         
-        assert len(results) == 0
+        assert results == []
+        assert best_score == 0.0
     
     @patch('rag.retriever.get_index')
     def test_vector_search_with_namespace(self, mock_get_index, mock_pinecone_index, sample_query_vector):
@@ -111,17 +125,16 @@ class TestVectorRetriever:
     def test_vector_search_score_ordering(self, mock_get_index, sample_query_vector):
         """Test that results are properly ordered by score"""
         mock_index = Mock()
-        mock_result = Mock()
         # Unordered matches
-        mock_result.matches = [
-            Mock(id="chunk2", score=0.75, metadata={"rid": "chunk2", "meta": "{}"}),
-            Mock(id="chunk1", score=0.95, metadata={"rid": "chunk1", "meta": "{}"}),
-            Mock(id="chunk3", score=0.82, metadata={"rid": "chunk3", "meta": "{}"})
-        ]
+        mock_result = QueryResult(matches=[
+            Match(id="chunk2", score=0.75, metadata={"rid": "chunk2", "meta": "{}"}),
+            Match(id="chunk1", score=0.95, metadata={"rid": "chunk1", "meta": "{}"}),
+            Match(id="chunk3", score=0.82, metadata={"rid": "chunk3", "meta": "{}"})
+        ])
         mock_index.query.return_value = mock_result
         mock_get_index.return_value = mock_index
         
-        results = vector_search(sample_query_vector, top_k=3)
+        results, best_score = vector_search(sample_query_vector, top_k=3)
         
         # Results should maintain Pinecone's ordering
         assert results[0]['id'] == 'chunk2'
@@ -132,20 +145,37 @@ class TestVectorRetriever:
     def test_vector_search_metadata_handling(self, mock_get_index, sample_query_vector):
         """Test proper metadata extraction"""
         mock_index = Mock()
-        mock_result = Mock()
         test_metadata = {"rid": "test_chunk", "meta": '{"source": "test.pdf", "page": 1}'}
-        mock_result.matches = [
-            Mock(id="test_chunk", score=0.9, metadata=test_metadata)
-        ]
+        mock_result = QueryResult(matches=[
+            Match(id="test_chunk", score=0.9, metadata=test_metadata)
+        ])
         mock_index.query.return_value = mock_result
         mock_get_index.return_value = mock_index
         
-        results = vector_search(sample_query_vector, top_k=1)
+        results, _best_score = vector_search(sample_query_vector, top_k=1)
         
         assert len(results) == 1
         assert results[0]['meta'] == test_metadata
         assert results[0]['text'] is None  # Should be filled by hydrate step
 
+    @patch('rag.retriever.get_index')
+    def test_repeated_search_served_from_cache(self, mock_get_index, mock_pinecone_index, sample_query_vector):
+        """Test that a repeated query vector skips Pinecone and returns unshared match dicts"""
+        mock_get_index.return_value = mock_pinecone_index
+        
+        first, best = vector_search(sample_query_vector, top_k=3)
+        first[0]["text"] = "hydrated in place"
+        second, cached_best = vector_search(sample_query_vector, top_k=3)
+        
+        assert mock_pinecone_index.query.call_count == 1
+        assert cached_best == best
+        assert [m["id"] for m in second] == ["chunk1", "chunk2", "chunk3"]
+        assert second[0]["text"] is None
+        
+        # A different top_k is a different search
+        vector_search(sample_query_vector, top_k=5)
+        assert mock_pinecone_index.query.call_count == 2
+
 
 @pytest.mark.asyncio
 class TestVectorRetrieverAsync:
@@ -157,25 +187,78 @@ class TestVectorRetrieverAsync:
         import asyncio
         
         mock_index = Mock()
-        mock_result = Mock()
-        mock_result.matches = [
-            Mock(id="chunk1", score=0.9, metadata={"rid": "chunk1", "meta": "{}"})
-        ]
+        mock_result = QueryResult(matches=[
+            Match(id="chunk1", score=0.9, metadata={"rid": "chunk1", "meta": "{}"})
+        ])
         mock_index.query.return_value = mock_result
         mock_get_index.return_value = mock_index
         
-        # Simulate concurrent searches
-        query_vector = [0.1] * 1536
+        # Simulate concurrent searches with distinct vectors so none is a cache hit
         tasks = [
-            asyncio.create_task(asyncio.to_thread(vector_search, query_vector, top_k=1))
-            for _ in range(5)
+            asyncio.create_task(asyncio.to_thread(vector_search, [0.1 * (i + 1)] * 1536, top_k=1))
+            for i in range(5)
         ]
         
         results = await asyncio.gather(*tasks)
         
         assert len(results) == 5
-        assert all(len(result) == 1 for result in results)
+        assert all(len(matches) == 1 and best == 0.9 for matches, best in results)
+        assert mock_index.query.call_count == 5
+    
+    def test_batch_search_overlaps_round_trips(self):
+        """Test that a batch of query vectors is searched concurrently on one index handle"""
+        import threading
+        from rag.retriever import vector_search_batch
+        
+        vectors = [[float(i)] * 4 for i in range(1, 6)]
+        # Every query blocks until all of them are in flight
+        all_in_flight = threading.Barrier(len(vectors), timeout=5)
+        
+        def blocking_query(namespace, vector, top_k, include_metadata):
+            all_in_flight.wait()
+            return QueryResult(matches=[Match(id=f"chunk-{vector[0]}", score=vector[0], metadata={})])
+        
+        mock_index = Mock()
+        mock_index.query.side_effect = blocking_query
+        
+        with patch('rag.retriever.get_index') as mock_get_index:
+            results = vector_search_batch(vectors, top_k=1, index=mock_index)
+        
+        mock_get_index.assert_not_called()
+        assert not all_in_flight.broken
         assert mock_index.query.call_count == 5
+        assert [r[0][0]["id"] for r in results] == [f"chunk-{v[0]}" for v in vectors]
+    
+    def test_grpc_batch_multiplexes_async_queries(self):
+        """Test that over gRPC every uncached query is in flight before any result is awaited"""
+        from rag.retriever import vector_search_batch
+        
+        in_flight = []
+        
+        def async_query(namespace, vector, top_k, include_metadata, async_req):
+            assert async_req is True
+            response = QueryResult(matches=[Match(id=f"chunk-{vector[0]}", score=0.5, metadata={})])
+            
+            def result():
+                assert len(in_flight) == 3
+                return response
+            
+            in_flight.append(Mock(result=result))
+            return in_flight[-1]
+        
+        mock_index = Mock()
+        mock_index.query.side_effect = async_query
+        vectors = [[float(i)] * 4 for i in range(1, 4)]
+        
+        with patch('rag.retriever.get_index', return_value=mock_index), \
+             patch('rag.retriever.uses_grpc', return_value=True):
+            results = vector_search_batch(vectors, top_k=1)
+            # The batch filled the cache, so a repeat sends nothing
+            repeat = vector_search_batch(vectors, top_k=1)
+        
+        assert len(in_flight) == 3
+        assert [r[0][0]["id"] for r in results] == ["chunk-1.0", "chunk-2.0", "chunk-3.0"]
+        assert repeat == results
 
 
 if __name__ == "__main__":
@@ -0,0 +1,113 @@
+"""
+Unit tests for ScreenshotOne captures
+"""
+
+import io
+import threading
+from urllib.parse import quote_plus
+
+import pytest
+import requests
+from unittest.mock import MagicMock, patch
+
+import tools.screenshotone as screenshotone
+
+
+class BrokenStream(io.RawIOBase):
+    """A response body that drops the connection after its first chunk"""
+
+    def __init__(self):
+        self.sent = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.sent:
+            raise requests.exceptions.ConnectionError("connection reset mid-stream")
+        self.sent = True
+        buffer[:5] = b"\x89PNG\r"
+        return 5
+
+
+def _response(status=200, raw=None):
+    response = MagicMock()
+    response.__enter__.return_value = response
+    response.raw = raw if raw is not None else io.BytesIO(b"image bytes")
+    if status >= 400:
+        error = requests.exceptions.HTTPError(f"{status} error", response=MagicMock(status_code=status))
+        response.raise_for_status.side_effect = error
+    return response
+
+
+@pytest.fixture
+def session():
+    """The pooled session, with tenacity's backoff sleep skipped"""
+    with patch.object(screenshotone, "_session") as mock_session, \
+         patch.object(screenshotone._download.retry, "sleep"):
+        yield mock_session
+
+
+class TestDownload:
+    """Test suite for streaming a capture to disk"""
+
+    def test_mid_stream_failure_leaves_no_files(self, session, tmp_path):
+        """Test that a dropped stream leaves neither a .part file nor a truncated capture"""
+        session.get.side_effect = lambda *args, **kwargs: _response(raw=BrokenStream())
+        output_path = tmp_path / "snap.png"
+
+        with pytest.raises(requests.exceptions.ConnectionError):
+            screenshotone._download("https://api.example/take?url=x", output_path)
+
+        assert session.get.call_count == 3
+        assert list(tmp_path.iterdir()) == []
+
+    def test_rate_limit_is_retried(self, session, tmp_path):
+        """Test that a 429 is retried and the next successful response is saved"""
+        session.get.side_effect = [_response(429), _response()]
+        output_path = tmp_path / "snap.png"
+
+        screenshotone._download("https://api.example/take?url=x", output_path)
+
+        assert session.get.call_count == 2
+        assert output_path.read_bytes() == b"image bytes"
+        assert list(tmp_path.iterdir()) == [output_path]
+
+    def test_client_error_is_not_retried(self, session, tmp_path):
+        """Test that a 4xx other than 429 fails on the first attempt"""
+        session.get.return_value = _response(403)
+
+        with pytest.raises(requests.exceptions.HTTPError):
+            screenshotone._download("https://api.example/take?url=x", tmp_path / "snap.png")
+
+        assert session.get.call_count == 1
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestFetchUrls:
+    """Test suite for concurrent captures"""
+
+    def test_paths_follow_input_order(self, tmp_path, monkeypatch):
+        """Test that paths come back in the order of urls even when captures finish out of order"""
+        monkeypatch.setenv("SCREENSHOTONE_API_KEY", "test-key")
+        urls = [f"https://example.com/page{i}" for i in range(4)]
+        last_done = threading.Event()
+
+        def download(request_url, output_path):
+            # The first capture finishes only after the last one has
+            if request_url.endswith(quote_plus(urls[0])):
+                assert last_done.wait(timeout=5)
+            output_path.write_text(request_url)
+            if request_url.endswith(quote_plus(urls[-1])):
+                last_done.set()
+
+        with patch.object(screenshotone, "OUT_DIR", tmp_path), \
+             patch.object(screenshotone, "_download", side_effect=download):
+            paths = screenshotone.fetch_urls(urls)
+
+        assert [p.read_text().endswith(quote_plus(url)) for p, url in zip(paths, urls)] == [True] * 4
+        assert len(set(paths)) == 4
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -1,77 +1,169 @@
 # Web crawler for sitemap and web content ingestion (optional)
 
-from typing import List, Dict, Optional
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from html import unescape
+from itertools import islice
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+from xml.etree import ElementTree
 import requests
+from requests.adapters import HTTPAdapter
+from core.cache import LRUCache
+from core.logging import logger
 from urllib.parse import urljoin, urlparse
 from pathlib import Path
 
+try:
+    from selectolax.parser import HTMLParser  # C-level HTML parser
+except ImportError:  # optional dependency
+    HTMLParser = None
+
+# Regex fallback when selectolax is missing: one pass drops script/style/
+# noscript blocks and every other tag, instead of a pass per element type
+_TITLE_RE = re.compile(r'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+_MARKUP_RE = re.compile(r'<(script|style|noscript)\b.*?</\1\s*>|<[^>]*>', re.IGNORECASE | re.DOTALL)
+
 class WebCrawler:
     """
     Simple web crawler for ingesting web content.
     Can crawl sitemaps or individual URLs.
     """
     
-    def __init__(self, user_agent: str = "Vectorpenter/1.0"):
+    def __init__(self, user_agent: str = "Vectorpenter/1.0", max_workers: int = 16,
+                 max_cached_pages: int = 1024):
         self.user_agent = user_agent
+        self.max_workers = max_workers
         self.session = requests.Session()
         self.session.headers.update({"User-Agent": user_agent})
+        # Enough pooled connections per host for crawl_urls' workers
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # url -> (validator headers, extracted page) for conditional GETs; the
+        # least recently fetched pages are dropped so a long crawl stays bounded
+        self._pages = LRUCache(max_size=max_cached_pages)
     
-    def crawl_sitemap(self, sitemap_url: str) -> List[Dict]:
+    def crawl_sitemap(self, sitemap_url: str, _seen: Optional[Set[str]] = None) -> Iterator[Dict]:
         """
         Crawl a sitemap and extract URLs for content ingestion.
+        
+        The XML is parsed incrementally from the response stream and each
+        entry is yielded as soon as it is read, so memory stays flat however
+        large the sitemap is. Sitemap indexes are followed recursively.
         """
+        seen = _seen if _seen is not None else set()
+        seen.add(sitemap_url)
+        children = []
         try:
-            response = self.session.get(sitemap_url)
-            response.raise_for_status()
-            # TODO: Parse XML sitemap and extract URLs
-            # This is a placeholder implementation
-            return []
+            with self.session.get(sitemap_url, stream=True) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                root = None
+                for event, elem in ElementTree.iterparse(response.raw, events=("start", "end")):
+                    if root is None:
+                        root = elem
+                    if event != "end":
+                        continue
+                    tag = elem.tag.rsplit("}", 1)[-1]
+                    if tag not in ("url", "sitemap"):
+                        continue
+                    loc = (elem.findtext("{*}loc") or "").strip()
+                    if loc and tag == "url":
+                        yield {"url": loc, "lastmod": (elem.findtext("{*}lastmod") or "").strip() or None}
+                    elif loc and loc not in seen:
+                        children.append(loc)
+                    # Drop parsed entries so the tree never grows
+                    root.clear()
         except Exception as e:
-            print(f"Error crawling sitemap {sitemap_url}: {e}")
-            return []
+            logger.warning("Error crawling sitemap %s: %s", sitemap_url, e)
+        
+        for child in children:
+            if child not in seen:
+                yield from self.crawl_sitemap(child, seen)
+    
+    def crawl_urls(self, urls: Iterable[str]) -> Iterator[Dict]:
+        """
+        Fetch many pages concurrently, yielding each successful page as it completes.
+        
+        Page fetches are network-bound, so up to max_workers requests are in
+        flight at once over the session's connection pool. URLs are pulled
+        from the iterable only to keep 2 * max_workers fetches queued, so a
+        lazy source such as crawl_sitemap is never read ahead in full.
+        """
+        urls = iter(urls)
+        window = 2 * self.max_workers
+        fetched = failed = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="crawler") as pool:
+            pending = {pool.submit(self.fetch_page, url) for url in islice(urls, window)}
+            try:
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    # Refill before yielding so fetches continue while the caller works
+                    pending.update(pool.submit(self.fetch_page, url) for url in islice(urls, window - len(pending)))
+                    for future in done:
+                        page = future.result()
+                        if page is None:
+                            failed += 1
+                            continue
+                        fetched += 1
+                        yield page
+            finally:
+                # A caller that stops early leaves queued fetches unstarted
+                for future in pending:
+                    future.cancel()
+        logger.info("Crawled %d pages (%d failed)", fetched, failed)
     
     def fetch_page(self, url: str) -> Optional[Dict]:
         """
         Fetch a single web page and extract text content.
+        
+        Pages seen before are revalidated with If-None-Match/If-Modified-Since;
+        an unchanged page (304) is returned from memory without re-parsing.
         """
         try:
-            response = self.session.get(url)
+            validators, cached = self._pages.get(url) or ({}, None)
+            response = self.session.get(url, headers=validators)
+            if response.status_code == 304 and cached is not None:
+                return cached
             response.raise_for_status()
             
-            # Basic text extraction (could be enhanced with BeautifulSoup)
-            content = response.text
+            # Title and text come from a single parse of the page
+            title, text = self._extract(response.text)
             
-            return {
+            page = {
                 "url": url,
-                "title": self._extract_title(content),
-                "content": self._extract_text(content),
+                "title": title,
+                "content": text,
                 "metadata": {
                     "source": "web",
                     "url": url,
                     "status_code": response.status_code
                 }
             }
+            validators = {}
+            if response.headers.get("ETag"):
+                validators["If-None-Match"] = response.headers["ETag"]
+            if response.headers.get("Last-Modified"):
+                validators["If-Modified-Since"] = response.headers["Last-Modified"]
+            if validators:
+                self._pages.put(url, (validators, page))
+            return page
         except Exception as e:
-            print(f"Error fetching page {url}: {e}")
+            logger.warning("Error fetching page %s: %s", url, e)
             return None
     
-    def _extract_title(self, html: str) -> str:
-        """Extract title from HTML content."""
-        # Simple title extraction
-        import re
-        match = re.search(r'<title>(.*?)</title>', html, re.IGNORECASE)
-        return match.group(1) if match else ""
-    
-    def _extract_text(self, html: str) -> str:
-        """Extract text content from HTML."""
-        # TODO: Implement proper HTML text extraction
-        # This is a placeholder - would benefit from BeautifulSoup
-        import re
-        # Remove script and style elements
-        html = re.sub(r'<script.*?</script>', '', html, flags=re.DOTALL)
-        html = re.sub(r'<style.*?</style>', '', html, flags=re.DOTALL)
-        # Remove HTML tags
-        html = re.sub(r'<.*?>', '', html)
-        # Clean up whitespace
-        html = re.sub(r'\s+', ' ', html).strip()
-        return html
+    def _extract(self, html: str) -> Tuple[str, str]:
+        """Extract the title and whitespace-collapsed visible text from HTML."""
+        if HTMLParser is not None:
+            tree = HTMLParser(html)
+            title_node = tree.css_first("title")
+            title = title_node.text(strip=True) if title_node else ""
+            for node in tree.css("script, style, noscript"):
+                node.decompose()
+            root = tree.body or tree.root
+            text = root.text(separator=" ") if root else ""
+        else:
+            match = _TITLE_RE.search(html)
+            title = unescape(match.group(1).strip()) if match else ""
+            text = unescape(_MARKUP_RE.sub(" ", html))
+        return title, " ".join(text.split())
@@ -1,33 +1,115 @@
 # Gmail integration for email ingestion (optional)
-# This is a placeholder for future Gmail API integration
+# Requires google-api-python-client and an authorized-user token file
 
+import base64
 from typing import List, Dict, Optional
 import json
+from core.logging import logger
+
+try:
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build
+except ImportError:  # optional dependency
+    build = None
+
+_SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
+# Gmail accepts up to 100 calls per batch but rate-limits batches above 50
+_BATCH_SIZE = 50
+
 
 class GmailIngester:
     """
     Optional Gmail integration for ingesting emails.
     Requires Gmail API credentials and setup.
     """
-    
+
     def __init__(self, credentials_path: Optional[str] = None):
         self.credentials_path = credentials_path
-        # TODO: Initialize Gmail API client
-    
+        self._service = None
+
+    def _gmail(self):
+        """Gmail API client, authorized once and reused for every request"""
+        if self._service is None:
+            if build is None:
+                raise RuntimeError("google-api-python-client not installed")
+            if not self.credentials_path:
+                raise RuntimeError("Gmail credentials_path not configured")
+            creds = Credentials.from_authorized_user_file(self.credentials_path, _SCOPES)
+            if not creds.valid and creds.refresh_token:
+                creds.refresh(Request())
+            self._service = build("gmail", "v1", credentials=creds, cache_discovery=False)
+        return self._service
+
     def fetch_emails(self, query: str = "", max_results: int = 100) -> List[Dict]:
         """
         Fetch emails matching the given query.
         Returns list of email dictionaries with metadata.
+
+        Message bodies are fetched with batch requests, _BATCH_SIZE messages
+        per HTTP round-trip, rather than one request per message.
         """
-        # TODO: Implement Gmail API email fetching
-        # Placeholder implementation
-        return []
-    
+        try:
+            service = self._gmail()
+            ids: List[str] = []
+            page_token = None
+            while len(ids) < max_results:
+                resp = service.users().messages().list(
+                    userId="me", q=query, maxResults=min(500, max_results - len(ids)), pageToken=page_token
+                ).execute()
+                ids.extend(m["id"] for m in resp.get("messages", []))
+                page_token = resp.get("nextPageToken")
+                if not page_token:
+                    break
+            ids = ids[:max_results]
+
+            emails: Dict[str, Dict] = {}
+
+            def on_message(request_id, response, exception):
+                if exception is not None:
+                    logger.warning("Error fetching email %s: %s", request_id, exception)
+                else:
+                    emails[request_id] = self._parse_message(response)
+
+            for start in range(0, len(ids), _BATCH_SIZE):
+                batch = service.new_batch_http_request(callback=on_message)
+                for message_id in ids[start:start + _BATCH_SIZE]:
+                    batch.add(service.users().messages().get(userId="me", id=message_id, format="full"),
+                              request_id=message_id)
+                batch.execute()
+            return [emails[message_id] for message_id in ids if message_id in emails]
+        except Exception as e:
+            logger.warning("Error fetching emails for query %r: %s", query, e)
+            return []
+
+    def _parse_message(self, message: Dict) -> Dict:
+        """Flatten a Gmail API message into the fields extract_text uses"""
+        payload = message.get("payload", {})
+        headers = {h["name"].lower(): h["value"] for h in payload.get("headers", [])}
+        return {
+            "id": message.get("id"),
+            "thread_id": message.get("threadId"),
+            "subject": headers.get("subject", ""),
+            "from": headers.get("from", ""),
+            "date": headers.get("date", ""),
+            "snippet": message.get("snippet", ""),
+            "body": self._plain_text(payload),
+        }
+
+    def _plain_text(self, payload: Dict) -> str:
+        """First text/plain part of a (possibly multipart) message payload"""
+        if payload.get("mimeType") == "text/plain" and payload.get("body", {}).get("data"):
+            return base64.urlsafe_b64decode(payload["body"]["data"]).decode("utf-8", errors="replace")
+        for part in payload.get("parts", []):
+            text = self._plain_text(part)
+            if text:
+                return text
+        return ""
+
     def extract_text(self, email: Dict) -> str:
         """
         Extract text content from email for indexing.
         """
-        # TODO: Implement email text extraction
         subject = email.get("subject", "")
         body = email.get("body", "")
         return f"Subject: {subject}\n\n{body}"
@@ -5,21 +5,101 @@ Capture webpages as images/PDFs directly into data/inputs/
 
 from __future__ import annotations
 import os
+import shutil
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from urllib.parse import urlencode
+from typing import List, Tuple
+from urllib.parse import quote_plus, urlencode
 import requests
+from requests.adapters import HTTPAdapter
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 from core.logging import logger
 
 # Output directory for screenshots
 OUT_DIR = Path("data/inputs")
 
-def fetch_url(url: str) -> Path:
+# Supported capture options
+_FORMATS: Tuple[str, ...] = ("png", "jpeg", "pdf")
+_DEVICES: Tuple[str, ...] = ("desktop", "tablet", "mobile")
+
+# ScreenshotOne pricing (as of 2025)
+# Typically $0.001-$0.01 per screenshot depending on plan
+_COST_PER_SCREENSHOT = 0.005  # Average estimate
+
+# One pooled session keeps TLS connections to the API warm across captures
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=32))
+
+
+@lru_cache(maxsize=32)
+def _request_prefix(base_url: str, api_key: str, format_type: str, device: str,
+                    full_page: str, block_ads: str) -> str:
+    """Request URL up to the captured page's url parameter, encoded once per configuration"""
+    params = {
+        "access_key": api_key,
+        "format": format_type,
+        "device_scale_factor": 1,
+        "device": device,
+        "full_page": full_page,
+        "block_ads": block_ads,
+        "cache": "false",
+        "omit_background": "false",
+    }
+    return f"{base_url}?{urlencode(params)}&url="
+
+
+def _is_transient(exc: BaseException) -> bool:
+    """Rate limits, server errors and dropped connections are worth retrying"""
+    if isinstance(exc, requests.exceptions.HTTPError):
+        status = exc.response.status_code if exc.response is not None else 0
+        return status == 429 or status >= 500
+    return isinstance(exc, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=1, max=8),
+    retry=retry_if_exception(_is_transient),
+    reraise=True,
+)
+def _download(request_url: str, output_path: Path) -> None:
+    """
+    Stream the image/PDF straight to disk rather than buffering it
+    
+    Bytes land in a .part file that is renamed into place once complete, so
+    an interrupted capture never leaves a truncated file for ingestion.
+    """
+    partial = output_path.with_name(output_path.name + ".part")
+    try:
+        with _session.get(request_url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            with open(partial, "wb") as f:
+                shutil.copyfileobj(response.raw, f, length=1 << 16)
+        os.replace(partial, output_path)
+    finally:
+        partial.unlink(missing_ok=True)
+
+def fetch_url(
+    url: str,
+    *,
+    format_type: str | None = None,
+    device: str | None = None,
+    full_page: bool | None = None,
+    block_ads: bool | None = None,
+) -> Path:
     """
     Fetch a screenshot of a URL using ScreenshotOne API
     
     Args:
         url: URL to capture
+        format_type: Output format (png, jpeg, pdf); defaults to SCREENSHOTONE_FORMAT
+        device: Device type (desktop, tablet, mobile); defaults to SCREENSHOTONE_DEVICE
+        full_page: Capture the full scrollable page; defaults to SCREENSHOTONE_FULL_PAGE
+        block_ads: Block ads while rendering; defaults to SCREENSHOTONE_BLOCK_ADS
         
     Returns:
         Path to saved screenshot file
@@ -32,52 +112,38 @@ def fetch_url(url: str) -> Path:
     if not OUT_DIR.exists():
         OUT_DIR.mkdir(parents=True, exist_ok=True)
     
-    # Get configuration from environment
+    # Per-call options take precedence over environment configuration
     base_url = os.getenv("SCREENSHOTONE_BASE", "https://api.screenshotone.com/take")
     api_key = os.getenv("SCREENSHOTONE_API_KEY", "")
-    format_type = os.getenv("SCREENSHOTONE_FORMAT", "png")
-    device = os.getenv("SCREENSHOTONE_DEVICE", "desktop")
-    full_page = os.getenv("SCREENSHOTONE_FULL_PAGE", "true")
-    block_ads = os.getenv("SCREENSHOTONE_BLOCK_ADS", "true")
+    if format_type is None:
+        format_type = os.getenv("SCREENSHOTONE_FORMAT", "png")
+    if device is None:
+        device = os.getenv("SCREENSHOTONE_DEVICE", "desktop")
+    if full_page is None:
+        full_page = os.getenv("SCREENSHOTONE_FULL_PAGE", "true")
+    if block_ads is None:
+        block_ads = os.getenv("SCREENSHOTONE_BLOCK_ADS", "true")
     
     if not api_key:
         raise RuntimeError("SCREENSHOTONE_API_KEY missing. Set it in .env and enable USE_SCREENSHOTONE.")
     
-    # Prepare API parameters
-    params = {
-        "access_key": api_key,
-        "url": url,
-        "format": format_type,
-        "device_scale_factor": 1,
-        "device": device,
-        "full_page": str(full_page).lower(),
-        "block_ads": str(block_ads).lower(),
-        "cache": "false",
-        "omit_background": "false",
-    }
-    
-    # Build request URL
-    query_string = urlencode(params)
-    request_url = f"{base_url}?{query_string}"
+    # Build request URL; only the captured url differs between calls
+    request_url = _request_prefix(base_url, api_key, format_type, device,
+                                  str(full_page).lower(), str(block_ads).lower()) + quote_plus(url)
     
     logger.info(f"Capturing screenshot: {url} ({format_type}, {device})")
     logger.debug(f"ScreenshotOne request: {request_url}")
     
     try:
-        # Make API request
-        response = requests.get(request_url, timeout=60)
-        response.raise_for_status()
-        
-        # Generate output filename
+        # Generate output filename (unique even for concurrent captures)
         timestamp = int(time.time() * 1000)
         extension = "png" if format_type not in ("jpeg", "pdf") else format_type
-        output_path = OUT_DIR / f"snap_{timestamp}.{extension}"
+        output_path = OUT_DIR / f"snap_{timestamp}_{uuid.uuid4().hex[:8]}.{extension}"
         
         # Save screenshot
-        with open(output_path, "wb") as f:
-            f.write(response.content)
+        _download(request_url, output_path)
         
-        logger.info(f"Screenshot saved: {output_path} ({len(response.content)} bytes)")
+        logger.info(f"Screenshot saved: {output_path} ({output_path.stat().st_size} bytes)")
         return output_path
         
     except requests.exceptions.Timeout:
@@ -101,6 +167,26 @@ def fetch_url(url: str) -> Path:
         raise RuntimeError(error_msg)
 
 
+def fetch_urls(urls: List[str], *, max_workers: int = 16, **options) -> List[Path]:
+    """
+    Capture several URLs concurrently
+    
+    Rendering dominates each capture, so requests are issued from a thread
+    pool over the shared session; keyword options are passed to fetch_url.
+    
+    Args:
+        urls: URLs to capture
+        max_workers: Maximum concurrent captures
+        
+    Returns:
+        Paths to saved screenshot files, in the order of urls
+    """
+    if not urls:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls)), thread_name_prefix="screenshotone") as pool:
+        return list(pool.map(lambda url: fetch_url(url, **options), urls))
+
+
 def is_screenshotone_available() -> bool:
     """
     Check if ScreenshotOne is properly configured
@@ -114,18 +200,30 @@ def is_screenshotone_available() -> bool:
     return use_screenshotone and bool(api_key.strip())
 
 
+# Last successful connection test (monotonic time); failures are never cached
+_connection_ok_at: float | None = None
+_CONNECTION_TTL = 300
+
+
 def test_screenshotone_connection() -> bool:
     """
     Test ScreenshotOne API connection
     
+    A success is remembered for five minutes, so repeated checks (e.g. from
+    health endpoints) don't each cost a render round-trip.
+    
     Returns:
         True if connection successful, False otherwise
     """
+    global _connection_ok_at
     try:
         if not is_screenshotone_available():
             logger.warning("ScreenshotOne not properly configured")
             return False
         
+        if _connection_ok_at is not None and time.monotonic() - _connection_ok_at < _CONNECTION_TTL:
+            return True
+        
         # Test with a simple URL (use a reliable test page)
         test_url = "https://httpbin.org/html"
         
@@ -140,16 +238,17 @@ def test_screenshotone_connection() -> bool:
             "device": "desktop",
             "full_page": "false",  # Faster test
             "block_ads": "true",
-            "cache": "false"
+            "cache": "true"  # Served from ScreenshotOne's cache after the first render
         }
         
         query_string = urlencode(params)
         test_request_url = f"{base_url}?{query_string}"
         
-        response = requests.head(test_request_url, timeout=10)  # HEAD request for faster test
+        response = _session.head(test_request_url, timeout=10)  # HEAD request for faster test
         
         if response.status_code == 200:
             logger.info("ScreenshotOne connection successful")
+            _connection_ok_at = time.monotonic()
             return True
         else:
             logger.warning(f"ScreenshotOne test failed: HTTP {response.status_code}")
@@ -170,16 +269,10 @@ def estimate_screenshotone_cost(num_screenshots: int) -> dict:
     Returns:
         Dictionary with cost estimates
     """
-    # ScreenshotOne pricing (as of 2025)
-    # Typically $0.001-$0.01 per screenshot depending on plan
-    cost_per_screenshot = 0.005  # Average estimate
-    
-    total_cost = num_screenshots * cost_per_screenshot
-    
     return {
         "screenshots": num_screenshots,
-        "cost_per_screenshot": cost_per_screenshot,
-        "estimated_cost_usd": round(total_cost, 4),
+        "cost_per_screenshot": _COST_PER_SCREENSHOT,
+        "estimated_cost_usd": round(num_screenshots * _COST_PER_SCREENSHOT, 4),
         "note": "Estimates based on typical ScreenshotOne pricing (~$0.005/screenshot)"
     }
 
@@ -191,7 +284,7 @@ def get_screenshot_formats() -> List[str]:
     Returns:
         List of format strings
     """
-    return ["png", "jpeg", "pdf"]
+    return list(_FORMATS)
 
 
 def get_device_types() -> List[str]:
@@ -201,4 +294,4 @@ def get_device_types() -> List[str]:
     Returns:
         List of device type strings
     """
-    return ["desktop", "tablet", "mobile"]
+    return list(_DEVICES)